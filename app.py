@@ -104,20 +104,6 @@ def public_place_order():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-# ===== 公開 API：無需登入即可取得菜單 =====
-@app.route("/public_menus", methods=["GET"])
-def public_menus():
-    try:
-        menus = []
-        for doc in db.collection("menus").stream():
-            item = doc.to_dict() or {}
-            item["menu_id"] = doc.id
-            menus.append(item)
-        return jsonify({"menus": menus}), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-
 # ===== 主程式入口（本地執行；在 Render 由 gunicorn 啟動）=====
 if __name__ == "__main__":
     with app.test_request_context():
@@ -0,0 +1,58 @@
+# backfill_batch_store.py
+"""
+替舊的批次文件補上 store 欄位：
+  stores/{store}/ingredients/{id}/batches/{batch_id}.store = {store}
+
+stock_summary.store_snapshot() 用 collection_group("batches").where("store", "==", ...) 一次查整店批次，
+沒有 store 欄位的舊批次查不到。新建立的批次（新增 / 編輯 / 補貨 / 調貨）都已經會帶 store。
+
+⚠️ Firestore 需先建立 batches 的 collection group 複合索引：store ASC, status ASC
+  （第一次查詢失敗時錯誤訊息會附上建立索引的連結）
+
+用法：
+  python backfill_batch_store.py                 # 全部分店
+  python backfill_batch_store.py --store 芝山店   # 指定分店（可重複）
+  python backfill_batch_store.py --dry-run       # 只統計不寫入
+"""
+import argparse
+
+from firebase_config import db
+
+
+def backfill_store(store_name, dry_run=False):
+    print(f"▶ 處理分店：{store_name}")
+    pending = []
+    total = 0
+    for ing_ref in db.collection("stores").document(store_name).collection("ingredients").list_documents():
+        for b in ing_ref.collection("batches").stream():
+            total += 1
+            if (b.to_dict() or {}).get("store") != store_name:
+                pending.append(b.reference)
+
+    print(f"  ✔ 共 {total} 個批次，{len(pending)} 個需要補 store")
+    if dry_run or not pending:
+        return
+
+    batch = db.batch()
+    for i, ref in enumerate(pending, start=1):
+        batch.update(ref, {"store": store_name})
+        if i % 400 == 0:  # WriteBatch 上限 500
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    print(f"✅ {store_name}：已更新 {len(pending)} 個批次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="替舊的批次文件補上 store 欄位")
+    parser.add_argument("--store", action="append", help="只處理指定分店（可重複）")
+    parser.add_argument("--dry-run", action="store_true", help="只統計不寫入")
+    args = parser.parse_args()
+
+    stores = args.store or [ref.id for ref in db.collection("stores").list_documents()]
+    for store_name in stores:
+        backfill_store(store_name, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# backfill_rollups.py
+"""
+由 completed_orders 重建月 / 年彙總：
+  stores/{store}/months/{yyyymm}/monthly_summary/summary
+  stores/{store}/years/{yyyy}/yearly_summary/summary
+
+重建完成後把 stores/{store}/summary_meta/rollups.enabled_since 設為 00000000，
+之後所有整月 / 整年的查詢都直接讀彙總文件。
+
+用法：
+  python backfill_rollups.py                 # 全部分店
+  python backfill_rollups.py --store 芝山店   # 指定分店（可重複）
+  python backfill_rollups.py --dry-run       # 只印出結果不寫入
+
+⚠️ 重建會覆寫彙總文件，請在沒有人結帳的時段執行，避免執行期間完成的訂單被覆寫掉
+"""
+import argparse
+import re
+from collections import defaultdict
+
+from google.cloud import firestore
+
+from firebase_config import db
+from routes import summary_store
+
+
+def _empty():
+    return {
+        "revenue": 0,
+        "orders_count": 0,
+        "items_count": 0,
+        "flavor_counts": defaultdict(int),
+        "flavor_revenue": defaultdict(int),
+        "flavor_labels": {},
+    }
+
+
+def _add_order(totals, order_data):
+    total_price, total_qty, flavor_increments = summary_store.order_increments(order_data)
+    totals["revenue"] += int(total_price)
+    totals["orders_count"] += 1
+    totals["items_count"] += int(total_qty)
+    for mid, mname, qty, sub in flavor_increments:
+        totals["flavor_counts"][mid] += int(qty)
+        totals["flavor_revenue"][mid] += int(sub)
+        totals["flavor_labels"][mid] = mname
+
+
+def _as_doc(totals, base):
+    return {
+        **base,
+        "revenue": totals["revenue"],
+        "orders_count": totals["orders_count"],
+        "items_count": totals["items_count"],
+        "flavor_counts": dict(totals["flavor_counts"]),
+        "flavor_revenue": dict(totals["flavor_revenue"]),
+        "flavor_labels": dict(totals["flavor_labels"]),
+        "rebuilt_at": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def backfill_store(store_name, dry_run=False):
+    print(f"▶ 重建分店：{store_name}")
+    months = defaultdict(_empty)
+    years = defaultdict(_empty)
+
+    # dates/{ymd} 可能只有子集合沒有欄位，用 list_documents 才列得到
+    date_refs = db.collection("stores").document(store_name).collection("dates").list_documents()
+    for date_ref in date_refs:
+        ymd = date_ref.id
+        if not re.fullmatch(r"\d{8}", ymd):
+            continue
+        count = 0
+        for doc in date_ref.collection("completed_orders").stream():
+            order_data = doc.to_dict() or {}
+            _add_order(months[ymd[:6]], order_data)
+            _add_order(years[ymd[:4]], order_data)
+            count += 1
+        if count:
+            print(f"  ✔ {ymd}：{count} 筆")
+
+    for yyyymm, totals in sorted(months.items()):
+        print(f"  📅 {yyyymm} revenue={totals['revenue']} orders={totals['orders_count']}")
+    for yyyy, totals in sorted(years.items()):
+        print(f"  📆 {yyyy} revenue={totals['revenue']} orders={totals['orders_count']}")
+
+    if dry_run:
+        return
+
+    writes = [
+        (summary_store.monthly_summary_ref(store_name, yyyymm), _as_doc(totals, {"store": store_name, "monthKey": yyyymm}))
+        for yyyymm, totals in months.items()
+    ] + [
+        (summary_store.yearly_summary_ref(store_name, yyyy), _as_doc(totals, {"store": store_name, "year": yyyy}))
+        for yyyy, totals in years.items()
+    ]
+    # 分散式計數器：重建結果寫在第 0 片，其餘分片清掉
+    for yyyymm in months:
+        writes += [(ref, None) for ref in summary_store.all_shards(summary_store.monthly_summary_ref, store_name, yyyymm)[1:]]
+    for yyyy in years:
+        writes += [(ref, None) for ref in summary_store.all_shards(summary_store.yearly_summary_ref, store_name, yyyy)[1:]]
+
+    batch = db.batch()
+    for i, (ref, data) in enumerate(writes, start=1):
+        if data is None:
+            batch.delete(ref)
+        else:
+            batch.set(ref, data)
+        if i % 400 == 0:  # WriteBatch 上限 500
+            batch.commit()
+            batch = db.batch()
+    batch.set(summary_store.rollup_meta_ref(store_name),
+              {"enabled_since": summary_store.ROLLUPS_ALWAYS, "backfilled_at": firestore.SERVER_TIMESTAMP})
+    batch.commit()
+    print(f"✅ {store_name}：已寫入 {len(months)} 個月、{len(years)} 個年度彙總")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由 completed_orders 重建月 / 年彙總")
+    parser.add_argument("--store", action="append", help="只處理指定分店（可重複）")
+    parser.add_argument("--dry-run", action="store_true", help="只計算不寫入")
+    args = parser.parse_args()
+
+    stores = args.store or [ref.id for ref in db.collection("stores").list_documents()]
+    for store_name in stores:
+        backfill_store(store_name, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -53,6 +53,7 @@ def migrate_ingredient(doc):
         if "quantity" in data:
             new_batch_ref = batches_ref.document()
             new_batch_ref.set({
+                "store": STORE_ID,
                 "quantity": data.get("quantity", 0),
                 "expiration_date": data.get("expiration_date"),
                 "unit": data.get("unit"),
@@ -0,0 +1,86 @@
+# repair_stock_aggregates.py
+"""
+由 batches 重建食材文件上的庫存彙總：
+  stores/{store}/ingredients/{id}.stock = {in_use_sum, in_use_earliest, unused_sum, unused_earliest, batch_count}
+
+平常由扣庫存 / 補貨 / 新增 / 編輯 / 調貨在 transaction 內維護；
+第一次上線（舊資料沒有 stock 欄位）或懷疑彙總跟批次對不上時執行。
+每個食材各自用一個 transaction 讀批次、寫彙總，營業中執行也不會跟扣庫存互相覆蓋。
+
+用法：
+  python repair_stock_aggregates.py                 # 全部分店
+  python repair_stock_aggregates.py --store 芝山店   # 指定分店（可重複）
+  python repair_stock_aggregates.py --dry-run       # 只比對不寫入
+"""
+import argparse
+
+from google.cloud import firestore
+
+from firebase_config import db
+from routes import stock_summary
+
+_COMPARE_KEYS = ("in_use_sum", "in_use_earliest", "unused_sum", "unused_earliest", "batch_count")
+
+
+def _same(old, new):
+    if old is None:
+        return False
+    for k in _COMPARE_KEYS:
+        a, b = old.get(k), new.get(k)
+        if isinstance(a, float) or isinstance(b, float):
+            if abs(float(a or 0) - float(b or 0)) > 1e-6:
+                return False
+        elif a != b:
+            return False
+    return True
+
+
+def repair_ingredient(ing_ref, dry_run=False):
+    """回傳 (舊彙總, 新彙總)；食材不存在時回傳 (None, None)"""
+
+    @firestore.transactional
+    def _tx(transaction):
+        snap = ing_ref.get(transaction=transaction)
+        if not snap.exists:
+            return None, None
+        old = stock_summary.from_doc(snap.to_dict() or {})
+        new = stock_summary.summarize(stock_summary.read_active_batches_tx(transaction, ing_ref).values())
+        if not dry_run and not _same(old, new):
+            transaction.update(ing_ref, stock_summary.stock_update(new))
+        return old, new
+
+    return _tx(db.transaction())
+
+
+def repair_store(store_name, dry_run=False):
+    print(f"▶ 重建分店：{store_name}")
+    fixed = 0
+    total = 0
+    for ing_ref in db.collection("stores").document(store_name).collection("ingredients").list_documents():
+        old, new = repair_ingredient(ing_ref, dry_run=dry_run)
+        if new is None:
+            continue
+        total += 1
+        if _same(old, new):
+            continue
+        fixed += 1
+        if old is None:
+            print(f"  ✔ {ing_ref.id}：新增彙總 {new}")
+        else:
+            print(f"  ⚠️ {ing_ref.id}：{old} → {new}")
+    print(f"✅ {store_name}：{total} 項食材，{'需要' if dry_run else '已'}修正 {fixed} 項")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由 batches 重建食材庫存彙總")
+    parser.add_argument("--store", action="append", help="只處理指定分店（可重複）")
+    parser.add_argument("--dry-run", action="store_true", help="只比對不寫入")
+    args = parser.parse_args()
+
+    stores = args.store or [ref.id for ref in db.collection("stores").list_documents()]
+    for store_name in stores:
+        repair_store(store_name, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
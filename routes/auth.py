@@ -1,9 +1,14 @@
 import hashlib
 import jwt
 import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
 from flask import Blueprint, request, jsonify
 from firebase_config import db
 from functools import wraps
+from routes import http_cache
 
 auth_bp = Blueprint('auth', __name__)
 users_collection = "users"
@@ -12,15 +17,72 @@ users_collection = "users"
 JWT_SECRET = "your-secret-key"
 JWT_EXPIRE_MINUTES = 720
 
+# ✅ 驗證快取：(username, iat) → 使用者資料，短 TTL；token 內帶齊 profile claims 時完全不查 Firestore
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "1") == "1"
+# claims 只在 token 簽發後幾分鐘內採信；之後改走 _load_user（最晚 AUTH_CACHE_TTL 秒看到角色 / 分店變更）
+AUTH_CLAIMS_MAX_AGE = float(os.getenv("AUTH_CLAIMS_MAX_AGE", "5"))
+
+# token 內帶的使用者欄位（handler 只會用到這些）
+PROFILE_CLAIMS = ("role", "store_name", "store_ids", "address", "name", "latitude", "longitude", "geocoded_address")
+
+_user_cache = OrderedDict()   # (username, iat) -> (expires_at, profile)
+_user_cache_lock = threading.Lock()
+
 # ✅ 密碼雜湊
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 # ✅ 建立 JWT Token
 def generate_token(payload):
-    payload["exp"] = datetime.datetime.utcnow() + datetime.timedelta(minutes=JWT_EXPIRE_MINUTES)
+    now = datetime.datetime.utcnow()
+    payload["iat"] = now
+    payload["exp"] = now + datetime.timedelta(minutes=JWT_EXPIRE_MINUTES)
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
+# ✅ 驗證快取
+def _public_profile(user):
+    return {k: v for k, v in (user or {}).items() if k != "password_hash"}
+
+def _profile_from_claims(decoded):
+    """token 有 profile claims 且簽發未滿 AUTH_CLAIMS_MAX_AGE 分鐘時，直接用 claims 組出 request.user"""
+    if not AUTH_TRUST_TOKEN_CLAIMS or not decoded.get("profile"):
+        return None
+    iat = decoded.get("iat")
+    if not isinstance(iat, (int, float)) or time.time() - iat >= AUTH_CLAIMS_MAX_AGE * 60:
+        return None
+    profile = {"username": decoded["username"]}
+    profile.update({k: decoded[k] for k in PROFILE_CLAIMS if k in decoded})
+    return profile
+
+def _load_user(username, iat):
+    """(username, iat) LRU；過期或沒有才讀 Firestore。找不到使用者回 None"""
+    key = (username, iat)
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(key)
+        if hit and hit[0] > now:
+            _user_cache.move_to_end(key)
+            return dict(hit[1])
+
+    user_doc = db.collection(users_collection).document(username).get()
+    if not user_doc.exists:
+        return None
+    profile = _public_profile(user_doc.to_dict())
+    with _user_cache_lock:
+        _user_cache[key] = (now + AUTH_CACHE_TTL, profile)
+        _user_cache.move_to_end(key)
+        while len(_user_cache) > AUTH_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return dict(profile)
+
+def invalidate_user(username):
+    """使用者資料變更後呼叫：清掉本行程的快取（token claims 最晚 AUTH_CLAIMS_MAX_AGE 分鐘後不再採信）"""
+    with _user_cache_lock:
+        for key in [k for k in _user_cache if k[0] == username]:
+            _user_cache.pop(key, None)
+
 # ✅ 驗證 Token 的裝飾器（支援 request.user）
 def token_required(f):
     @wraps(f)
@@ -32,6 +94,10 @@ def token_required(f):
             if auth_header.startswith("Bearer "):
                 token = auth_header.split(" ")[1]
 
+        # 瀏覽器的 EventSource 不能帶 header：只有 SSE 請求接受 ?token=
+        if not token and "text/event-stream" in request.headers.get("Accept", ""):
+            token = request.args.get("token")
+
         if not token:
             return jsonify({"error": "缺少 Token，請重新登入"}), 401
 
@@ -42,11 +108,11 @@ def token_required(f):
             if not username:
                 return jsonify({"error": "Token 無效：缺少 username"}), 401
 
-            user_doc = db.collection(users_collection).document(username).get()
-            if not user_doc.exists:
+            user = _profile_from_claims(decoded) or _load_user(username, decoded.get("iat"))
+            if user is None:
                 return jsonify({"error": "找不到使用者"}), 404
 
-            request.user = user_doc.to_dict()  # 附加到 request
+            request.user = user  # 附加到 request
         except jwt.ExpiredSignatureError:
             return jsonify({"error": "Token 已過期"}), 401
         except jwt.InvalidTokenError:
@@ -104,6 +170,7 @@ def signup():
                 store_ref.set({
                     "created": True
                 })
+                http_cache.invalidate("stores")
 
         db.collection(users_collection).document(username).set(user_data)
 
@@ -137,10 +204,14 @@ def signin():
         else:
             store_ids = [user.get("store_name")]
 
+        # profile claims 一起放進 token，之後的 API 不必再查 users
+        claims = {k: user[k] for k in PROFILE_CLAIMS if user.get(k) is not None}
         token = generate_token({
+            **claims,
             "username": user["username"],
             "role": role,
-            "store_ids": store_ids
+            "store_ids": store_ids,
+            "profile": 1,
         })
 
         return jsonify({
@@ -156,11 +227,18 @@ def signin():
         return jsonify({"error": str(e)}), 500
     
 # ✅ 公開取得所有分店名稱（給顧客端）
+def _store_list_payload():
+    stores_ref = db.collection('stores').stream()
+    return {"store_names": sorted(doc.id for doc in stores_ref)}
+
+def store_exists(store_name):
+    """公開 API 用：分店名稱是否存在（跟 /stores 共用同一份快取）"""
+    _, payload = http_cache.cached_payload("stores", _store_list_payload)
+    return store_name in payload["store_names"]
+
 @auth_bp.route('/stores', methods=['GET'])
 def public_get_store_list():
     try:
-        stores_ref = db.collection('stores').stream()
-        store_names = [doc.id for doc in stores_ref]
-        return jsonify({"store_names": sorted(store_names)}), 200
+        return http_cache.cached_json("stores", _store_list_payload)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
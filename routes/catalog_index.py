@@ -0,0 +1,239 @@
+# routes/catalog_index.py
+"""
+行程內（per-process）索引：
+- 食譜：依 doc id / menu_id / name 查 recipes（根目錄或分店層級）
+- 食材：各分店「正規化名稱 → ingredient doc id / unit」
+- 菜單：menus 整個集合（約 10 筆）常駐，附內容雜湊版本號給 ETag 用；
+  快取冷掉時，下單計價只用一次 get_all 抓該筆訂單用到的 menu_id，並在背景重建
+
+第一次使用時整個集合讀一次建索引，之後以 TTL 過期重建；
+本行程內的新增/修改/刪除 API 會呼叫 invalidate_* 立即失效，
+其他 worker 則最晚在 TTL 後看到新資料（查不到時也會提早重建一次）。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from firebase_config import db
+
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "300"))
+# 查不到時允許提早重建的最短間隔，避免打錯名稱時每次都整批重讀
+CATALOG_MISS_REFRESH_SECONDS = float(os.getenv("CATALOG_MISS_REFRESH_SECONDS", "10"))
+# 菜單價格可能隨時調整，TTL 較短
+MENU_TTL_SECONDS = float(os.getenv("MENU_TTL_SECONDS", "60"))
+
+_lock = threading.RLock()
+_recipe_indexes: Dict[Optional[str], Dict[str, Any]] = {}      # scope(None=根 recipes / 店名) -> index
+_ingredient_indexes: Dict[str, Dict[str, Any]] = {}            # store -> index
+_menu_index: Optional[Dict[str, Any]] = None
+_menu_refreshing = threading.Event()
+
+
+def normalize_name(name: Any) -> str:
+    return str(name or "").strip().lower()
+
+
+def _expired(index: Optional[Dict[str, Any]]) -> bool:
+    return index is None or (time.monotonic() - index["loaded_at"]) > CATALOG_TTL_SECONDS
+
+
+def _can_refresh_on_miss(index: Dict[str, Any]) -> bool:
+    return (time.monotonic() - index["loaded_at"]) > CATALOG_MISS_REFRESH_SECONDS
+
+
+# =========================
+# 食譜索引
+# =========================
+def _recipes_col(store: Optional[str]):
+    if store:
+        return db.collection("stores").document(store).collection("recipes")
+    return db.collection("recipes")
+
+
+def _build_recipe_index(store: Optional[str]) -> Dict[str, Any]:
+    by_id: Dict[str, dict] = {}
+    by_menu_id: Dict[str, str] = {}
+    by_name: Dict[str, str] = {}
+    for doc in _recipes_col(store).stream():
+        data = doc.to_dict() or {}
+        by_id[doc.id] = data
+        # 對應舊版 where("menu_id"/"name", "==", ...) 查詢；同值保留第一筆
+        if data.get("menu_id") is not None:
+            by_menu_id.setdefault(str(data["menu_id"]), doc.id)
+        if isinstance(data.get("name"), str):
+            by_name.setdefault(data["name"], doc.id)
+    print(f"[catalog_index] recipes 索引已建立 scope={store or '/'} count={len(by_id)}")
+    return {"loaded_at": time.monotonic(), "by_id": by_id, "by_menu_id": by_menu_id, "by_name": by_name}
+
+
+def _recipe_index(store: Optional[str], force: bool = False) -> Dict[str, Any]:
+    with _lock:
+        index = _recipe_indexes.get(store)
+        if force or _expired(index):
+            index = _build_recipe_index(store)
+            _recipe_indexes[store] = index
+        return index
+
+
+def _lookup_recipe(index: Dict[str, Any], menu_id: Any, menu_name: Any) -> Optional[Tuple[str, dict]]:
+    # 順序與原本相同：recipes/{menu_id} → recipes/{menu_name} → where menu_id → where name
+    candidates = []
+    if menu_id:
+        candidates.append(str(menu_id))
+    if menu_name:
+        candidates.append(str(menu_name))
+    if menu_id and str(menu_id) in index["by_menu_id"]:
+        candidates.append(index["by_menu_id"][str(menu_id)])
+    if menu_name and menu_name in index["by_name"]:
+        candidates.append(index["by_name"][menu_name])
+
+    for doc_id in candidates:
+        if doc_id in index["by_id"]:
+            return doc_id, index["by_id"][doc_id]
+    return None
+
+
+def get_recipe(menu_id: Any = None, menu_name: Any = None, store: Optional[str] = None) -> Optional[Tuple[str, dict]]:
+    """回傳 (recipe_doc_id, recipe_data)；找不到回 None。store=None 代表根目錄 recipes"""
+    index = _recipe_index(store)
+    found = _lookup_recipe(index, menu_id, menu_name)
+    if found is None and _can_refresh_on_miss(index):
+        found = _lookup_recipe(_recipe_index(store, force=True), menu_id, menu_name)
+    return found
+
+
+def invalidate_recipes(store: Optional[str] = None) -> None:
+    with _lock:
+        _recipe_indexes.pop(store, None)
+
+
+# =========================
+# 食材名稱索引（分店層級）
+# =========================
+def _build_ingredient_index(store: str) -> Dict[str, Any]:
+    by_name: Dict[str, Dict[str, Any]] = {}
+    col = db.collection("stores").document(store).collection("ingredients")
+    for doc in col.stream():
+        data = doc.to_dict() or {}
+        key = normalize_name(data.get("name"))
+        if not key:
+            continue
+        by_name.setdefault(key, {"id": doc.id, "name": data.get("name"), "unit": data.get("unit")})
+    print(f"[catalog_index] ingredients 索引已建立 store={store} count={len(by_name)}")
+    return {"loaded_at": time.monotonic(), "by_name": by_name}
+
+
+def _ingredient_index(store: str, force: bool = False) -> Dict[str, Any]:
+    with _lock:
+        index = _ingredient_indexes.get(store)
+        if force or _expired(index):
+            index = _build_ingredient_index(store)
+            _ingredient_indexes[store] = index
+        return index
+
+
+def get_ingredient(store: str, name: Any) -> Optional[Dict[str, Any]]:
+    """回傳 {"id", "name", "unit"}；名稱比對忽略前後空白與大小寫"""
+    key = normalize_name(name)
+    if not store or not key:
+        return None
+    index = _ingredient_index(store)
+    found = index["by_name"].get(key)
+    if found is None and _can_refresh_on_miss(index):
+        found = _ingredient_index(store, force=True)["by_name"].get(key)
+    return dict(found) if found else None
+
+
+def get_ingredient_doc_id(store: str, name: Any) -> Optional[str]:
+    found = get_ingredient(store, name)
+    return found["id"] if found else None
+
+
+def invalidate_ingredients(store: Optional[str] = None) -> None:
+    """store=None 代表清空所有分店"""
+    with _lock:
+        if store is None:
+            _ingredient_indexes.clear()
+        else:
+            _ingredient_indexes.pop(store, None)
+
+
+# =========================
+# 菜單快取
+# =========================
+def _menu_version(by_id: Dict[str, dict]) -> str:
+    raw = json.dumps(sorted(by_id.items()), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _build_menu_index() -> Dict[str, Any]:
+    by_id = {doc.id: (doc.to_dict() or {}) for doc in db.collection("menus").stream()}
+    print(f"[catalog_index] menus 快取已建立 count={len(by_id)}")
+    return {"loaded_at": time.monotonic(), "by_id": by_id, "version": _menu_version(by_id)}
+
+
+def _menu_expired(index: Optional[Dict[str, Any]]) -> bool:
+    return index is None or (time.monotonic() - index["loaded_at"]) > MENU_TTL_SECONDS
+
+
+def _menus(force: bool = False) -> Dict[str, Any]:
+    global _menu_index
+    with _lock:
+        if force or _menu_expired(_menu_index):
+            _menu_index = _build_menu_index()
+        return _menu_index
+
+
+def _refresh_menus_in_background() -> None:
+    if _menu_refreshing.is_set():
+        return
+    _menu_refreshing.set()
+
+    def _run():
+        try:
+            _menus()
+        except Exception as e:
+            print(f"[catalog_index] menus 背景重建失敗：{e}")
+        finally:
+            _menu_refreshing.clear()
+
+    threading.Thread(target=_run, name="menu-cache-refresh", daemon=True).start()
+
+
+def get_menus() -> Tuple[str, List[Tuple[str, dict]]]:
+    """回傳 (version, [(menu_id, data), ...])；data 為複本，可自由修改"""
+    index = _menus()
+    return index["version"], [(mid, dict(data)) for mid, data in index["by_id"].items()]
+
+
+def get_menu_items(menu_ids: Iterable[Any]) -> Dict[str, dict]:
+    """
+    下單計價用：{menu_id: data}，找不到的 id 不會出現在結果裡
+    - 快取有效：直接從記憶體取（查不到時允許提早重建一次）
+    - 快取冷掉 / 過期：一次 get_all 抓這些 id，並在背景重建整份快取
+    """
+    ids = [str(m) for m in dict.fromkeys(menu_ids) if m]
+    if not ids:
+        return {}
+
+    index = _menu_index
+    if _menu_expired(index):
+        refs = [db.collection("menus").document(mid) for mid in ids]
+        found = {snap.id: (snap.to_dict() or {}) for snap in db.get_all(refs) if snap.exists}
+        _refresh_menus_in_background()
+        return found
+
+    found = {mid: dict(index["by_id"][mid]) for mid in ids if mid in index["by_id"]}
+    if len(found) < len(ids) and (time.monotonic() - index["loaded_at"]) > CATALOG_MISS_REFRESH_SECONDS:
+        index = _menus(force=True)
+        found = {mid: dict(index["by_id"][mid]) for mid in ids if mid in index["by_id"]}
+    return found
+
+
+def invalidate_menus() -> None:
+    global _menu_index
+    with _lock:
+        _menu_index = None
@@ -0,0 +1,96 @@
+# routes/fanout.py
+"""
+共用的有上限執行緒池：把多個互不相依的 I/O 呼叫（Firestore / 外部 API）同時送出
+
+- 整個行程共用一個 ThreadPoolExecutor（FANOUT_MAX_WORKERS），多個 request 同時進來也不會無限開執行緒
+- run_all() 等到 deadline 為止；來不及的呼叫回 default 並列在 timed_out，丟例外的列在 errors
+  （逾時的呼叫不會被強制中斷，會在背景跑完後被丟棄）
+- iter_completed() 依完成順序逐一交出結果，適合邊算邊回傳（串流）的 API
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "16"))
+FANOUT_DEFAULT_TIMEOUT = float(os.getenv("FANOUT_DEFAULT_TIMEOUT", "10"))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="fanout")
+
+# iter_completed() 對逾時的 key 回傳的 error
+TIMED_OUT = "timed out"
+
+
+class FanoutResult:
+    def __init__(self):
+        self.values: Dict[Hashable, Any] = {}
+        self.errors: Dict[Hashable, str] = {}
+        self.timed_out: List[Hashable] = []
+        self.elapsed_seconds = 0.0
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.errors or self.timed_out)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+
+def iter_completed(tasks: Dict[Hashable, Callable[[], Any]],
+                   timeout: Optional[float] = None) -> Iterator[Tuple[Hashable, Any, Optional[str]]]:
+    """
+    同時執行 tasks（key → 無參數函式），依完成順序 yield (key, value, error)：
+    成功 error 為 None；丟例外時 value 為 None、error 為例外訊息；
+    到 timeout 還沒完成的 key 最後一起以 error=TIMED_OUT 交出。
+    呼叫端中途停止迭代（例如串流被中斷）時，還沒開始跑的呼叫會被取消。
+    """
+    timeout = FANOUT_DEFAULT_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+
+    futures = {_executor.submit(fn): key for key, fn in tasks.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                key = futures[fut]
+                try:
+                    value = fut.result()
+                except Exception as e:
+                    yield key, None, str(e)
+                else:
+                    yield key, value, None
+
+        timed_out, pending = pending, set()
+        for fut in timed_out:
+            fut.cancel()  # 還沒開始跑的直接取消，已在跑的放它在背景結束
+            yield futures[fut], None, TIMED_OUT
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+def run_all(tasks: Dict[Hashable, Callable[[], Any]], timeout: Optional[float] = None,
+            default: Any = None) -> FanoutResult:
+    """
+    同時執行 tasks（key → 無參數函式），最多等 timeout 秒。
+    成功的結果放 values；例外放 errors（key → 訊息）；逾時的 key 放 timed_out，values 填 default。
+    """
+    result = FanoutResult()
+    t0 = time.monotonic()
+
+    for key, value, error in iter_completed(tasks, timeout):
+        if error is None:
+            result.values[key] = value
+            continue
+        if error is TIMED_OUT:
+            result.timed_out.append(key)
+        else:
+            result.errors[key] = error
+        result.values[key] = default
+
+    result.elapsed_seconds = time.monotonic() - t0
+    return result
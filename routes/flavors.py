@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from firebase_config import db
 from routes.auth import token_required
+from routes import http_cache
 
 
 flavors_bp = Blueprint('flavors', __name__)
@@ -15,6 +16,7 @@ def add_flavor():
         if not data.get("name") or "ingredients" not in data:
             return jsonify({"error": "缺少必要字段"}), 400
         doc_ref = db.collection(flavors_collection).add(data)
+        http_cache.invalidate("flavors")
         return jsonify({"message": "口味新增成功", "doc_id": doc_ref[1].id})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -26,6 +28,7 @@ def update_flavor(flavor_id):
     try:
         data = request.get_json()
         db.collection(flavors_collection).document(flavor_id).update(data)
+        http_cache.invalidate("flavors")
         return jsonify({"message": "口味更新成功"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -36,6 +39,7 @@ def update_flavor(flavor_id):
 def delete_flavor(flavor_id):
     try:
         db.collection(flavors_collection).document(flavor_id).delete()
+        http_cache.invalidate("flavors")
         return jsonify({"message": "口味刪除成功"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -45,8 +49,9 @@ def delete_flavor(flavor_id):
 @token_required
 def get_flavors():
     try:
-        flavors_ref = db.collection(flavors_collection).stream()
-        flavors = [{"id": flavor.id, **flavor.to_dict()} for flavor in flavors_ref]
-        return jsonify({"flavors": flavors}), 200
+        def _build():
+            flavors_ref = db.collection(flavors_collection).stream()
+            return {"flavors": [{"id": flavor.id, **flavor.to_dict()} for flavor in flavors_ref]}
+        return http_cache.cached_json("flavors", _build, private=True)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
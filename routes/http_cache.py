@@ -0,0 +1,68 @@
+# routes/http_cache.py
+"""
+讀多寫少的目錄型 API（菜單 / 口味 / 配方 / 分店清單）的回應快取
+
+- cached_json()：回應內容在行程內快取 RESPONSE_CACHE_TTL 秒，ETag = 內容雜湊；
+  瀏覽器帶 If-None-Match 且內容沒變時回 304，不重送內容、也不讀 Firestore
+- 對應的新增 / 修改 / 刪除 API 呼叫 invalidate(key) 立即失效（其他 worker 最晚 TTL 後更新）
+- Cache-Control：公開資料允許前端 / CDN 快取 PUBLIC_MAX_AGE 秒；需登入的資料為 private 並每次帶 ETag 重新驗證
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from flask import jsonify, request
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+PUBLIC_MAX_AGE = int(os.getenv("PUBLIC_MAX_AGE", "30"))
+
+_lock = threading.Lock()
+_entries: Dict[str, Dict[str, Any]] = {}
+
+
+def content_etag(payload: Any) -> str:
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def etag_json(payload, etag: str, private: bool = False, max_age: Optional[int] = None):
+    """
+    jsonify(payload) 並加上 ETag / Cache-Control；If-None-Match 相符時轉成 304
+    private=True：需要登入的資料，只允許瀏覽器快取，不給共用 proxy 快取
+    注意：直接 return 這個 response，不要再包成 (resp, 200)，否則 304 會被蓋掉
+    """
+    if max_age is None:
+        max_age = 0 if private else PUBLIC_MAX_AGE
+    resp = jsonify(payload)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = f"{'private' if private else 'public'}, max-age={int(max_age)}, must-revalidate"
+    return resp.make_conditional(request)
+
+
+def cached_payload(key: str, build: Callable[[], Any], ttl: float = RESPONSE_CACHE_TTL):
+    """回傳 (etag, payload)；快取過期才呼叫 build()"""
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry["expires_at"] > now:
+            return entry["etag"], entry["payload"]
+
+    payload = build()
+    etag = f"{key}-{content_etag(payload)}"
+    with _lock:
+        _entries[key] = {"payload": payload, "etag": etag, "expires_at": now + ttl}
+    return etag, payload
+
+
+def cached_json(key: str, build: Callable[[], Any], private: bool = False,
+                max_age: Optional[int] = None, ttl: float = RESPONSE_CACHE_TTL):
+    etag, payload = cached_payload(key, build, ttl)
+    return etag_json(payload, etag, private=private, max_age=max_age)
+
+
+def invalidate(key: str) -> None:
+    with _lock:
+        _entries.pop(key, None)
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from firebase_config import db
 from routes.auth import token_required
+from routes import catalog_index, stock_summary
 from google.cloud import firestore
 from datetime import datetime, timedelta, date
 from zoneinfo import ZoneInfo
@@ -46,40 +47,6 @@ def taipei_today_str(dt_utc: Optional[datetime] = None) -> str:
     return (dt_utc + timedelta(hours=8)).strftime("%Y%m%d")
 
 
-def _parse_exp_date(val: Any) -> Optional[date]:
-    """把 expiration_date 轉成 date 方便比較（支援 string / datetime / firestore timestamp dict）"""
-    if val is None:
-        return None
-
-    if isinstance(val, date) and not isinstance(val, datetime):
-        return val
-
-    if isinstance(val, datetime):
-        return val.date()
-
-    if isinstance(val, str):
-        s = val.strip()
-        if not s:
-            return None
-        try:
-            return datetime.strptime(s[:10], "%Y-%m-%d").date()
-        except Exception:
-            try:
-                return datetime.strptime(s[:10], "%Y/%m/%d").date()
-            except Exception:
-                return None
-
-    if isinstance(val, dict):
-        sec = val.get("seconds") or val.get("_seconds")
-        if sec is not None:
-            try:
-                return datetime.utcfromtimestamp(int(sec)).date()
-            except Exception:
-                return None
-
-    return None
-
-
 def _safe_float(v: Any, default: float = 0.0) -> float:
     try:
         if v is None:
@@ -96,57 +63,38 @@ def _to_int(v: Any) -> int:
         return 0
 
 
-def _sum_batches_and_earliest(ing_ref) -> Tuple[float, Optional[date], float, Optional[date], bool]:
+def _sum_batches_and_earliest(agg: Optional[Dict[str, Any]]) -> Tuple[float, Optional[date], float, Optional[date], bool]:
     """
-    回傳：
+    把 stock_summary.read_store() 的彙總轉成：
       (in_use_sum, in_use_earliest, unused_sum, unused_earliest, has_any_batches)
     """
-    in_use_sum = 0.0
-    unused_sum = 0.0
-    in_use_earliest = None
-    unused_earliest = None
-    has_any = False
-
-    try:
-        docs = ing_ref.collection("batches").where("status", "in", ["in_use", "unused"]).stream()
-        for b in docs:
-            has_any = True
-            bd = b.to_dict() or {}
-            status = bd.get("status")
-            qty = _safe_float(bd.get("quantity", 0), 0.0)
-            exp = _parse_exp_date(bd.get("expiration_date"))
-
-            if status == "in_use":
-                in_use_sum += qty
-                if exp and (in_use_earliest is None or exp < in_use_earliest):
-                    in_use_earliest = exp
-            elif status == "unused":
-                unused_sum += qty
-                if exp and (unused_earliest is None or exp < unused_earliest):
-                    unused_earliest = exp
-    except Exception as e:
-        print("read batches error:", e)
-
-    return in_use_sum, in_use_earliest, unused_sum, unused_earliest, has_any
+    agg = agg or stock_summary.empty()
+    return (
+        agg["in_use_sum"],
+        stock_summary.parse_exp_date(agg["in_use_earliest"]),
+        agg["unused_sum"],
+        stock_summary.parse_exp_date(agg["unused_earliest"]),
+        agg["batch_count"] > 0,
+    )
 
 
-def _ensure_in_use_batch(ing_ref, unit: Optional[str], price: Optional[float], qty: float, exp_date: Optional[str]) -> str:
+def _ensure_in_use_batch_tx(transaction, store_name: str, ing_ref, ing: Dict[str, Any], unit: Optional[str],
+                            price: Optional[float], qty: float, exp_date: Optional[str]) -> Tuple[str, Dict[str, Any]]:
     """
-    確保該食材至少有一個 in_use 批次：
+    確保該食材至少有一個 in_use 批次（transaction 內，呼叫前不能有寫入）：
     - 若有 current_batch_id 且該批存在 → 更新它
-    - 否則建立新的 in_use 批次並回傳 batch_id
+    - 否則建立新的 in_use 批次
+    回傳 (batch_id, 寫入後的批次資料)
     """
-    ing_snap = ing_ref.get()
-    ing = ing_snap.to_dict() or {}
     current_batch_id = ing.get("current_batch_id")
 
     batches_col = ing_ref.collection("batches")
 
     if current_batch_id:
         b_ref = batches_col.document(current_batch_id)
-        b_snap = b_ref.get()
+        b_snap = b_ref.get(transaction=transaction)
         if b_snap.exists:
-            upd = {"status": "in_use"}
+            upd = {"status": "in_use", "store": store_name}
             if qty is not None:
                 upd["quantity"] = float(qty)
             if unit:
@@ -155,12 +103,13 @@ def _ensure_in_use_batch(ing_ref, unit: Optional[str], price: Optional[float], q
                 upd["expiration_date"] = exp_date
             if price is not None:
                 upd["price"] = float(price)
-            b_ref.update(upd)
-            return current_batch_id
+            transaction.update(b_ref, upd)
+            return current_batch_id, {**(b_snap.to_dict() or {}), **upd}
 
     # 沒 current 或找不到 → 新建
     b_ref = batches_col.document()
-    b_ref.set({
+    b_data = {
+        "store": store_name,
         "created_at": firestore.SERVER_TIMESTAMP,
         "status": "in_use",
         "quantity": float(qty),
@@ -169,8 +118,9 @@ def _ensure_in_use_batch(ing_ref, unit: Optional[str], price: Optional[float], q
         "expiration_date": exp_date,
         "price": float(price) if price is not None else float(ing.get("price", 0) or 0),
         "note": "init/edited as in_use",
-    })
-    return b_ref.id
+    }
+    transaction.set(b_ref, b_data)
+    return b_ref.id, b_data
 
 
 # ==========================
@@ -184,19 +134,20 @@ def get_ingredients():
     - 使用中庫存：sum(batches.status == in_use)
     - 預備庫存：sum(batches.status == unused)
     - 效期：各自取最早 expiration_date
+    （都讀食材文件上的 stock 彙總，整份列表只讀一次集合；舊資料另補一次整店批次查詢）
     輸出皆為整數（你前端要整數）
     """
     try:
         store_name = request.user.get("store_name")
         base_col = db.collection("stores").document(store_name).collection("ingredients")
         ing_snaps = list(base_col.stream())
+        aggs = stock_summary.read_store(db, store_name, ing_snaps)
 
         ingredients = []
         for ing in ing_snaps:
             data = ing.to_dict() or {}
-            ing_ref = base_col.document(ing.id)
 
-            in_use_sum, in_use_earliest, unused_sum, unused_earliest, has_batches = _sum_batches_and_earliest(ing_ref)
+            in_use_sum, in_use_earliest, unused_sum, unused_earliest, has_batches = _sum_batches_and_earliest(aggs.get(ing.id))
 
             # 以批次為準；若完全沒 batches（舊資料）才 fallback 父文件
             if has_batches:
@@ -211,6 +162,8 @@ def get_ingredients():
                 data["quantity"] = current_qty_int
                 # expiration_date 保留父文件（可能是舊資料）
 
+            data.pop(stock_summary.STOCK_FIELD, None)
+
             # 預備庫存欄位
             data["reserved_quantity"] = int(round(unused_sum))
             data["reserved_expiration_date"] = unused_earliest.isoformat() if unused_earliest else None
@@ -251,8 +204,8 @@ def add_ingredient():
         qty = float(data["quantity"])
         exp_date = data.get("expiration_date")
 
-        # 先建父文件（父文件只當「快速顯示」；真正以 batches 為準）
-        ing_ref.set({
+        # 父文件只當「快速顯示」；真正以 batches 為準。父文件 + 初始批次用同一個 WriteBatch 寫入
+        parent = {
             "name": name,
             "unit": unit,
             "price": price,
@@ -261,12 +214,15 @@ def add_ingredient():
             "current_batch_id": None,
             "current_quantity": int(round(max(qty, 0))),
             "quantity": int(round(max(qty, 0))),
-        })
+        }
+        batches: List[Dict[str, Any]] = []
+        writer = db.batch()
 
         # 建立 in_use 初始批次（qty<=0 就不建）
         if qty > 0:
             b_ref = ing_ref.collection("batches").document()
-            b_ref.set({
+            b_data = {
+                "store": store_name,
                 "created_at": firestore.SERVER_TIMESTAMP,
                 "status": "in_use",
                 "quantity": float(qty),
@@ -275,15 +231,18 @@ def add_ingredient():
                 "expiration_date": exp_date,
                 "price": float(price),
                 "note": "init batch (in_use) from add_ingredient",
-            })
-            ing_ref.update({
+            }
+            writer.set(b_ref, b_data)
+            batches.append(b_data)
+            parent.update({
                 "current_batch_id": b_ref.id,
-                "current_quantity": int(round(qty)),
-                "quantity": int(round(qty)),
                 "expiration_date": exp_date,  # 父文件顯示用
-                "status": "in_stock",
             })
 
+        writer.set(ing_ref, {**parent, **stock_summary.stock_update(stock_summary.summarize(batches))})
+        writer.commit()
+
+        catalog_index.invalidate_ingredients(store_name)
         return jsonify({"message": "新增成功"}), 200
 
     except Exception as e:
@@ -327,19 +286,35 @@ def update_ingredient(ingredient_id):
             qty = float(qty_val) if qty_val is not None else 0.0
             unit = upd_parent.get("unit") or normalize_unit((snap.to_dict() or {}).get("unit"))
             price = upd_parent.get("price")
-            # 確保有 in_use 批次可改
-            batch_id = _ensure_in_use_batch(ing_ref, unit=unit, price=price, qty=qty, exp_date=exp_date)
-
-            upd_parent["current_batch_id"] = batch_id
-            upd_parent["current_quantity"] = int(round(max(qty, 0)))
-            upd_parent["quantity"] = int(round(max(qty, 0)))
-            if exp_date is not None:
-                upd_parent["expiration_date"] = exp_date
-            upd_parent["status"] = "in_stock" if qty > 0 else "out_of_stock"
 
-        if upd_parent:
+            # 批次與父文件（含庫存彙總）在同一個 transaction 裡更新
+            @firestore.transactional
+            def _tx(transaction):
+                ing = ing_ref.get(transaction=transaction).to_dict() or {}
+                active = stock_summary.read_active_batches_tx(transaction, ing_ref)
+                # 確保有 in_use 批次可改
+                batch_id, batch_data = _ensure_in_use_batch_tx(
+                    transaction, store_name, ing_ref, ing, unit=unit, price=price, qty=qty, exp_date=exp_date
+                )
+                active[batch_id] = batch_data
+
+                upd = dict(upd_parent)
+                upd["current_batch_id"] = batch_id
+                upd["current_quantity"] = int(round(max(qty, 0)))
+                upd["quantity"] = int(round(max(qty, 0)))
+                if exp_date is not None:
+                    upd["expiration_date"] = exp_date
+                upd["status"] = "in_stock" if qty > 0 else "out_of_stock"
+                upd.update(stock_summary.stock_update(stock_summary.summarize(active.values())))
+                transaction.update(ing_ref, upd)
+
+            _tx(db.transaction())
+        elif upd_parent:
             ing_ref.update(upd_parent)
 
+        if "name" in payload or "unit" in payload:
+            catalog_index.invalidate_ingredients(store_name)
+
         return jsonify({"message": "更新成功"}), 200
 
     except Exception as e:
@@ -372,6 +347,7 @@ def delete_ingredient(ingredient_id):
             batch_writer.commit()
 
         ing_ref.delete()
+        catalog_index.invalidate_ingredients(store_name)
         return jsonify({"message": "刪除成功"}), 200
 
     except Exception as e:
@@ -420,8 +396,10 @@ def restock_ingredients():
             unit_norm = normalize_unit(unit or ing.get("unit"))
             price = float(ing.get("price", 0) or 0)
 
-            # 建立新的 unused 批次（預備庫存）
-            ing_ref.collection("batches").add({
+            # 建立新的 unused 批次（預備庫存），同一個 transaction 更新庫存彙總
+            b_ref = ing_ref.collection("batches").document()
+            b_data = {
+                "store": store_name,
                 "quantity": float(add_qty_float),
                 "original_quantity": float(add_qty_float),
                 "unit": unit_norm,
@@ -431,13 +409,23 @@ def restock_ingredients():
                 "restock_record": True,
                 "note": "restock -> unused",
                 "price": price,
-            })
+            }
+
+            @firestore.transactional
+            def _tx(transaction):
+                cur = ing_ref.get(transaction=transaction).to_dict() or {}
+                agg = stock_summary.load_tx(transaction, ing_ref, cur)
+                transaction.set(b_ref, b_data)
 
-            # 父文件只做「狀態保險」：有備用不代表有使用中，但至少不要卡在奇怪狀態
-            # 若原本完全沒 current_batch_id 且 current_quantity == 0，仍維持 out_of_stock（等自動切批次時再轉 in_use）
-            # 這邊不強行改 current_quantity
-            if ing.get("status") not in ("in_stock", "out_of_stock"):
-                ing_ref.update({"status": "in_stock" if float(ing.get("current_quantity", 0) or 0) > 0 else "out_of_stock"})
+                upd = stock_summary.stock_update(stock_summary.add_batch(agg, "unused", add_qty_float, exp_date))
+                # 父文件只做「狀態保險」：有備用不代表有使用中，但至少不要卡在奇怪狀態
+                # 若原本完全沒 current_batch_id 且 current_quantity == 0，仍維持 out_of_stock（等自動切批次時再轉 in_use）
+                # 這邊不強行改 current_quantity
+                if cur.get("status") not in ("in_stock", "out_of_stock"):
+                    upd["status"] = "in_stock" if float(cur.get("current_quantity", 0) or 0) > 0 else "out_of_stock"
+                transaction.update(ing_ref, upd)
+
+            _tx(db.transaction())
 
         return jsonify({"message": "補貨完成"}), 200
 
@@ -502,36 +490,23 @@ def _refresh_for_store_today(store_name: str) -> Tuple[Dict[str, float], int, st
             except Exception:
                 qty = 1.0
 
-            recipe_doc = (
-                db.collection("stores")
-                .document(store_name)
-                .collection("recipes")
-                .document(menu_name)
-                .get()
-            )
-            if not recipe_doc.exists:
+            found = catalog_index.get_recipe(menu_name=menu_name, store=store_name)
+            if not found:
                 continue
 
-            recipe = recipe_doc.to_dict() or {}
+            _, recipe = found
 
             for ing_name, detail in recipe.items():
+                if not isinstance(detail, dict):
+                    continue
                 amount = float(detail.get("amount", 0) or 0)
                 recipe_unit = normalize_unit(detail.get("unit"))
 
-                ing_query = (
-                    db.collection("stores")
-                    .document(store_name)
-                    .collection("ingredients")
-                    .where("name", "==", ing_name)
-                    .limit(1)
-                    .stream()
-                )
-                ing_doc = next(ing_query, None)
-                if not ing_doc:
+                ing_info = catalog_index.get_ingredient(store_name, ing_name)
+                if not ing_info:
                     continue
 
-                ing_data = ing_doc.to_dict() or {}
-                ingredient_unit = normalize_unit(ing_data.get("unit"))
+                ingredient_unit = normalize_unit(ing_info.get("unit"))
 
                 if recipe_unit != ingredient_unit:
                     adj = convert_amount(ingredient_unit, recipe_unit, amount)
@@ -544,7 +519,7 @@ def _refresh_for_store_today(store_name: str) -> Tuple[Dict[str, float], int, st
                     db.collection("stores")
                     .document(store_name)
                     .collection("ingredients")
-                    .document(ing_doc.id)
+                    .document(ing_info["id"])
                 )
 
                 snap = ing_ref.get()
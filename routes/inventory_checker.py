@@ -1,6 +1,8 @@
 # routes/inventory_checker.py
 from flask import Blueprint, request, jsonify
 from routes.auth import token_required
+from routes.utils_geo import geocode_for_user
+from routes import stock_summary
 
 # --- 天氣改用 REST 版 ---
 try:
@@ -8,14 +10,14 @@ try:
 except Exception:
     from weather_from_rest import fetch_weather_from_rest  # 後備匯入路徑
 
-from tool.lstm_predict_all import forecast_next_sales, load_models_and_data
+from tool.lstm_predict_all import forecast_all_sales, load_models_and_data, get_history
+from tool import model_registry, forecast_cache
 from tool.firebase_fetcher import fetch_recipes
 from tool.ingredient_demand import calculate_total_demand
 
 from firebase_config import db
 
 import os
-import requests
 import traceback
 from datetime import datetime, timedelta, timezone, date
 from typing import Any, Dict, List, Optional, Tuple
@@ -23,65 +25,15 @@ from typing import Any, Dict, List, Optional, Tuple
 
 inventory_bp = Blueprint("inventory", __name__)
 
-# -------------------------------
-# 地址 → GPS（Google → OSM fallback）
-# -------------------------------
-def geocode_address(address: str) -> Tuple[float, float]:
-    """
-    優先用 Google Geocoding；失敗才退回 OpenStreetMap。
-    需在環境變數設定 GOOGLE_API_KEY。
-    """
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if api_key:
-        try:
-            g_url = "https://maps.googleapis.com/maps/api/geocode/json"
-            params = {
-                "address": address,
-                "region": "tw",
-                "language": "zh-TW",
-                "key": api_key,
-            }
-            r = requests.get(g_url, params=params, timeout=8)
-            r.raise_for_status()
-            data = r.json()
-            if data.get("status") == "OK" and data.get("results"):
-                loc = data["results"][0]["geometry"]["location"]
-                lat, lon = float(loc["lat"]), float(loc["lng"])
-                print(f"📍(Google) 地址轉換成功：{address} → ({lat}, {lon})")
-                return lat, lon
-            else:
-                print(f"⚠️(Google) geocode 失敗：{data.get('status')}")
-        except Exception as e:
-            print(f"❌(Google) 地址轉換例外：{e}")
+# 同一地點（約 1 公里格）的天氣預報共用時間（秒）
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "1800"))
 
-    # --- Fallback：OpenStreetMap Nominatim ---
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            "q": address,
-            "format": "json",
-            "limit": 1,
-            "countrycodes": "tw",
-            "accept-language": "zh-TW",
-        }
-        r = requests.get(
-            url,
-            params=params,
-            headers={"User-Agent": "yaoyao-backend/1.0"},
-            timeout=8,
-        )
-        r.raise_for_status()
-        data = r.json()
-        if data:
-            lat = float(data[0]["lat"])
-            lon = float(data[0]["lon"])
-            print(f"📍(OSM) 地址轉換成功：{address} → ({lat}, {lon})")
-            return lat, lon
-    except Exception as e:
-        print(f"❌(OSM) 地址轉換失敗：{e}")
+# MODEL_WARMUP=1 時在 worker 啟動就把模型載入常駐，第一個 /check_inventory 不用等
+if os.getenv("MODEL_WARMUP", "0") == "1":
+    load_models_and_data()
 
-    # 兩者都失敗：給台北市政府附近座標，避免整個流程中斷
-    return 25.0375, 121.5637
+# 兩種 geocoder 都失敗時的座標（台北市政府附近），避免整個流程中斷
+FALLBACK_LATLON = (25.0375, 121.5637)
 
 
 # -------------------------------
@@ -185,15 +137,18 @@ def fetch_ingredient_inventory_batches(store_name: str) -> Dict[str, Dict[str, A
       - 可用庫存 = sum(batches where status in ["in_use","unused"])
       - 最早效期 = 在上述可用批次中，挑最早的 expiration_date
       - 如果某食材沒有 batches（舊資料），fallback 用父文件 quantity/expiration_date
+    兩者都直接讀食材文件上的 stock 彙總（routes/stock_summary.py），整店只讀一次食材集合
+    （舊資料沒有彙總時再補一次整店 collection_group 批次查詢）
     """
     inv: Dict[str, Dict[str, Any]] = {}
 
-    ingredients = (
+    ingredients = list(
         db.collection("stores")
           .document(store_name)
           .collection("ingredients")
           .stream()
     )
+    aggs = stock_summary.read_store(db, store_name, ingredients)
 
     for ing_doc in ingredients:
         ing = ing_doc.to_dict() or {}
@@ -204,29 +159,12 @@ def fetch_ingredient_inventory_batches(store_name: str) -> Dict[str, Dict[str, A
         key = name.upper()
         unit = ing.get("unit")
 
-        # 1) 優先看 batches（新結構）
-        batches_col = ing_doc.reference.collection("batches")
-
-        total = 0.0
-        earliest: Optional[date] = None
-        has_any_batch = False
-
-        try:
-            # Firestore 沒有 in() 在所有 SDK 都一致保證，這裡用兩次查詢最穩
-            for st in ("in_use", "unused"):
-                for b in batches_col.where("status", "==", st).stream():
-                    has_any_batch = True
-                    bd = b.to_dict() or {}
-                    qty = float(bd.get("quantity", 0) or 0)
-                    if qty > 0:
-                        total += qty
-
-                    exp = parse_to_date(bd.get("expiration_date"))
-                    if exp:
-                        earliest = exp if (earliest is None or exp < earliest) else earliest
-        except Exception:
-            # 批次讀取失敗：退回父文件
-            has_any_batch = False
+        # 1) 優先看庫存彙總（批次讀取失敗時不會有 agg）
+        agg = aggs.get(ing_doc.id)
+        has_any_batch = bool(agg and agg["batch_count"] > 0)
+        if has_any_batch:
+            total = stock_summary.available(agg)
+            earliest = parse_to_date(stock_summary.earliest(agg))
 
         # 2) 若沒有任何 batch，就 fallback 父文件（支援舊資料）
         if not has_any_batch:
@@ -257,25 +195,33 @@ def check_inventory():
         if not store_name:
             return jsonify({"error": "使用者未設定店家 store_name"}), 400
 
-        # 1) GPS
-        lat, lon = geocode_address(address)
+        # 1) GPS（優先用 user 文件上的座標，其次 geo_cache，最後才打外部 API）
+        lat, lon = geocode_for_user(request.user)
+        if lat is None:
+            lat, lon = FALLBACK_LATLON
 
-        # 2) 天氣（給需求預測用）
-        forecast_data = fetch_weather_from_rest(lat, lon)
+        # 2) 天氣（給需求預測用）；同一地點在 WEATHER_CACHE_TTL 內共用
+        weather_key = forecast_cache.make_key("weather", lat=round(lat, 2), lon=round(lon, 2))
+        forecast_data = forecast_cache.get_or_compute(
+            weather_key, lambda: fetch_weather_from_rest(lat, lon), ttl=WEATHER_CACHE_TTL
+        )
         if not forecast_data:
             return jsonify({"error": "氣象資料取得失敗"}), 400
 
-        # 3) 載入模型與資料
-        models, scalers, pivot_df, flavors = load_models_and_data()
+        # 3) 預測快取 key：口味集合 + 歷史最後日期 + 今天 + 天氣 + 模型版本
+        pivot_df, flavors = get_history()
+        cache_key = forecast_cache.forecast_key(
+            flavors, pivot_df.index[-1], taipei_today(), forecast_data, model_registry.model_version(flavors)
+        )
+
+        # 4) 預測未來需求（把 3 個時段的預測量加總）；快取沒有才載模型推論
+        #    所有口味一次組輸入，同架構模型合併成一次推論
+        def _predict() -> Dict[str, float]:
+            models, scalers, pivot_df, flavors = load_models_and_data()
+            forecasts = forecast_all_sales(flavors, pivot_df, models, scalers, forecast_data)
+            return {flavor: float(sum(y_pred)) for flavor, y_pred in forecasts.items()}
 
-        # 4) 預測未來需求（把 3 個時段的預測量加總）
-        predicted_sales: Dict[str, float] = {}
-        for flavor in flavors:
-            model = models.get(flavor)
-            scaler = scalers.get(flavor)
-            if model and scaler:
-                y_pred = forecast_next_sales(flavor, pivot_df, model, scaler, forecast_data)
-                predicted_sales[flavor] = float(sum(y_pred))
+        predicted_sales: Dict[str, float] = forecast_cache.get_or_compute(cache_key, _predict)
 
         # 5) ✅ 取庫存/食譜 + 計算需求（庫存改成 batches 總量）
         inventory = fetch_ingredient_inventory_batches(store_name)
@@ -376,3 +322,33 @@ def check_inventory():
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
+
+
+# -------------------------------
+# 模型常駐快取：狀態 / 熱更新
+# -------------------------------
+@inventory_bp.route("/model_registry/stats", methods=["GET"])
+@token_required
+def model_registry_stats():
+    if request.user.get("role") not in ("developer", "superadmin"):
+        return jsonify({"error": "無權限"}), 403
+    return jsonify({**model_registry.stats(), "forecast_cache": forecast_cache.stats()}), 200
+
+
+@inventory_bp.route("/model_registry/reload", methods=["POST"])
+@token_required
+def model_registry_reload():
+    if request.user.get("role") not in ("developer", "superadmin"):
+        return jsonify({"error": "無權限"}), 403
+    try:
+        data = request.get_json(silent=True) or {}
+        if data.get("all"):
+            model_registry.reload()
+            changed = ["*"]
+        else:
+            changed = model_registry.reload_if_changed(force=True)
+        if data.get("clear_forecast_cache"):
+            forecast_cache.clear()
+        return jsonify({"reloaded": changed}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from firebase_config import db
 from routes.auth import token_required
+from routes import catalog_index
+from routes.http_cache import etag_json
 
 
 menus_bp = Blueprint('menus', __name__)
@@ -11,9 +13,10 @@ menus_collection = "menus"
 @token_required
 def get_menus():
     try:
-        menus_ref = db.collection(menus_collection).stream()
-        menus = [{"id": doc.id, **doc.to_dict()} for doc in menus_ref]
-        return jsonify({"menus": menus}), 200
+        # 走行程內菜單快取；內容沒變時回 304
+        version, items = catalog_index.get_menus()
+        menus = [{"id": menu_id, **data} for menu_id, data in items]
+        return etag_json({"menus": menus}, f"menus-{version}", private=True)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -27,6 +30,7 @@ def add_menu():
             return jsonify({"error": "缺少 name 或 price"}), 400
 
         db.collection(menus_collection).add(data)
+        catalog_index.invalidate_menus()
         return jsonify({"message": "菜單新增成功"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -38,6 +42,7 @@ def update_menu(menu_id):
     try:
         data = request.get_json()
         db.collection(menus_collection).document(menu_id).update(data)
+        catalog_index.invalidate_menus()
         return jsonify({"message": "菜單更新成功"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -48,6 +53,7 @@ def update_menu(menu_id):
 def delete_menu(menu_id):
     try:
         db.collection(menus_collection).document(menu_id).delete()
+        catalog_index.invalidate_menus()
         return jsonify({"message": "菜單刪除成功"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -56,8 +62,8 @@ def delete_menu(menu_id):
 @menus_bp.route('/public_menus', methods=['GET'])
 def public_menus():
     try:
-        menus_ref = db.collection(menus_collection).stream()
-        menus = [{"menu_id": doc.id, **doc.to_dict()} for doc in menus_ref]
-        return jsonify({"menus": menus}), 200
+        version, items = catalog_index.get_menus()
+        menus = [{"menu_id": menu_id, **data} for menu_id, data in items]
+        return etag_json({"menus": menus}, f"public-menus-{version}")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
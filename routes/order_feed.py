@@ -0,0 +1,385 @@
+# routes/order_feed.py
+"""
+待處理訂單即時動態（每個 worker 每家分店共用一個 Firestore on_snapshot 監聽）
+
+- 第一次用到時對 stores/{store}/orders 開監聽，之後所有連線共用同一份記憶體佇列，
+  不論有幾個店員畫面 / 顧客在等，Firestore 讀取量都只有一個監聽的量
+- 每次變動給一個遞增版本號，最近 ORDER_FEED_BUFFER 筆異動（added / modified / removed）保留在記憶體，
+  斷線重連帶上次的版本號（SSE 的 Last-Event-ID）就能只補差異；太舊時改送完整快照
+- 版本號只在同一個監聽內有意義：每個監聽另有 epoch（pid + 亂數），版本號都搭配 epoch 使用，
+  重連到別的 worker、或監聽閒置關閉後重建時 epoch 不同 → 一律送完整快照
+- 沒有訂閱者、也 ORDER_FEED_IDLE_SECONDS 秒沒被查詢時關閉監聽
+- 監聽因錯誤中止時，下一次訂閱 / 等待會重新建立監聽（新 epoch，訂閱者收到完整快照）
+
+顧客查進度（order_status / wait_order_status）：
+- 還在佇列裡 → 訂單上的 status；等待中的連線依 (分店, 訂單 id) 各自等，只有自己那張訂單有異動才會被喚醒
+- 離開佇列（完成與刪除 pending 在同一個 transaction）→ 只讀 completed_orders/{ymd}-{order_number}
+  （撞號時的 {ymd}-{order_number}-{order_id}）那幾份文件確認是否完成，結果記在記憶體，同一張訂單只讀一次
+- 監聽啟動前就離開佇列的訂單，用一次 where("order_id") limit 1 查當天完成訂單；沒有就是 not_found
+- 監聽沒看過的 id 查到 not_found 可能只是剛下單、新增還沒送到：等待時 ORDER_STATUS_NOT_FOUND_GRACE 秒內不回 not_found；
+  監聽看到該訂單新增 / 離開佇列時清掉記住的結果
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_config import db
+
+ORDER_FEED_BUFFER = max(1, int(os.getenv("ORDER_FEED_BUFFER", "500")))
+ORDER_FEED_IDLE_SECONDS = float(os.getenv("ORDER_FEED_IDLE_SECONDS", "60"))
+ORDER_FEED_READY_TIMEOUT = float(os.getenv("ORDER_FEED_READY_TIMEOUT", "10"))
+# 查無訂單（not_found）的結果記多久；期間同一個 id 不再查 Firestore
+ORDER_STATUS_NEGATIVE_TTL = float(os.getenv("ORDER_STATUS_NEGATIVE_TTL", "30"))
+# 監聽沒看過的 id 查不到時，等待中的連線最多再等幾秒才當成 not_found（剛下單時監聽可能還沒收到）
+ORDER_STATUS_NOT_FOUND_GRACE = float(os.getenv("ORDER_STATUS_NOT_FOUND_GRACE", "5"))
+
+_lock = threading.Lock()
+_feeds: Dict[str, Dict[str, Any]] = {}   # store -> feed
+
+# 顧客等單一訂單狀態：(store, order_id) -> {"cond", "waiters"}
+_watch_lock = threading.Lock()
+_order_watches: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+# 離開佇列的訂單查到的結果：(store, order_id) -> (過期時間 或 None=不會再變, 狀態)
+_resolved_lock = threading.Lock()
+_resolved: "OrderedDict[Tuple[str, str], Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+
+
+def _valid(data: Dict[str, Any]) -> bool:
+    # 跟 get_orders 一樣，沒有 items 的文件不算訂單
+    return isinstance((data or {}).get("items"), list)
+
+
+def _order_dict(doc) -> Dict[str, Any]:
+    data = doc.to_dict() or {}
+    data["id"] = doc.id
+    return data
+
+
+def _notify_orders(store_name: str, order_ids) -> None:
+    """只喚醒在等這幾張訂單的連線"""
+    with _watch_lock:
+        watches = [_order_watches.get((store_name, oid)) for oid in order_ids]
+    for watch in watches:
+        if watch is not None:
+            with watch["cond"]:
+                watch["cond"].notify_all()
+
+
+def _on_snapshot(feed: Dict[str, Any], changes) -> None:
+    """Firestore 監聽執行緒呼叫：更新佇列、記錄差異、喚醒等待中的連線"""
+    changed = []
+    with feed["cond"]:
+        if feed["closed"]:
+            return
+        first = not feed["ready"].is_set()
+        for change in changes:
+            doc = change.document
+            if change.type.name == "REMOVED" or not _valid(doc.to_dict() or {}):
+                old = feed["orders"].pop(doc.id, None)
+                if old is None:
+                    continue
+                feed["removed"][doc.id] = old
+                while len(feed["removed"]) > ORDER_FEED_BUFFER:
+                    feed["removed"].popitem(last=False)
+                event = {"type": "removed", "id": doc.id}
+            else:
+                order = _order_dict(doc)
+                existed = doc.id in feed["orders"]
+                feed["orders"][doc.id] = order
+                feed["removed"].pop(doc.id, None)
+                event = {"type": "modified" if existed else "added", "id": doc.id, "order": order}
+            changed.append(doc.id)
+            if not first:
+                feed["version"] += 1
+                feed["events"].append((feed["version"], event))
+        if first:
+            # 初始快照只建立佇列，不當成差異送出
+            feed["version"] += 1
+            feed["events"].clear()
+            feed["base_version"] = feed["version"]
+            feed["ready"].set()
+        feed["cond"].notify_all()
+
+    # 之前查到的 not_found 不再成立：先清掉再喚醒，被喚醒的連線會重查
+    with _resolved_lock:
+        for oid in changed:
+            _resolved.pop((feed["store"], oid), None)
+    _notify_orders(feed["store"], changed)
+
+
+def _start(store_name: str) -> Dict[str, Any]:
+    feed = {
+        "store": store_name,
+        "epoch": f"{os.getpid()}-{secrets.token_hex(4)}",
+        "orders": {},
+        "removed": OrderedDict(),   # 最近離開佇列的訂單 id -> 最後資料（查完成副本用）
+        "version": 0,
+        "base_version": 0,      # 保留的差異從這個版本之後開始
+        "events": deque(maxlen=ORDER_FEED_BUFFER),
+        "cond": threading.Condition(),
+        "ready": threading.Event(),
+        "subscribers": 0,
+        "idle_timer": None,
+        "last_used": time.monotonic(),
+        "watch": None,
+        "closed": False,
+    }
+    query = db.collection("stores").document(store_name).collection("orders").order_by("created_at")
+    feed["watch"] = query.on_snapshot(lambda docs, changes, read_time: _on_snapshot(feed, changes))
+    print(f"✅ 訂單監聽啟動：{store_name}")
+    return feed
+
+
+def _stop(feed: Dict[str, Any]) -> None:
+    with feed["cond"]:
+        feed["closed"] = True
+        feed["cond"].notify_all()
+    try:
+        feed["watch"].unsubscribe()
+    except Exception as e:
+        print(f"⚠️ 關閉訂單監聽失敗（{feed['store']}）：{e}")
+
+
+def _alive(feed: Dict[str, Any]) -> bool:
+    watch = feed["watch"]
+    return not feed["closed"] and getattr(watch, "is_active", True) is not False
+
+
+def _feed(store_name: str) -> Dict[str, Any]:
+    """取得（必要時建立 / 重建）分店的監聽；呼叫端需持有 _lock"""
+    feed = _feeds.get(store_name)
+    if feed is not None and _alive(feed):
+        return feed
+
+    subscribers = 0
+    if feed is not None:
+        print(f"⚠️ 訂單監聽已中止，重新建立：{store_name}")
+        if feed["idle_timer"] is not None:
+            feed["idle_timer"].cancel()
+        _stop(feed)
+        subscribers = feed["subscribers"]
+
+    feed = _start(store_name)
+    feed["subscribers"] = subscribers
+    _feeds[store_name] = feed
+    return feed
+
+
+def _schedule_idle_check(store_name: str, feed: Dict[str, Any], delay: float) -> None:
+    """呼叫端需持有 _lock"""
+    if feed["idle_timer"] is not None:
+        return
+    timer = threading.Timer(delay, _stop_if_idle, args=(store_name, feed))
+    timer.daemon = True
+    feed["idle_timer"] = timer
+    timer.start()
+
+
+def _stop_if_idle(store_name: str, feed: Dict[str, Any]) -> None:
+    with _lock:
+        feed["idle_timer"] = None
+        if _feeds.get(store_name) is not feed or feed["subscribers"] > 0:
+            return
+        remaining = ORDER_FEED_IDLE_SECONDS - (time.monotonic() - feed["last_used"])
+        if remaining > 0:
+            _schedule_idle_check(store_name, feed, remaining)
+            return
+        _feeds.pop(store_name, None)
+    _stop(feed)
+    print(f"✅ 訂單監聽關閉（閒置）：{store_name}")
+
+
+def subscribe(store_name: str) -> None:
+    with _lock:
+        feed = _feed(store_name)
+        feed["subscribers"] += 1
+        if feed["idle_timer"] is not None:
+            feed["idle_timer"].cancel()
+            feed["idle_timer"] = None
+
+
+def unsubscribe(store_name: str) -> None:
+    with _lock:
+        feed = _feeds.get(store_name)
+        if feed is None:
+            return
+        feed["subscribers"] = max(0, feed["subscribers"] - 1)
+        feed["last_used"] = time.monotonic()
+        if feed["subscribers"] == 0:
+            _schedule_idle_check(store_name, feed, ORDER_FEED_IDLE_SECONDS)
+
+
+def _current(store_name: str) -> Dict[str, Any]:
+    feed = _feeds.get(store_name)
+    if feed is not None and _alive(feed):
+        # 常見情況不拿全域鎖；last_used 只是閒置判斷用，競爭寫入無妨
+        feed["last_used"] = time.monotonic()
+    else:
+        with _lock:
+            feed = _feed(store_name)
+            feed["last_used"] = time.monotonic()
+    if feed["subscribers"] == 0 and feed["idle_timer"] is None:
+        # 沒訂閱的單次查詢（例如長輪詢）也共用監聽，閒置後自動關閉
+        with _lock:
+            _schedule_idle_check(store_name, feed, ORDER_FEED_IDLE_SECONDS)
+    if not feed["ready"].wait(ORDER_FEED_READY_TIMEOUT):
+        raise TimeoutError(f"訂單監聽逾時：{store_name}")
+    return feed
+
+
+def _sorted_orders(feed: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # 依建立時間排（同 get_orders）；沒有 created_at 的排最後
+    return sorted(
+        feed["orders"].values(),
+        key=lambda o: (o.get("created_at") is None, str(o.get("created_at") or ""), o["id"]),
+    )
+
+
+def snapshot(store_name: str) -> Tuple[str, int, List[Dict[str, Any]]]:
+    """(epoch, 版本號, 依建立時間排序的待處理訂單)"""
+    feed = _current(store_name)
+    with feed["cond"]:
+        return feed["epoch"], feed["version"], _sorted_orders(feed)
+
+
+def wait_events(store_name: str, epoch: str, since: int,
+                timeout: float) -> Tuple[str, int, Optional[List[Dict[str, Any]]]]:
+    """
+    等 (epoch, since) 之後的異動，最多 timeout 秒。回傳 (epoch, 最新版本號, 差異 list)
+    - 差異 list 為 [] 表示逾時沒有異動
+    - 為 None 表示 epoch 不是目前的監聽、或 since 已不在保留範圍，呼叫端要改送完整快照
+    """
+    feed = _current(store_name)
+    with feed["cond"]:
+        if epoch != feed["epoch"]:
+            return feed["epoch"], feed["version"], None
+        if feed["version"] == since:
+            feed["cond"].wait_for(lambda: feed["version"] != since or feed["closed"], timeout)
+        if feed["closed"] and feed["version"] == since:
+            return epoch, since, []
+        if since > feed["version"] or since < feed["base_version"]:
+            return epoch, feed["version"], None
+        oldest = feed["events"][0][0] if feed["events"] else feed["version"] + 1
+        if since + 1 < oldest and since != feed["version"]:
+            return epoch, feed["version"], None
+        return epoch, feed["version"], [event for version, event in feed["events"] if version > since]
+
+
+# =========================
+# 顧客查單一訂單狀態
+# =========================
+def _taipei_ymd(dt: datetime) -> str:
+    # created_at 存 UTC，完成訂單以台灣日期分目錄
+    return (dt + timedelta(hours=8)).strftime("%Y%m%d")
+
+
+def _status(order_id: str, order_number: Any, status: str) -> Dict[str, Any]:
+    return {"order_id": order_id, "order_number": order_number, "status": status}
+
+
+def _completed_col(store_name: str, ymd: str):
+    return db.collection("stores").document(store_name).collection("dates").document(ymd).collection("completed_orders")
+
+
+def _find_completed(store_name: str, order_id: str, last: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """離開佇列的訂單：確認有沒有完成副本（只讀那幾份文件；不知道號碼時查一次 order_id）"""
+    today = _taipei_ymd(datetime.utcnow())
+    if last is not None and last.get("order_number") is not None:
+        days = [today]
+        created = last.get("created_at")
+        if hasattr(created, "strftime"):
+            days.append(_taipei_ymd(created.replace(tzinfo=None)))
+        refs = []
+        for ymd in dict.fromkeys(days):
+            doc_id = f"{ymd}-{last['order_number']}"
+            refs += [_completed_col(store_name, ymd).document(doc_id),
+                     _completed_col(store_name, ymd).document(f"{doc_id}-{order_id}")]
+        docs = [snap for snap in db.get_all(refs) if snap.exists]
+    else:
+        docs = list(_completed_col(store_name, today).where("order_id", "==", order_id).limit(1).stream())
+
+    for snap in docs:
+        data = snap.to_dict() or {}
+        if data.get("order_id") == order_id:
+            return _status(order_id, data.get("order_number"), "completed")
+    return _status(order_id, (last or {}).get("order_number"), "not_found")
+
+
+def _resolve_gone(feed: Dict[str, Any], version: int, order_id: str,
+                  last: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """version：查詢前的監聽版本號；查詢期間監聽有異動就不記結果（可能已過時）"""
+    store_name = feed["store"]
+    key = (store_name, order_id)
+    now = time.monotonic()
+    with _resolved_lock:
+        hit = _resolved.get(key)
+        if hit is not None and (hit[0] is None or hit[0] > now):
+            return hit[1]
+
+    status = _find_completed(store_name, order_id, last)
+    expires_at = None if status["status"] == "completed" else now + ORDER_STATUS_NEGATIVE_TTL
+    with _resolved_lock:
+        # 跟 _on_snapshot 清除結果用同一把鎖：檢查完版本號到寫入之間不會漏掉清除
+        if feed["version"] != version or feed["closed"]:
+            return status
+        _resolved[key] = (expires_at, status)
+        _resolved.move_to_end(key)
+        while len(_resolved) > ORDER_FEED_BUFFER * 4:
+            _resolved.popitem(last=False)
+    return status
+
+
+def _lookup(store_name: str, order_id: str) -> Tuple[Dict[str, Any], bool]:
+    """(狀態, 監聽是否看過這個 id)"""
+    feed = _current(store_name)
+    with feed["cond"]:
+        order = feed["orders"].get(order_id)
+        last = feed["removed"].get(order_id)
+        version = feed["version"]
+    if order is not None:
+        return _status(order_id, order.get("order_number"), order.get("status") or "pending"), True
+    return _resolve_gone(feed, version, order_id, last), last is not None
+
+
+def order_status(store_name: str, order_id: str) -> Dict[str, Any]:
+    """
+    {"order_id", "order_number", "status"}：
+      待處理佇列裡 → 訂單上的 status（pending / ...）；有完成副本 → completed；其他 → not_found
+    """
+    return _lookup(store_name, order_id)[0]
+
+
+def wait_order_status(store_name: str, order_id: str, known: Optional[str], timeout: float) -> Dict[str, Any]:
+    """
+    狀態跟 known 不同（或逾時）就回傳目前狀態；只有這張訂單有異動時才會被喚醒重查
+    監聽沒看過的 id 查到 not_found 時，前 ORDER_STATUS_NOT_FOUND_GRACE 秒當成還沒確定、繼續等
+    """
+    key = (store_name, order_id)
+    with _watch_lock:
+        watch = _order_watches.setdefault(key, {"cond": threading.Condition(), "waiters": 0})
+        watch["waiters"] += 1
+    try:
+        now = time.monotonic()
+        deadline = now + max(0.0, timeout)
+        grace_until = now + ORDER_STATUS_NOT_FOUND_GRACE
+        while True:
+            with watch["cond"]:
+                status, seen = _lookup(store_name, order_id)
+                now = time.monotonic()
+                remaining = deadline - now
+                unsure = status["status"] == "not_found" and not seen and now < grace_until
+                if (status["status"] != known and not unsure) or remaining <= 0:
+                    return status
+                if unsure and known != "not_found":
+                    remaining = min(remaining, grace_until - now)
+                watch["cond"].wait(remaining)
+    finally:
+        with _watch_lock:
+            watch["waiters"] -= 1
+            if watch["waiters"] == 0:
+                _order_watches.pop(key, None)
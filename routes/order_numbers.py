@@ -0,0 +1,107 @@
+# routes/order_numbers.py
+"""
+訂單號碼配發（每店每天從 1 開始）
+
+stores/{store}/daily_counter/{yyyymmdd}.count 記錄「已被租走的最大號碼」。
+每個 worker 一次用 transaction 租一段 ORDER_NUMBER_BLOCK 個號碼（count += N），之後在行程內依序發號，
+同一個計數器文件的 transaction 從「每張訂單一次」降為「每 N 張訂單一次」。
+- 號碼保證不重複；同一 worker 內遞增，多個 worker 之間大致遞增（各自從自己的區段發號）
+- worker 重啟或跨日時，區段內沒用完的號碼會被跳過（不會重複使用）
+- ORDER_NUMBER_BLOCK=1 等同原本逐張取號的行為
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+from google.cloud import firestore
+
+from firebase_config import db
+
+ORDER_NUMBER_BLOCK = max(1, int(os.getenv("ORDER_NUMBER_BLOCK", "20")))
+
+_lock = threading.Lock()
+_key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_leases: Dict[Tuple[str, str], Dict[str, int]] = {}   # (store, date) -> {"next", "end"}
+_stats = {
+    "allocated": 0,
+    "leases": 0,
+    "lease_seconds_total": 0.0,
+    "lease_seconds_max": 0.0,
+    "abandoned_numbers": 0,   # 跨日時沒用完就丟掉的號碼
+}
+
+
+def _counter_ref(store_name: str, date_str: str):
+    return db.collection("stores").document(store_name).collection("daily_counter").document(date_str)
+
+
+def _key_lock(key: Tuple[str, str]) -> threading.Lock:
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _lease_block(store_name: str, date_str: str, size: int) -> Tuple[int, int]:
+    """用一次 transaction 把 count 往上推 size，回傳租到的區段 [start, end]"""
+    counter_ref = _counter_ref(store_name, date_str)
+
+    @firestore.transactional
+    def _txn(transaction):
+        snapshot = counter_ref.get(transaction=transaction)
+        current = int((snapshot.to_dict() or {}).get("count", 0)) if snapshot.exists else 0
+        end = current + size
+        transaction.set(counter_ref, {"count": end, "updated_at": firestore.SERVER_TIMESTAMP}, merge=True)
+        return current + 1, end
+
+    return _txn(db.transaction())
+
+
+def _drop_stale_leases(date_str: str) -> None:
+    """換日後把前一天的區段清掉（呼叫端需持有 _lock）"""
+    for key in [k for k in _leases if k[1] != date_str]:
+        lease = _leases.pop(key)
+        _key_locks.pop(key, None)
+        _stats["abandoned_numbers"] += max(0, lease["end"] - lease["next"] + 1)
+
+
+def allocate(store_name: str, date_str: str) -> int:
+    """回傳 store 在 date_str（YYYYMMDD）的下一個訂單號碼"""
+    key = (store_name, date_str)
+    with _lock:
+        _drop_stale_leases(date_str)
+
+    with _key_lock(key):
+        lease = _leases.get(key)
+        if lease is None or lease["next"] > lease["end"]:
+            t0 = time.perf_counter()
+            start, end = _lease_block(store_name, date_str, ORDER_NUMBER_BLOCK)
+            elapsed = time.perf_counter() - t0
+            lease = {"next": start, "end": end}
+            with _lock:
+                _leases[key] = lease
+                _stats["leases"] += 1
+                _stats["lease_seconds_total"] += elapsed
+                _stats["lease_seconds_max"] = max(_stats["lease_seconds_max"], elapsed)
+            print(f"🎟️ 租用訂單號碼區段 store={store_name} date={date_str} {start}-{end}（{elapsed * 1000:.0f}ms）")
+
+        number = lease["next"]
+        lease["next"] += 1
+
+    with _lock:
+        _stats["allocated"] += 1
+    return number
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        leases = {
+            f"{store}/{date_str}": {"next": lease["next"], "end": lease["end"],
+                                    "remaining": max(0, lease["end"] - lease["next"] + 1)}
+            for (store, date_str), lease in _leases.items()
+        }
+        return {
+            **_stats,
+            "block_size": ORDER_NUMBER_BLOCK,
+            "numbers_per_lease": round(_stats["allocated"] / _stats["leases"], 2) if _stats["leases"] else None,
+            "active_leases": leases,
+        }
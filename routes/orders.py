@@ -1,16 +1,36 @@
 # routes/orders.py
 from datetime import datetime, timedelta, date
-from typing import Optional, Any, List
+from typing import Optional, Any, List, Dict
 import traceback
+import random
+import os
+import threading
+import time
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from firebase_config import db
-from routes.auth import token_required
+from routes.auth import store_exists, token_required
+from routes import catalog_index, order_feed, order_numbers, pagination, stock_summary, summary_store
 from google.cloud import firestore
-from google.cloud.firestore import Increment
+from google.api_core.exceptions import Conflict
 
 orders_bp = Blueprint('orders', __name__)
 
+# complete_multiple_orders：每個 transaction 最多完成幾張訂單
+# （每張約 6 筆寫入 + 食材 / 批次更新，需低於 Firestore 單次 commit 500 筆上限）
+BULK_COMPLETE_CHUNK = max(1, int(os.getenv("BULK_COMPLETE_CHUNK", "40")))
+
+# /orders/stream：沒有異動時每隔幾秒送心跳；每條連線最長幾秒（到時結束，EventSource 帶 Last-Event-ID 自動重連補差異）
+ORDER_STREAM_HEARTBEAT = float(os.getenv("ORDER_STREAM_HEARTBEAT", "15"))
+ORDER_STREAM_MAX_SECONDS = float(os.getenv("ORDER_STREAM_MAX_SECONDS", "300"))
+# /order_status 長輪詢最多等幾秒（需低於前端 / 反向代理的逾時）
+ORDER_STATUS_MAX_WAIT = float(os.getenv("ORDER_STATUS_MAX_WAIT", "25"))
+# 顧客端看到這些狀態就不會再變了
+FINAL_ORDER_STATUSES = ("completed", "not_found")
+# /order_status 免登入：同時在等（長輪詢 + SSE）的連線上限，每條都占一個 worker 執行緒
+ORDER_STATUS_MAX_WAITERS = max(1, int(os.getenv("ORDER_STATUS_MAX_WAITERS", "200")))
+_order_status_waiters = threading.BoundedSemaphore(ORDER_STATUS_MAX_WAITERS)
+
 # === 小工具：取得台灣時區的今天字串 YYYYMMDD ===
 def taipei_today_str_from_utc(dt_utc: datetime | None = None) -> str:
     if dt_utc is None:
@@ -62,145 +82,236 @@ def _get_current_batch_id_safe_tx(transaction: firestore.Transaction, ing_ref, i
     except Exception:
         return None
 
-def consume_ingredient_with_batches(store_name: str, ingredient_doc_id: str, amount_to_consume: float) -> None:
+def _read_batch_chain_tx(transaction: firestore.Transaction, ing_ref, ing_snap, needed: float, current_snap=None):
     """
-    ✅ 兩階段交易 (Read / Write Phase) 以解決 Firestore 500 錯誤
+    🟢 讀取階段：從 current in_use 批次開始，必要時依 FIFO 接上 unused 批次，
+    直到湊滿 needed。回傳 (ing_name, batches_chain, total_available, active_batches)
+    - current_snap：呼叫端已用 get_all 預先取回的 current 批次（省掉逐一讀取）
+    - 最常見的情況（current 批次扣完還有剩、食材文件已有庫存彙總）只讀 current 批次，active_batches 為 None
+    - 其餘情況一次讀回全部 in_use + unused 批次，寫入階段據此重算庫存彙總
     """
-    if amount_to_consume is None:
-        return
-    try:
-        amount_to_consume = float(amount_to_consume)
-    except Exception:
-        raise ValueError("扣庫存數量不是數字")
-    if amount_to_consume <= 0:
-        return
+    if not ing_snap.exists:
+        raise ValueError("ingredient not found")
+    ing_data = ing_snap.to_dict() or {}
+    ing_name = ing_data.get("name", ing_ref.id)
+
+    # 決定從哪個批次開始
+    current_batch_id = _get_current_batch_id_safe_tx(transaction, ing_ref, ing_data)
+
+    # 收集所有需要用到的批次資料 [ (id, data, ref), ... ]
+    batches_chain = []
+    total_available = 0.0
+
+    # 1. 先讀取當前批次 (in_use)
+    if current_batch_id:
+        b_ref = ing_ref.collection("batches").document(current_batch_id)
+        b_snap = current_snap if current_snap is not None else b_ref.get(transaction=transaction)
+        if b_snap.exists:
+            b_data = b_snap.to_dict()
+            if b_data.get("status") == "in_use":
+                batches_chain.append((current_batch_id, b_data, b_ref))
+                total_available += float(b_data.get("quantity", 0) or 0)
+
+    if total_available > needed and stock_summary.from_doc(ing_data) is not None:
+        return ing_name, batches_chain, total_available, None
+
+    # 2. 會有批次換狀態：讀回全部 in_use + unused（順便當作預備庫存的來源）
+    active_batches = stock_summary.read_active_batches_tx(transaction, ing_ref)
+
+    if total_available < needed:
+        # [FIX] 只篩選 status，不使用 order_by，在 Python 端排序 (FIFO: 依 created_at)
+        unused = [(b_id, b_data) for b_id, b_data in active_batches.items() if b_data.get("status") == "unused"]
+        # 如果沒有 created_at，排在最後
+        unused.sort(key=lambda item: item[1].get("created_at") or datetime.max)
+
+        for b_id, b_data in unused:
+            batches_chain.append((b_id, b_data, ing_ref.collection("batches").document(b_id)))
+            total_available += float(b_data.get("quantity", 0) or 0)
+
+            if total_available >= needed:
+                break
+
+    return ing_name, batches_chain, total_available, active_batches
+
+
+def _write_batch_chain_tx(transaction: firestore.Transaction, ing_ref, ing_snap, batches_chain: list,
+                          needed: float, active_batches: Optional[dict]) -> None:
+    """
+    🔴 寫入階段：依 batches_chain 順序扣量，並同步父文件的 current_batch 資訊與庫存彙總
+    """
+    remaining_to_deduct = needed
+    next_current_batch_id = None
+    final_batch_qty = 0
+    final_batch_exp = None
+
+    for b_id, b_data, b_ref in batches_chain:
+        if remaining_to_deduct <= 0:
+            break
+
+        current_qty = float(b_data.get("quantity", 0) or 0)
+
+        # 計算這一批要扣多少
+        deduct_amount = min(current_qty, remaining_to_deduct)
+        new_qty = current_qty - deduct_amount
+        remaining_to_deduct -= deduct_amount
+
+        # 決定狀態
+        new_status = "in_use"
+        if new_qty == 0:
+            new_status = "depleted"
+        else:
+            # 這一批還有剩，它將成為新的 current_batch
+            next_current_batch_id = b_id
+            final_batch_qty = new_qty
+            final_batch_exp = b_data.get("expiration_date")
+
+        # 執行更新
+        transaction.update(b_ref, {
+            "quantity": new_qty,
+            "status": new_status
+        })
+        if active_batches is not None:
+            active_batches[b_id] = {**b_data, "quantity": new_qty, "status": new_status}
+
+    # 庫存彙總：只扣 current 批次時直接減量，否則由扣完後的批次重算
+    if active_batches is None:
+        agg = stock_summary.from_doc(ing_snap.to_dict() or {})
+        agg["in_use_sum"] -= needed
+    else:
+        agg = stock_summary.summarize(active_batches.values())
+
+    # 更新父文件
+    if next_current_batch_id:
+        transaction.update(ing_ref, {
+            "current_batch_id": next_current_batch_id,
+            "quantity": final_batch_qty,
+            "current_quantity": final_batch_qty,
+            "expiration_date": final_batch_exp,
+            "status": "in_stock",
+            **stock_summary.stock_update(agg),
+        })
+    else:
+        # 剛好全部用完
+        transaction.update(ing_ref, {
+            "current_batch_id": None,
+            "quantity": 0,
+            "current_quantity": 0,
+            "status": "out_of_stock",
+            **stock_summary.stock_update(agg),
+        })
+
+
+def _normalize_needs(needs: Dict[str, Any]) -> Dict[str, float]:
+    plan: Dict[str, float] = {}
+    for ingredient_doc_id, amount in (needs or {}).items():
+        if amount is None:
+            continue
+        try:
+            amount = float(amount)
+        except Exception:
+            raise ValueError("扣庫存數量不是數字")
+        if amount > 0:
+            plan[ingredient_doc_id] = amount
+    return plan
 
-    ing_ref = (
-        db.collection("stores")
-          .document(store_name)
-          .collection("ingredients")
-          .document(ingredient_doc_id)
+
+def _read_deduction_tx(transaction: firestore.Transaction, store_name: str, plan: Dict[str, float],
+                       extra_refs: tuple = (), shortages: Optional[dict] = None):
+    """
+    🟢 PHASE 1：一次 get_all 取回所有食材父文件（連同呼叫端要一起讀的 extra_refs），
+    再一次 get_all 取回各食材的 current 批次；current 不夠扣的才另外查 unused 批次。
+    任何一種不足就丟 ValueError；有傳 shortages（dict）時改成記下
+    {ingredient_doc_id: (食材名, 實際可用量)} 讓呼叫端自行取捨。回傳 (chains, extra_snaps)
+    """
+    ing_col = db.collection("stores").document(store_name).collection("ingredients")
+    ing_refs = {ing_id: ing_col.document(ing_id) for ing_id in plan}
+    refs = list(ing_refs.values()) + list(extra_refs)
+    snaps = {snap.reference.path: snap for snap in transaction.get_all(refs)} if refs else {}
+
+    current_refs = {}
+    for ing_id, ing_ref in ing_refs.items():
+        snap = snaps[ing_ref.path]
+        cbid = (snap.to_dict() or {}).get("current_batch_id") if snap.exists else None
+        if cbid:
+            current_refs[ing_id] = ing_ref.collection("batches").document(cbid)
+    current_snaps = (
+        {snap.reference.path: snap for snap in transaction.get_all(list(current_refs.values()))}
+        if current_refs else {}
     )
 
+    chains = []
+    for ing_id, needed in plan.items():
+        ing_ref = ing_refs[ing_id]
+        ing_snap = snaps[ing_ref.path]
+        current_snap = current_snaps.get(current_refs[ing_id].path) if ing_id in current_refs else None
+        ing_name, batches_chain, total_available, active_batches = _read_batch_chain_tx(
+            transaction, ing_ref, ing_snap, needed, current_snap
+        )
+        # 檢查總庫存
+        if total_available < needed:
+            if shortages is None:
+                raise ValueError(f"食材「{ing_name}」庫存不足！需求 {needed}，可用僅 {total_available}")
+            shortages[ing_id] = (ing_name, total_available)
+        chains.append((ing_ref, ing_snap, batches_chain, needed, active_batches))
+
+    return chains, [snaps[ref.path] for ref in extra_refs]
+
+
+def _write_deduction_tx(transaction: firestore.Transaction, chains: list) -> None:
+    """🔴 PHASE 2：全部都夠了才開始寫"""
+    for ing_ref, ing_snap, batches_chain, needed, active_batches in chains:
+        _write_batch_chain_tx(transaction, ing_ref, ing_snap, batches_chain, needed, active_batches)
+
+
+def consume_ingredients_with_batches(store_name: str, needs: Dict[str, float]) -> None:
+    """
+    ✅ 一次交易扣多種食材：needs = {ingredient_doc_id: 扣除量}
+    - 先讀完所有食材與批次（Read Phase），任何一種不足就整筆放棄
+    - 再一次寫入全部批次更新（Write Phase），不會出現「扣一半」的狀況
+    """
+    plan = _normalize_needs(needs)
+    if not plan:
+        return
+
     transaction = db.transaction()
 
     @firestore.transactional
     def _tx(transaction: firestore.Transaction):
-        # 🟢 PHASE 1: 讀取階段 (Read Phase)
-        ing_snap = ing_ref.get(transaction=transaction)
-        if not ing_snap.exists:
-            raise ValueError("ingredient not found")
-        ing_data = ing_snap.to_dict() or {}
-        ing_name = ing_data.get("name", ingredient_doc_id)
-
-        # 決定從哪個批次開始
-        current_batch_id = _get_current_batch_id_safe_tx(transaction, ing_ref, ing_data)
-        
-        # 收集所有需要用到的批次資料 [ (id, data, ref), ... ]
-        batches_chain = []
-        total_available = 0.0
-        
-        # 1. 先讀取當前批次 (in_use)
-        if current_batch_id:
-            b_ref = ing_ref.collection("batches").document(current_batch_id)
-            b_snap = b_ref.get(transaction=transaction)
-            if b_snap.exists:
-                b_data = b_snap.to_dict()
-                if b_data.get("status") == "in_use":
-                    batches_chain.append((current_batch_id, b_data, b_ref))
-                    total_available += float(b_data.get("quantity", 0) or 0)
-
-        # 2. 如果不夠，讀取預備庫存 (unused)
-        needed = float(amount_to_consume)
-        
-        if total_available < needed:
-            # 抓取所有 unused
-            # [FIX] 這裡只篩選 status，不使用 order_by，避免 500 錯誤或需要建索引
-            q = ing_ref.collection("batches").where("status", "==", "unused")
-            unused_docs = list(transaction.get(q))
-            
-            # [FIX] 在 Python 端進行排序 (FIFO: 依 created_at)
-            def _sort_key(d):
-                data = d.to_dict() or {}
-                # 如果沒有 created_at，用 id 排，確保順序固定
-                return data.get("created_at") or datetime.max
-
-            unused_docs.sort(key=_sort_key)
-
-            for doc in unused_docs:
-                b_data = doc.to_dict()
-                batches_chain.append((doc.id, b_data, doc.reference))
-                total_available += float(b_data.get("quantity", 0) or 0)
-                
-                if total_available >= needed:
-                    break
-        
-        # 3. 檢查總庫存
-        if total_available < needed:
-            raise ValueError(f"食材「{ing_name}」庫存不足！需求 {needed}，可用僅 {total_available}")
-
-        # 🔴 PHASE 2: 寫入階段 (Write Phase)
-        remaining_to_deduct = needed
-        next_current_batch_id = None
-        final_batch_qty = 0
-        final_batch_exp = None
-        
-        for index, (b_id, b_data, b_ref) in enumerate(batches_chain):
-            if remaining_to_deduct <= 0:
-                break
-            
-            current_qty = float(b_data.get("quantity", 0) or 0)
-            
-            # 計算這一批要扣多少
-            deduct_amount = min(current_qty, remaining_to_deduct)
-            new_qty = current_qty - deduct_amount
-            remaining_to_deduct -= deduct_amount
-            
-            # 決定狀態
-            new_status = "in_use"
-            if new_qty == 0:
-                new_status = "depleted"
-            else:
-                # 這一批還有剩，它將成為新的 current_batch
-                next_current_batch_id = b_id
-                final_batch_qty = new_qty
-                final_batch_exp = b_data.get("expiration_date")
-            
-            # 執行更新
-            transaction.update(b_ref, {
-                "quantity": new_qty,
-                "status": new_status
-            })
-            
-        # 更新父文件
-        if next_current_batch_id:
-            transaction.update(ing_ref, {
-                "current_batch_id": next_current_batch_id,
-                "quantity": final_batch_qty,
-                "current_quantity": final_batch_qty,
-                "expiration_date": final_batch_exp,
-                "status": "in_stock"
-            })
-        else:
-            # 剛好全部用完
-            transaction.update(ing_ref, {
-                "current_batch_id": None,
-                "quantity": 0,
-                "current_quantity": 0,
-                "status": "out_of_stock"
-            })
+        chains, _ = _read_deduction_tx(transaction, store_name, plan)
+        _write_deduction_tx(transaction, chains)
 
     _tx(transaction)
 
 
-def _deduct_inventory_for_items(store_name: str, items: list[dict]) -> None:
+def consume_ingredient_with_batches(store_name: str, ingredient_doc_id: str, amount_to_consume: float) -> None:
     """
-    items -> recipes -> ingredients 扣批次庫存
+    ✅ 兩階段交易 (Read / Write Phase) 以解決 Firestore 500 錯誤
     """
-    print(f"[扣庫存-開始] store={store_name} items_count={len(items)}")
-    
-    # [FIX] 修正路徑：讀取根目錄 recipes
-    recipes_col = db.collection("recipes")
+    consume_ingredients_with_batches(store_name, {ingredient_doc_id: amount_to_consume})
+
+
+def _find_recipe_ingredients(menu_id: Any, menu_name: Any) -> dict:
+    """依 recipes/{menu_id} → recipes/{menu_name} → menu_id/name 欄位 的順序找食譜（走行程內索引）"""
+    found = catalog_index.get_recipe(menu_id, menu_name)
+    if not found:
+        print(f"[扣庫存-失敗] 找不到 recipe；menu_id={menu_id} menu_name={menu_name}")
+        raise ValueError(f"找不到產品「{menu_name}」的食譜設定(recipes)，無法扣庫存！")
+
+    _, recipe_data = found
+    ingredients_map = recipe_data.get("ingredients")
+    if not isinstance(ingredients_map, dict):
+        # 相容舊格式：直接把 recipe_data 當作 ingredients (排除非 dict 欄位)
+        ingredients_map = {k: v for k, v in recipe_data.items() if isinstance(v, dict) and "amount" in v}
+    return ingredients_map
+
+
+def _plan_inventory_deduction(store_name: str, items: list[dict]) -> Dict[str, Dict[str, Any]]:
+    """
+    items -> recipes -> ingredients，先把整張訂單的需求依食材彙總：
+      {ingredient_doc_id: {"name": 食材名, "unit": 庫存單位, "need": 總扣除量}}
+    食譜與食材名稱都查行程內索引（routes/catalog_index.py），不再逐筆打 Firestore
+    """
+    plan: Dict[str, Dict[str, Any]] = {}
 
     for item in items:
         menu_id = item.get("menu_id")
@@ -214,45 +325,7 @@ def _deduct_inventory_for_items(store_name: str, items: list[dict]) -> None:
         except Exception:
             quantity = 1.0
 
-        # 找 recipe
-        recipe_doc = None
-        tried = []
-
-        if menu_id:
-            tried.append(f"recipes/{menu_id}")
-            snap = recipes_col.document(str(menu_id)).get()
-            if snap.exists:
-                recipe_doc = snap
-
-        if not recipe_doc and menu_name:
-            tried.append(f"recipes/{menu_name}")
-            snap = recipes_col.document(str(menu_name)).get()
-            if snap.exists:
-                recipe_doc = snap
-
-        if not recipe_doc:
-            # 嘗試 where 查詢
-            conds = []
-            if menu_id: conds.append(("menu_id", menu_id))
-            if menu_name: conds.append(("name", menu_name))
-            
-            for f, v in conds:
-                try:
-                    docs = list(recipes_col.where(f, "==", v).limit(1).stream())
-                    if docs: 
-                        recipe_doc = docs[0]
-                        break
-                except: pass
-
-        if not recipe_doc or not getattr(recipe_doc, "exists", True):
-            print(f"[扣庫存-失敗] 找不到 recipe；tried={tried}")
-            raise ValueError(f"找不到產品「{menu_name}」的食譜設定(recipes)，無法扣庫存！")
-
-        recipe_data = recipe_doc.to_dict() or {}
-        ingredients_map = recipe_data.get("ingredients")
-        if not isinstance(ingredients_map, dict):
-            # 相容舊格式：直接把 recipe_data 當作 ingredients (排除非 dict 欄位)
-            ingredients_map = {k: v for k, v in recipe_data.items() if isinstance(v, dict) and "amount" in v}
+        ingredients_map = _find_recipe_ingredients(menu_id, menu_name)
 
         if not ingredients_map:
             print(f"[扣庫存-略過] 食譜無食材設定：{menu_name}")
@@ -266,19 +339,11 @@ def _deduct_inventory_for_items(store_name: str, items: list[dict]) -> None:
                 continue
 
             # 找庫存食材 (這是分店層級的)
-            ing_query = (
-                db.collection("stores").document(store_name)
-                  .collection("ingredients")
-                  .where("name", "==", ing_name)
-                  .limit(1)
-                  .stream()
-            )
-            ing_doc = next(ing_query, None)
-            if not ing_doc:
+            ing_info = catalog_index.get_ingredient(store_name, ing_name)
+            if not ing_info:
                 raise ValueError(f"食譜需要「{ing_name}」，但在 {store_name} 庫存中找不到！")
 
-            ing_data = ing_doc.to_dict() or {}
-            ingredient_unit = normalize_unit(ing_data.get("unit"))
+            ingredient_unit = normalize_unit(ing_info.get("unit"))
 
             if recipe_unit != ingredient_unit:
                 try:
@@ -290,15 +355,28 @@ def _deduct_inventory_for_items(store_name: str, items: list[dict]) -> None:
             else:
                 adjusted_amount = amount
 
-            need = float(adjusted_amount) * float(quantity)
-            print(f"[扣庫存-執行] {ing_name} 需扣 {need} ({ingredient_unit}) doc_id={ing_doc.id}")
+            entry = plan.setdefault(ing_info["id"], {"name": ing_name, "unit": ingredient_unit, "need": 0.0})
+            entry["need"] += float(adjusted_amount) * float(quantity)
+
+    return plan
 
-            # 執行扣庫存
-            consume_ingredient_with_batches(
-                store_name=store_name,
-                ingredient_doc_id=ing_doc.id,
-                amount_to_consume=need,
-            )
+
+def _deduct_inventory_for_items(store_name: str, items: list[dict]) -> None:
+    """
+    items -> recipes -> ingredients 扣批次庫存
+    先彙總整張訂單的食材需求，再用一次交易扣完全部批次
+    """
+    print(f"[扣庫存-開始] store={store_name} items_count={len(items)}")
+
+    plan = _plan_inventory_deduction(store_name, items)
+    for ing_id, entry in plan.items():
+        print(f"[扣庫存-執行] {entry['name']} 需扣 {entry['need']} ({entry['unit']}) doc_id={ing_id}")
+
+    # 執行扣庫存（單一交易）
+    consume_ingredients_with_batches(
+        store_name=store_name,
+        needs={ing_id: entry["need"] for ing_id, entry in plan.items()},
+    )
 
     print(f"[扣庫存-結束] store={store_name}")
 
@@ -316,18 +394,21 @@ def _create_order_logic(store_name: str, items: List[dict]):
     order_items = []
     total_price = 0
 
+    for item in items:
+        if not item.get("menu_id") or not isinstance(item.get("quantity"), (int, float)):
+            raise ValueError("每個項目必須含有 menu_id 和 quantity")
+
+    # 價格從菜單快取取得；快取冷掉時也只會有一次 get_all
+    menus = catalog_index.get_menu_items(item["menu_id"] for item in items)
+
     for item in items:
         menu_id = item.get("menu_id")
         quantity = item.get("quantity")
 
-        if not menu_id or not isinstance(quantity, (int, float)):
-            raise ValueError("每個項目必須含有 menu_id 和 quantity")
-
-        menu_doc = db.collection("menus").document(menu_id).get()
-        if not menu_doc.exists:
+        menu_data = menus.get(str(menu_id))
+        if menu_data is None:
             raise ValueError(f"找不到菜單 {menu_id}")
 
-        menu_data = menu_doc.to_dict()
         unit_price = menu_data.get("price", 0)
         subtotal = unit_price * quantity
 
@@ -342,19 +423,8 @@ def _create_order_logic(store_name: str, items: List[dict]):
 
     now = datetime.utcnow()
     date_str = taipei_today_str_from_utc(now)
-    counter_doc_ref = db.collection("stores").document(store_name).collection("daily_counter").document(date_str)
-
-    transaction = db.transaction()
-
-    @firestore.transactional
-    def increment_order_number(transaction):
-        snapshot = counter_doc_ref.get(transaction=transaction)
-        current = snapshot.to_dict().get("count", 0) if snapshot.exists else 0
-        next_number = current + 1
-        transaction.set(counter_doc_ref, {"count": next_number})
-        return next_number
-
-    order_number = increment_order_number(transaction)
+    # 號碼由 worker 內租到的區段配發，不必每張訂單都對 daily_counter 開 transaction
+    order_number = order_numbers.allocate(store_name, date_str)
 
     order_data = {
         "order_number": order_number,
@@ -371,92 +441,6 @@ def _create_order_logic(store_name: str, items: List[dict]):
     return doc_ref[1].id, order_number, order_data
 
 
-# ----------------------------------------------------
-# Running Total：把完成訂單即時累加到 daily_summary/summary
-# ----------------------------------------------------
-def _apply_order_to_running_total(store_name: str, ymd: str, completed_doc_id: str, order_data: dict):
-    """
-    將一筆 completed order 累加到 summary (冪等)
-    """
-    summary_ref = (db.collection("stores").document(store_name)
-                      .collection("dates").document(ymd)
-                      .collection("daily_summary").document("summary"))
-    applied_flag_ref = (db.collection("stores").document(store_name)
-                          .collection("dates").document(ymd)
-                          .collection("daily_summary_applied").document(completed_doc_id))
-
-    items = order_data.get("items", []) or []
-
-    # 計算本單合計
-    total_qty = 0
-    total_price = 0
-    flavor_increments = [] 
-
-    # 允許使用 order 層級 total_price
-    if isinstance(order_data.get("total_price"), (int, float)):
-        total_price = int(order_data["total_price"])
-
-    for it in items:
-        mid = str(it.get("menu_id", "")).strip()
-        mname = it.get("menu_name") or mid
-        qty = 0
-        sub = 0
-        try:
-            qty = int(it.get("quantity", 0))
-        except: pass
-        try:
-            sub = int(it.get("subtotal", 0))
-        except: pass
-
-        total_qty += max(qty, 0)
-        # 如果 order 沒 total_price，就由 items 累加
-        if not isinstance(order_data.get("total_price"), (int, float)):
-            total_price += max(sub, 0)
-
-        if mid:
-            flavor_increments.append((mid, mname, max(qty, 0), max(sub, 0)))
-
-    @firestore.transactional
-    def _txn(transaction: firestore.Transaction):
-        # 防重
-        applied_snap = applied_flag_ref.get(transaction=transaction)
-        if applied_snap.exists:
-            return "already_applied"
-
-        # 確保 summary 基礎欄位
-        base = {
-            "store": store_name,
-            "date": f"{ymd[:4]}-{ymd[4:6]}-{ymd[6:]}",
-            "monthKey": ymd[:6],
-        }
-        transaction.set(summary_ref, base, merge=True)
-
-        # 更新
-        updates = {
-            "revenue": Increment(int(total_price)),
-            "orders_count": Increment(1),
-            "items_count": Increment(int(total_qty)),
-            "last_updated_at": firestore.SERVER_TIMESTAMP,
-        }
-        for mid, mname, qty, sub in flavor_increments:
-            updates[f"flavor_counts.{mid}"] = Increment(int(qty))
-            updates[f"flavor_revenue.{mid}"] = Increment(int(sub))
-            updates[f"flavor_labels.{mid}"] = mname
-
-        transaction.update(summary_ref, updates)
-
-        # 打旗標
-        transaction.set(applied_flag_ref, {
-            "order_id": completed_doc_id,
-            "applied_at": firestore.SERVER_TIMESTAMP,
-        }, merge=False)
-
-        return "applied"
-
-    tx = db.transaction()
-    return _txn(tx)
-
-
 # =========================
 # API Routes
 # =========================
@@ -514,25 +498,204 @@ def public_place_order():
 @orders_bp.route('/get_orders', methods=['GET'])
 @token_required
 def get_orders():
+    """
+    查詢參數（皆可省略，省略時與舊版相同回傳全部）：
+      limit / start_after：游標分頁，下一頁帶上回應的 next_cursor
+      fields：只回這些欄位，例如 fields=order_number,status,total_price
+      status：狀態篩選，例如 status=pending
+    """
     try:
         store_name = request.user.get("store_name")
-        orders_ref = (db.collection("stores").document(store_name)
-                        .collection("orders")
-                        .order_by("created_at")
-                        .stream())
+        try:
+            limit = pagination.parse_limit(request.args.get("limit"))
+            fields = pagination.parse_fields(request.args.get("fields"))
+            statuses = pagination.parse_list(request.args.get("status"))
+            docs, next_cursor = pagination.fetch_page(
+                db.collection("stores").document(store_name).collection("orders"),
+                "created_at",
+                limit=limit,
+                start_after=request.args.get("start_after"),
+                fields=fields,
+                statuses=statuses,
+            )
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+
+        # 有讀 items 才能檢查格式（投影沒選 items 時不過濾）
+        check_items = not fields or "items" in fields
         orders = []
-        for doc in orders_ref:
-            data = doc.to_dict()
-            if "items" not in data or not isinstance(data["items"], list):
+        for doc in docs:
+            data = pagination.doc_dict(doc, fields)
+            if check_items and not isinstance(data.get("items"), list):
                 continue
-            data["id"] = doc.id
             orders.append(data)
 
-        return jsonify({"orders": orders}), 200
+        return jsonify({"orders": orders, "next_cursor": next_cursor}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _sse(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {current_app.json.dumps(data)}\n\n"
+
+
+def _event_id(epoch: str, version: int) -> str:
+    return f"{epoch}:{version}"
+
+
+def _last_event_id():
+    """Last-Event-ID = "epoch:版本號"；沒帶或格式不對回 None（送完整快照）"""
+    raw = request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or ""
+    epoch, sep, version = raw.rpartition(":")
+    try:
+        return (epoch, int(version)) if sep and epoch else None
+    except Exception:
+        return None
+
+
+@orders_bp.route('/orders/stream', methods=['GET'])
+@token_required
+def stream_orders():
+    """
+    待處理訂單即時推播（Server-Sent Events），取代輪詢 /get_orders
+    - event: snapshot  data = {"version", "orders": [...]}（連線時、或重連的版本太舊時送完整佇列）
+    - event: order     data = {"type": "added" | "modified" | "removed", "id", "order"?}
+    - SSE id 為 "epoch:版本號"；重連的 epoch 不是這個 worker 目前的監聽時送完整快照
+    - 註解行 ": heartbeat" 保持連線
+    同一 worker 同一分店的所有連線共用一個 Firestore 監聽（routes/order_feed.py）。
+    瀏覽器 EventSource 不能帶 Authorization header，可改用 ?token=
+    每條連線占用一個 worker 執行緒，gunicorn 需用 gthread / gevent worker
+    """
+    store_name = request.user.get("store_name")
+    if not store_name:
+        return jsonify({"error": "找不到 store_name"}), 400
+
+    order_feed.subscribe(store_name)
+    try:
+        last = _last_event_id()
+        first = None
+        if last is not None:
+            epoch, version, events = order_feed.wait_events(store_name, last[0], last[1], 0)
+            if events is not None:
+                first = [("order", event, _event_id(epoch, last[1] + i + 1)) for i, event in enumerate(events)]
+        if first is None:
+            epoch, version, pending = order_feed.snapshot(store_name)
+            first = [("snapshot", {"version": version, "orders": pending}, _event_id(epoch, version))]
+    except Exception as e:
+        order_feed.unsubscribe(store_name)
+        print(f"⚠️ 訂單推播啟動失敗（{store_name}）：{e}")
+        return jsonify({"error": str(e)}), 503
+
+    def generate():
+        cursor = (epoch, version)
+        deadline = time.monotonic() + ORDER_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            for event, data, event_id in first:
+                yield _sse(event, data, event_id)
+            while time.monotonic() < deadline:
+                cur_epoch, latest, events = order_feed.wait_events(
+                    store_name, *cursor, min(ORDER_STREAM_HEARTBEAT, max(0.0, deadline - time.monotonic()))
+                )
+                if events is None:
+                    cur_epoch, latest, pending = order_feed.snapshot(store_name)
+                    yield _sse("snapshot", {"version": latest, "orders": pending}, _event_id(cur_epoch, latest))
+                elif events:
+                    for i, event in enumerate(events):
+                        yield _sse("order", event, _event_id(cur_epoch, latest - len(events) + i + 1))
+                else:
+                    yield ": heartbeat\n\n"
+                cursor = (cur_epoch, latest)
+        except Exception as e:
+            print(f"⚠️ 訂單推播中斷（{store_name}）：{e}")
+
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # 反向代理不要緩衝
+    # 連線結束（含還沒開始送就斷線，generator 的 finally 不會執行）時取消訂閱
+    resp.call_on_close(lambda: order_feed.unsubscribe(store_name))
+    return resp
+
+
+@orders_bp.route('/order_status/<store_name>/<order_id>', methods=['GET'])
+def public_order_status(store_name, order_id):
+    """
+    顧客查訂單進度（免登入），回傳 {"order_id", "order_number", "status"}
+    status：待處理訂單上的狀態（pending 等）/ completed / not_found
+    - 直接查詢：立即回傳目前狀態
+    - 長輪詢：?wait=秒數（上限 ORDER_STATUS_MAX_WAIT）&known=目前已知狀態，狀態改變或逾時才回應
+    - SSE：Accept: text/event-stream（或 ?stream=1），狀態改變時送 event: status，完成或不存在後結束
+    狀態都由共用的 Firestore 監聽回答（routes/order_feed.py），等待中的顧客不會各自讀 Firestore
+    等待中的連線超過 ORDER_STATUS_MAX_WAITERS 時回 503 + Retry-After
+    """
+    if not store_exists(store_name):
+        return jsonify({"error": "找不到分店"}), 404
+
+    try:
+        wait = min(max(float(request.args.get("wait", "0") or 0), 0.0), ORDER_STATUS_MAX_WAIT)
+    except Exception:
+        return jsonify({"error": "wait 必須是秒數"}), 400
+
+    wants_stream = request.args.get("stream") == "1" or "text/event-stream" in request.headers.get("Accept", "")
+    waits = wants_stream or wait > 0
+    if waits and not _order_status_waiters.acquire(blocking=False):
+        resp = jsonify({"error": "等待中的連線過多，請稍後再試"})
+        resp.headers["Retry-After"] = "5"
+        return resp, 503
+
+    try:
+        status = order_feed.order_status(store_name, order_id)
+        if not wants_stream and wait > 0:
+            known = request.args.get("known") or status["status"]
+            # not_found 也交給 wait_order_status：剛下單、監聽還沒收到時會再等一下
+            if status["status"] in (known, "not_found"):
+                status = order_feed.wait_order_status(store_name, order_id, known, wait)
+    except Exception as e:
+        if waits:
+            _order_status_waiters.release()
+        print(f"⚠️ 查詢訂單狀態失敗（{store_name} {order_id}）：{e}")
+        return jsonify({"error": str(e)}), 503
+
+    if not wants_stream:
+        if waits:
+            _order_status_waiters.release()
+        resp = jsonify(status)
+        resp.headers["Cache-Control"] = "no-store"
+        return resp
+
+    def generate():
+        current = status
+        deadline = time.monotonic() + ORDER_STREAM_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            yield _sse("status", current)
+            rechecked = False
+            while time.monotonic() < deadline:
+                if current["status"] in FINAL_ORDER_STATUSES and (current["status"] != "not_found" or rechecked):
+                    break
+                timeout = min(ORDER_STREAM_HEARTBEAT, max(0.0, deadline - time.monotonic()))
+                if current["status"] == "not_found":
+                    # 剛下單時監聽可能還沒收到新增：寬限時間後再確認一次才結束
+                    rechecked = True
+                    timeout = min(order_feed.ORDER_STATUS_NOT_FOUND_GRACE, max(0.0, deadline - time.monotonic()))
+                latest = order_feed.wait_order_status(store_name, order_id, current["status"], timeout)
+                if latest["status"] != current["status"]:
+                    current = latest
+                    yield _sse("status", current)
+                else:
+                    yield ": heartbeat\n\n"
+        except Exception as e:
+            print(f"⚠️ 訂單狀態推播中斷（{store_name} {order_id}）：{e}")
+
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    # 連線結束（含還沒開始送就斷線）時才歸還名額
+    resp.call_on_close(_order_status_waiters.release)
+    return resp
+
+
 @orders_bp.route('/delete_order/<order_id>', methods=['DELETE'])
 @token_required
 def delete_order(order_id):
@@ -557,18 +720,20 @@ def update_order(order_id):
         order_items = []
         total_price = 0
 
+        for item in items:
+            if not item.get("menu_id") or not isinstance(item.get("quantity"), (int, float)):
+                return jsonify({"error": "每項必含 menu_id 和 quantity"}), 400
+
+        menus = catalog_index.get_menu_items(item["menu_id"] for item in items)
+
         for item in items:
             menu_id = item.get("menu_id")
             quantity = item.get("quantity")
 
-            if not menu_id or not isinstance(quantity, (int, float)):
-                return jsonify({"error": "每項必含 menu_id 和 quantity"}), 400
-
-            menu_doc = db.collection("menus").document(menu_id).get()
-            if not menu_doc.exists:
+            menu_data = menus.get(str(menu_id))
+            if menu_data is None:
                 return jsonify({"error": f"找不到菜單 ID: {menu_id}"}), 404
 
-            menu_data = menu_doc.to_dict()
             unit_price = menu_data["price"]
             subtotal = unit_price * quantity
 
@@ -595,98 +760,210 @@ def update_order(order_id):
 # ----------------------------------------------------
 # Running Total：把完成訂單即時累加到 daily_summary/summary
 # ----------------------------------------------------
-def _apply_order_to_running_total(store_name: str, ymd: str, completed_doc_id: str, order_data: dict):
+def _applied_flag_ref(store_name: str, ymd: str, completed_doc_id: str):
+    return (db.collection("stores").document(store_name)
+              .collection("dates").document(ymd)
+              .collection("daily_summary_applied").document(completed_doc_id))
+
+
+def _stage_running_total(writer, store_name: str, ymd: str, completed_doc_id: str, order_data: dict) -> None:
     """
-    將一筆 completed order 累加到 `stores/{store}/dates/{ymd}/daily_summary/summary`
-    - 使用 Transaction + Increment 原子更新
-    - 以 daily_summary_applied/{completed_doc_id} 作為防重旗標（冪等）
+    把一筆 completed order 的累加寫進 writer（WriteBatch 或 Transaction），由呼叫端 commit：
+      stores/{store}/dates/{ymd}/daily_summary/summary
+      stores/{store}/months/{yyyymm}/monthly_summary/summary
+      stores/{store}/years/{yyyy}/yearly_summary/summary
+    - 分散式計數器：隨機挑一個分片（SUMMARY_SHARD_COUNT），三份文件用 set(merge) + Increment 累加
+    - 同時 create daily_summary_applied/{completed_doc_id}：旗標已存在時整批失敗（AlreadyExists），
+      因此同一張訂單只會被累加一次（冪等）
     欄位：revenue, orders_count, items_count, flavor_counts.<mid>, flavor_revenue.<mid>, flavor_labels.<mid>
     """
-    summary_ref = (db.collection("stores").document(store_name)
-                     .collection("dates").document(ymd)
-                     .collection("daily_summary").document("summary"))
-    applied_flag_ref = (db.collection("stores").document(store_name)
-                          .collection("dates").document(ymd)
-                          .collection("daily_summary_applied").document(completed_doc_id))
+    # 記下這家店從哪天開始有月/年彙總（讀取端據此決定哪些月份可直接用彙總文件）
+    summary_store.mark_rollups_enabled(store_name, ymd)
 
-    items = order_data.get("items", []) or []
+    increments = summary_store.increment_fields(order_data)
+    shard = random.randrange(summary_store.SUMMARY_SHARD_COUNT)
 
-    # 計算本單合計
-    total_qty = 0
-    total_price = 0
-    flavor_increments = []  # (mid, mname, qty, sub)
+    writer.create(_applied_flag_ref(store_name, ymd, completed_doc_id), {
+        "order_id": completed_doc_id,
+        "applied_at": firestore.SERVER_TIMESTAMP,
+        "shard": shard,
+    })
+    for ref, base in summary_store.rollup_refs(store_name, ymd, shard):
+        writer.set(ref, {**base, **increments}, merge=True)
 
-    # 允許使用 order 層級 total_price；沒有就由 items 小計
-    if isinstance(order_data.get("total_price"), (int, float)):
-        total_price = int(order_data["total_price"])
 
-    for it in items:
-        mid = str(it.get("menu_id", "")).strip()
-        mname = it.get("menu_name") or mid
-        qty = 0
-        sub = 0
-        try:
-            qty = int(it.get("quantity", 0))
-        except Exception:
-            pass
-        try:
-            sub = int(it.get("subtotal", it.get("total", 0) or 0))
-        except Exception:
-            try:
-                sub = int(float(it.get("subtotal", it.get("total", 0) or 0)))
-            except Exception:
-                sub = 0
+def _apply_order_to_running_total(store_name: str, ymd: str, completed_doc_id: str, order_data: dict):
+    """單獨累加一筆 completed order（一個 WriteBatch）；已累加過回傳 already_applied"""
+    batch = db.batch()
+    _stage_running_total(batch, store_name, ymd, completed_doc_id, order_data)
+    try:
+        batch.commit()
+    except Conflict:
+        return "already_applied"
+    return "applied"
+
+
+# ----------------------------------------------------
+# 完成訂單：扣庫存 + 搬到 completed_orders + running total + 刪除 pending，一次 commit
+# ----------------------------------------------------
+def _completed_copy(store_name: str, order_id: str, order_data: dict) -> dict:
+    return {
+        **order_data,
+        "order_id": order_id,  # 原 pending 訂單的 id，方便追查 / 查詢狀態
+        "status": "completed",
+        "used_in_inventory_refresh": False,
+        "completed_at": firestore.SERVER_TIMESTAMP,
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "store_name": store_name,
+    }
+
+
+def _completed_ref(store_name: str, ymd: str, completed_doc_id: str):
+    return (db.collection("stores").document(store_name)
+              .collection("dates").document(ymd)
+              .collection("completed_orders").document(completed_doc_id))
+
 
-        total_qty += max(qty, 0)
-        if not isinstance(order_data.get("total_price"), (int, float)):
-            total_price += max(sub, 0)
+def _is_copy_of(copy_snap, order_id: str, order_data: dict) -> bool:
+    """completed_orders 上的文件是不是這張訂單的副本（舊流程寫的副本沒有 order_id，改比 created_at）"""
+    copy = copy_snap.to_dict() or {}
+    if copy.get("order_id"):
+        return copy["order_id"] == order_id
+    return copy.get("created_at") is not None and copy.get("created_at") == order_data.get("created_at")
 
-        if mid:
-            flavor_increments.append((mid, mname, max(qty, 0), max(sub, 0)))
+
+def _complete_orders_bulk(store_name: str, order_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    ✅ 一次 transaction 完成一批訂單（BULK_COMPLETE_CHUNK 張以內）：
+      一次 get_all 取回全部訂單 → 彙總整批的食材需求 → 每種食材只規劃一次批次扣量
+      → completed_orders 副本 + summary 累加 + 冪等旗標 + 刪除 pending 隨同一次 commit 寫入
+    庫存不夠整批扣時，依 order_ids 順序能做的先做，做不了的訂單不動並回報原因。
+    副本 id 為 {ymd}-{order_number}；號碼每天重來，前一天留下的訂單可能跟今天的撞號，
+    這時（同批重複、或該 id 已是別張訂單的副本）改用 {ymd}-{order_number}-{order_id}。
+    回傳 {order_id: {"order_id", "status": "completed" | "not_found" | "failed", ...}}
+    """
+    ids = list(dict.fromkeys(str(i) for i in order_ids if i))
+    orders_col = db.collection("stores").document(store_name).collection("orders")
+    ymd = taipei_today_str_from_utc(datetime.utcnow())
+    # 每個行程只有第一次會真的寫 Firestore，放在 transaction 外
+    summary_store.mark_rollups_enabled(store_name, ymd)
 
     @firestore.transactional
-    def _txn(transaction: firestore.Transaction):
-        # 防重：已套用則跳過
-        applied_snap = applied_flag_ref.get(transaction=transaction)
-        if applied_snap.exists:
-            return "already_applied"
-
-        # 確保 summary 基礎欄位存在
-        base = {
-            "store": store_name,
-            "date": f"{ymd[:4]}-{ymd[4:6]}-{ymd[6:]}",
-            "monthKey": ymd[:6],
-        }
-        transaction.set(summary_ref, base, merge=True)
-
-        # 準備更新
-        updates = {
-            "revenue": Increment(int(total_price)),
-            "orders_count": Increment(1),
-            "items_count": Increment(int(total_qty)),
-            "last_updated_at": firestore.SERVER_TIMESTAMP,
-        }
-        for mid, mname, qty, sub in flavor_increments:
-            updates[f"flavor_counts.{mid}"] = Increment(int(qty))
-            updates[f"flavor_revenue.{mid}"] = Increment(int(sub))
-            updates[f"flavor_labels.{mid}"] = mname  # 覆寫同值冪等
-
-        transaction.update(summary_ref, updates)
-
-        # 打防重旗標
-        transaction.set(applied_flag_ref, {
-            "order_id": completed_doc_id,
-            "applied_at": firestore.SERVER_TIMESTAMP,
-        }, merge=False)
-
-        return "applied"
-
-    tx = db.transaction()
-    return _txn(tx)
+    def _tx(transaction: firestore.Transaction):
+        report: Dict[str, Dict[str, Any]] = {}
+        snaps = {snap.id: snap for snap in transaction.get_all([orders_col.document(i) for i in ids])} if ids else {}
+
+        # 1. 每張訂單各自換算食材需求（食譜 / 食材名稱走行程內索引，不打 Firestore）
+        candidates = []
+        for order_id in ids:
+            snap = snaps.get(order_id)
+            if snap is None or not snap.exists:
+                report[order_id] = {"order_id": order_id, "status": "not_found", "error": "訂單不存在"}
+                continue
+            order_data = snap.to_dict() or {}
+            try:
+                plan = _plan_inventory_deduction(store_name, order_data.get("items", []))
+                needs = _normalize_needs({ing_id: entry["need"] for ing_id, entry in plan.items()})
+            except ValueError as e:
+                report[order_id] = {"order_id": order_id, "status": "failed", "error": str(e)}
+                continue
+            doc_id = f"{ymd}-{order_data.get('order_number', 0)}"
+            candidates.append((order_id, order_data, needs, doc_id))
+
+        # 2. 整批需求加總，一次讀完食材 / 批次 / 各訂單的冪等旗標與副本 id
+        total_needs: Dict[str, float] = {}
+        for _, _, needs, _ in candidates:
+            for ing_id, need in needs.items():
+                total_needs[ing_id] = total_needs.get(ing_id, 0.0) + need
+        extra_refs = tuple(
+            ref
+            for _, _, _, doc_id in candidates
+            for ref in (_applied_flag_ref(store_name, ymd, doc_id), _completed_ref(store_name, ymd, doc_id))
+        )
+        shortages: Dict[str, Any] = {}
+        chains, extra_snaps = _read_deduction_tx(transaction, store_name, total_needs, extra_refs, shortages)
+
+        # 撞號的訂單改用帶 order_id 的副本 id（新 id 不會有旗標）
+        taken = set()
+        flag_snaps = []
+        for i, (order_id, order_data, needs, doc_id) in enumerate(candidates):
+            flag_snap, copy_snap = extra_snaps[2 * i], extra_snaps[2 * i + 1]
+            if doc_id in taken or (copy_snap.exists and not _is_copy_of(copy_snap, order_id, order_data)):
+                doc_id = f"{doc_id}-{order_id}"
+                candidates[i] = (order_id, order_data, needs, doc_id)
+                flag_snap = None
+            taken.add(doc_id)
+            flag_snaps.append(flag_snap)
+
+        # 3. 不夠扣的食材：依順序能做的先做
+        used: Dict[str, float] = {}
+        accepted = []
+        for (order_id, order_data, needs, doc_id), flag_snap in zip(candidates, flag_snaps):
+            short = [
+                f"食材「{shortages[ing_id][0]}」庫存不足！需求 {need}，可用僅 {shortages[ing_id][1] - used.get(ing_id, 0.0)}"
+                for ing_id, need in needs.items()
+                if ing_id in shortages and used.get(ing_id, 0.0) + need > shortages[ing_id][1]
+            ]
+            if short:
+                report[order_id] = {"order_id": order_id, "status": "failed", "error": "；".join(short)}
+                continue
+            for ing_id, need in needs.items():
+                used[ing_id] = used.get(ing_id, 0.0) + need
+            accepted.append((order_id, order_data, doc_id, flag_snap))
+
+        # 🔴 寫入：扣量改成實際接受的訂單合計
+        _write_deduction_tx(transaction, [
+            (ing_ref, ing_snap, batches_chain, used[ing_ref.id], active_batches)
+            for ing_ref, ing_snap, batches_chain, _, active_batches in chains
+            if used.get(ing_ref.id, 0.0) > 0
+        ])
+        for order_id, order_data, doc_id, flag_snap in accepted:
+            transaction.set(_completed_ref(store_name, ymd, doc_id), _completed_copy(store_name, order_id, order_data))
+            # 舊流程中斷時可能已累加過：旗標存在就不再累加
+            applied = flag_snap is not None and flag_snap.exists
+            if not applied:
+                _stage_running_total(transaction, store_name, ymd, doc_id, order_data)
+            transaction.delete(orders_col.document(order_id))
+            report[order_id] = {
+                "order_id": order_id,
+                "status": "completed",
+                "completed_id": doc_id,
+                "date": ymd,
+                "summary": "already_applied" if applied else "applied",
+            }
+
+        return report
+
+    return _tx(db.transaction())
+
+
+def _complete_order_atomic(store_name: str, order_id: str) -> Dict[str, Any]:
+    """
+    ✅ 一次 transaction 完成一張訂單：
+      扣批次庫存 + 寫 completed_orders 副本 + 累加 daily/monthly/yearly summary + 冪等旗標 + 刪除 pending 訂單
+    讀取：訂單 → 食材父文件與旗標（一次 get_all）→ current 批次（一次 get_all），寫入全部隨 commit 一起送出；
+    中途失敗不會留下「已複製但沒刪除」或「扣了庫存沒入帳」的半套狀態。
+    訂單不存在丟 LookupError；庫存不足 / 找不到食譜丟 ValueError。
+    回傳 {"order_id", "status", "completed_id", "date", "summary": "applied" | "already_applied"}
+    """
+    result = _complete_orders_bulk(store_name, [order_id])[str(order_id)]
+    if result["status"] == "not_found":
+        raise LookupError(result["error"])
+    if result["status"] != "completed":
+        raise ValueError(result["error"])
+    return result
+
+
+@orders_bp.route("/order_numbers/stats", methods=["GET"])
+@token_required
+def order_number_stats():
+    if request.user.get("role") not in ("developer", "superadmin"):
+        return jsonify({"error": "無權限"}), 403
+    return jsonify(order_numbers.stats()), 200
 
 
 # =========================
-# 完成單筆訂單並扣庫存（含 running total）
+# 完成單筆訂單並扣庫存（含 running total，單一 transaction）
 # =========================
 @orders_bp.route("/complete_order/<order_id>", methods=["POST"])
 @token_required
@@ -694,45 +971,14 @@ def complete_order(order_id):
     try:
         store_name = request.user.get("store_name")
 
-        order_ref = db.collection("stores").document(store_name).collection("orders").document(order_id)
-        order_doc = order_ref.get()
-        if not order_doc.exists:
-            return jsonify({"error": "訂單不存在"}), 404
-
-        order_data = order_doc.to_dict() or {}
-        items = order_data.get("items", [])
-
-        # 1. 扣批次庫存 (Transaction 內已處理防呆)
-        _deduct_inventory_for_items(store_name, items)
-
-        # 2. 移動訂單到 completed_orders
-        now_utc = datetime.utcnow()
-        ymd = taipei_today_str_from_utc(now_utc)
-        order_number = order_data.get("order_number", 0)
-        doc_id = f"{ymd}-{order_number}"
-
-        order_data["status"] = "completed"
-        order_data["used_in_inventory_refresh"] = False
-        order_data["completed_at"] = firestore.SERVER_TIMESTAMP
-        order_data["timestamp"] = firestore.SERVER_TIMESTAMP
-        order_data["store_name"] = store_name
-
-        dates_ref = (db.collection("stores").document(store_name)
-                        .collection("dates").document(ymd)
-                        .collection("completed_orders").document(doc_id))
-        dates_ref.set(order_data)
-
-        # ---- Running total：即時累加到當天 summary（冪等、防重）----
-        _apply_order_to_running_total(store_name, ymd, doc_id, order_data)
-
-        # 3. Running Total：即時累加到當天 summary
-        _apply_order_to_running_total(store_name, ymd, doc_id, order_data)
-
-        # 4. 刪除 pending
-        order_ref.delete()
+        # 扣庫存、搬移、running total、刪除 pending 全部在同一個 transaction
+        result = _complete_order_atomic(store_name, order_id)
+        print(f"[完成訂單] {store_name} {order_id} -> {result['completed_id']} ({result['summary']})")
 
         return jsonify({"message": "訂單已完成並已扣庫存"}), 200
 
+    except LookupError as le:
+        return jsonify({"error": str(le)}), 404
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
@@ -754,49 +1000,24 @@ def complete_multiple_orders():
         if not isinstance(ids, list) or not ids:
             return jsonify({"error": "請提供要完成的訂單 ID 陣列"}), 400
 
-        for order_id in ids:
-            order_ref = db.collection("stores").document(store_name).collection("orders").document(order_id)
-            order_doc = order_ref.get()
-            if not order_doc.exists:
-                continue
-
-            order_data = order_doc.to_dict() or {}
-            items = order_data.get("items", [])
-
-            # 1. 扣庫存
+        # 每 BULK_COMPLETE_CHUNK 張一個 transaction（Firestore 單次 commit 上限 500 筆寫入）
+        results = []
+        for i in range(0, len(ids), BULK_COMPLETE_CHUNK):
+            chunk = [str(x) for x in ids[i:i + BULK_COMPLETE_CHUNK] if x]
             try:
-                _deduct_inventory_for_items(store_name, items)
+                report = _complete_orders_bulk(store_name, chunk)
             except Exception as e:
-                print(f"訂單 {order_id} 扣庫存失敗，跳過: {e}")
-                continue
-
-            # 2. 移動訂單
-            now_utc = datetime.utcnow()
-            ymd = taipei_today_str_from_utc(now_utc)
-            order_number = order_data.get("order_number", 0)
-            doc_id = f"{ymd}-{order_number}"
-
-            order_data["status"] = "completed"
-            order_data["used_in_inventory_refresh"] = False
-            order_data["completed_at"] = firestore.SERVER_TIMESTAMP
-            order_data["timestamp"] = firestore.SERVER_TIMESTAMP
-            order_data["store_name"] = store_name
-
-            dates_ref = (db.collection("stores").document(store_name)
-                            .collection("dates").document(ymd)
-                            .collection("completed_orders").document(doc_id))
-            dates_ref.set(order_data)
-
-            # ---- Running total：即時累加到當天 summary（冪等、防重）----
-            _apply_order_to_running_total(store_name, ymd, doc_id, order_data)
-
-            # 3. Running Total
-            _apply_order_to_running_total(store_name, ymd, doc_id, order_data)
+                print(f"[批次完成] 第 {i // BULK_COMPLETE_CHUNK + 1} 批失敗：{e}")
+                report = {oid: {"order_id": oid, "status": "failed", "error": str(e)} for oid in chunk}
+            results.extend(report[oid] for oid in dict.fromkeys(chunk))
 
-            # 4. 刪除
-            order_ref.delete()
-
-        return jsonify({"message": "多筆訂單完成成功"}), 200
+        completed = sum(1 for r in results if r["status"] == "completed")
+        return jsonify({
+            "message": "多筆訂單完成成功" if completed == len(results) else "部分訂單未完成",
+            "completed": completed,
+            "failed": len(results) - completed,
+            "results": results,
+        }), 200
 
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
@@ -813,17 +1034,25 @@ def get_completed_orders():
         if not date_str:
             date_str = taipei_today_str_from_utc()
 
-        docs = (db.collection("stores").document(store_name)
-                    .collection("dates").document(date_str)
-                    .collection("completed_orders")
-                    .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                    .stream())
-        orders = []
-        for doc in docs:
-            order = doc.to_dict()
-            order['id'] = doc.id
-            orders.append(order)
-        return jsonify({"date": date_str, "orders": orders}), 200
+        # limit / start_after / fields / status 同 get_orders
+        try:
+            fields = pagination.parse_fields(request.args.get("fields"))
+            docs, next_cursor = pagination.fetch_page(
+                db.collection("stores").document(store_name)
+                  .collection("dates").document(date_str)
+                  .collection("completed_orders"),
+                "timestamp",
+                direction=firestore.Query.DESCENDING,
+                limit=pagination.parse_limit(request.args.get("limit")),
+                start_after=request.args.get("start_after"),
+                fields=fields,
+                statuses=pagination.parse_list(request.args.get("status")),
+            )
+        except ValueError as ve:
+            return jsonify({"error": str(ve)}), 400
+
+        orders = [pagination.doc_dict(doc, fields) for doc in docs]
+        return jsonify({"date": date_str, "orders": orders, "next_cursor": next_cursor}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -847,24 +1076,13 @@ def get_sales_summary():
         today = date.today()
         start_dt = today - timedelta(days=days - 1)
 
+        # 整段區間的 daily_summary 一次 get_all
+        revenues = summary_store.field_series(
+            summary_store.read_daily_summary(store_name, start_dt, today + timedelta(days=1), ("revenue",)), "revenue"
+        )
         results = []
-        for i in range(days):
+        for i, revenue in enumerate(revenues):
             d = start_dt + timedelta(days=i)
-            ymd = f"{d.year}{d.month:02d}{d.day:02d}"
-            doc_ref = (
-                db.collection("stores").document(store_name)
-                  .collection("dates").document(ymd)
-                  .collection("daily_summary").document("summary")
-            )
-            snap = doc_ref.get()
-            revenue = 0
-            if snap.exists:
-                data = snap.to_dict() or {}
-                try:
-                    revenue = int(data.get("revenue", 0))
-                except:
-                    revenue = 0
-
             results.append({
                 "date": d.strftime("%Y-%m-%d"),
                 "total": revenue
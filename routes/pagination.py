@@ -0,0 +1,121 @@
+# routes/pagination.py
+"""
+列表 API 的游標分頁 / 欄位投影 / 狀態篩選（Firestore 端完成，不把整個集合讀回來）
+
+- limit：每頁筆數（上限 PAGE_MAX_LIMIT）；沒帶時維持舊行為回傳全部
+- start_after：上一頁回應的 next_cursor（不透明字串 = 排序欄位值 + 文件 id 的 base64 JSON）
+- fields：逗號分隔的欄位清單，用 Query.select() 只讀回這些欄位；排序欄位一定會一起讀（游標要用）
+- status：逗號分隔，一個值用 ==、多個用 in
+排序固定加上 __name__ 當第二鍵，同一時間戳的文件也不會跨頁重複或漏掉。
+有 status 篩選時需要對應的複合索引 (status, 排序欄位, __name__)。
+"""
+import base64
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+PAGE_MAX_LIMIT = max(1, int(os.getenv("PAGE_MAX_LIMIT", "200")))
+
+_DOC_ID = "__name__"  # 依文件 id 排序用的特殊欄位
+
+_FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+def parse_limit(raw: Optional[str]) -> Optional[int]:
+    """None / 空字串 → None（不分頁）；其他需為正整數，超過上限取上限"""
+    if raw is None or str(raw).strip() == "":
+        return None
+    try:
+        n = int(str(raw).strip())
+    except Exception:
+        raise ValueError("limit 必須是正整數")
+    if n <= 0:
+        raise ValueError("limit 必須是正整數")
+    return min(n, PAGE_MAX_LIMIT)
+
+
+def parse_list(raw: Optional[str]) -> List[str]:
+    return [s.strip() for s in str(raw or "").split(",") if s.strip()]
+
+
+def parse_fields(raw: Optional[str]) -> Optional[List[str]]:
+    fields = parse_list(raw)
+    if not fields:
+        return None
+    for f in fields:
+        if not _FIELD_RE.match(f):
+            raise ValueError(f"fields 欄位名稱不合法：{f}")
+    return fields
+
+
+def _encode_value(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return {"t": v.isoformat()}
+    return v
+
+
+def _decode_value(v: Any) -> Any:
+    if isinstance(v, dict) and "t" in v:
+        return datetime.fromisoformat(v["t"])
+    return v
+
+
+def encode_cursor(order_value: Any, doc_id: str) -> str:
+    raw = json.dumps({"v": _encode_value(order_value), "id": doc_id}, ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[Any, str]]:
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        return _decode_value(data["v"]), str(data["id"])
+    except Exception:
+        raise ValueError("start_after 游標無效")
+
+
+def fetch_page(collection_ref, order_field: str, direction: str = firestore.Query.ASCENDING,
+               limit: Optional[int] = None, start_after: Optional[str] = None,
+               fields: Optional[List[str]] = None,
+               statuses: Optional[List[str]] = None) -> Tuple[List[Any], Optional[str]]:
+    """
+    回傳 (文件快照 list, next_cursor)；沒有下一頁時 next_cursor 為 None
+    多讀一筆判斷是否還有下一頁，只在確定有下一頁時才給游標
+    """
+    q = collection_ref
+    if statuses:
+        q = q.where("status", "==", statuses[0]) if len(statuses) == 1 else q.where("status", "in", statuses)
+    q = q.order_by(order_field, direction=direction).order_by(_DOC_ID, direction=direction)
+    if fields:
+        q = q.select(list(dict.fromkeys([*fields, order_field])))
+
+    cursor = decode_cursor(start_after)
+    if cursor is not None:
+        value, doc_id = cursor
+        q = q.start_after({order_field: value, _DOC_ID: doc_id})
+
+    if limit is None:
+        return list(q.stream()), None
+
+    docs = list(q.limit(limit + 1).stream())
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    last = docs[-1]
+    return docs, encode_cursor(last.get(order_field), last.id)
+
+
+def doc_dict(doc, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """快照轉 dict；有投影時只回要求的欄位（排序欄位是為了游標才讀的，不回傳）"""
+    data = doc.to_dict() or {}
+    if fields:
+        top = {f.split(".", 1)[0] for f in fields}
+        data = {k: v for k, v in data.items() if k in top}
+    data["id"] = doc.id
+    return data
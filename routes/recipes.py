@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from firebase_config import db
 from routes.auth import token_required
+from routes import catalog_index, http_cache
 
 recipes_bp = Blueprint("recipes", __name__)
 RECIPE_COLLECTION = "recipes"
@@ -10,9 +11,10 @@ RECIPE_COLLECTION = "recipes"
 @token_required
 def get_all_recipes():
     try:
-        docs = db.collection(RECIPE_COLLECTION).stream()
-        recipes = {doc.id: doc.to_dict() for doc in docs}
-        return jsonify({"recipes": recipes}), 200
+        def _build():
+            docs = db.collection(RECIPE_COLLECTION).stream()
+            return {"recipes": {doc.id: doc.to_dict() for doc in docs}}
+        return http_cache.cached_json("recipes", _build, private=True)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -45,6 +47,8 @@ def create_or_update_recipe():
                 return jsonify({"error": f"{ing} 缺少 amount 或 unit"}), 400
 
         db.collection(RECIPE_COLLECTION).document(menu_name).set(ingredients)
+        catalog_index.invalidate_recipes()
+        http_cache.invalidate("recipes")
         return jsonify({"message": f"{menu_name} 配方已儲存"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -55,6 +59,8 @@ def create_or_update_recipe():
 def delete_recipe(menu_name):
     try:
         db.collection(RECIPE_COLLECTION).document(menu_name).delete()
+        catalog_index.invalidate_recipes()
+        http_cache.invalidate("recipes")
         return jsonify({"message": f"{menu_name} 配方已刪除"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,202 @@
+# routes/stock_summary.py
+"""
+食材庫存彙總（反正規化在食材文件上，取代每次讀取都掃 batches）
+
+stores/{store}/ingredients/{id}.stock = {
+    "in_use_sum": 使用中批次數量合計,
+    "in_use_earliest": 使用中批次最早效期（"YYYY-MM-DD" 或 None）,
+    "unused_sum": 預備批次數量合計,
+    "unused_earliest": 預備批次最早效期,
+    "batch_count": in_use + unused 批次數,
+    "updated_at": SERVER_TIMESTAMP,
+}
+- 扣庫存 / 補貨 / 新增 / 編輯 / 調貨都在同一個 transaction（或 WriteBatch）裡連同批次一起寫，
+  庫存列表只要讀一次食材集合
+- 還沒有 stock 欄位的舊資料：讀取時先用 store_snapshot() 一次 collection_group("batches") 查詢補上整店批次；
+  查不到（批次還沒有 store 欄位 / 索引還沒建好）的食材改查自己的 batches 子集合，並把算出的 stock 寫回文件，
+  下次就不用再掃；也可以執行 repair_stock_aggregates.py 一次由批次重建
+- store_snapshot 只是加速：批次文件帶 store 欄位（舊批次用 backfill_batch_store.py 補）、
+  且有 batches 的 collection group 複合索引 (store ASC, status ASC) 時才查得到
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from google.cloud import firestore
+
+ACTIVE_STATUSES = ("in_use", "unused")
+STOCK_FIELD = "stock"
+
+
+def parse_exp_date(val: Any) -> Optional[date]:
+    """把 expiration_date 轉成 date（支援 string / datetime / firestore timestamp dict）"""
+    if val is None:
+        return None
+    if isinstance(val, datetime):
+        return val.date()
+    if isinstance(val, date):
+        return val
+    if isinstance(val, str):
+        s = val.strip().replace("/", "-")
+        try:
+            return datetime.strptime(s[:10], "%Y-%m-%d").date()
+        except Exception:
+            return None
+    if isinstance(val, dict):
+        sec = val.get("seconds") or val.get("_seconds")
+        if sec is not None:
+            try:
+                return datetime.utcfromtimestamp(int(sec)).date()
+            except Exception:
+                return None
+    return None
+
+
+def _to_float(v: Any) -> float:
+    try:
+        return float(v or 0)
+    except Exception:
+        return 0.0
+
+
+def empty() -> Dict[str, Any]:
+    return {"in_use_sum": 0.0, "in_use_earliest": None, "unused_sum": 0.0, "unused_earliest": None, "batch_count": 0}
+
+
+def add_batch(agg: Dict[str, Any], status: Any, quantity: Any, expiration_date: Any) -> Dict[str, Any]:
+    """回傳把一個批次加進 agg 後的新彙總（非 in_use / unused 的批次不計）"""
+    out = dict(agg)
+    if status not in ACTIVE_STATUSES:
+        return out
+    out["batch_count"] = int(out.get("batch_count") or 0) + 1
+    out[f"{status}_sum"] = _to_float(out.get(f"{status}_sum")) + _to_float(quantity)
+    exp = parse_exp_date(expiration_date)
+    if exp:
+        key = f"{status}_earliest"
+        if out.get(key) is None or exp.isoformat() < out[key]:
+            out[key] = exp.isoformat()
+    return out
+
+
+def summarize(batches: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """由批次資料（dict）計算彙總"""
+    agg = empty()
+    for bd in batches:
+        bd = bd or {}
+        agg = add_batch(agg, bd.get("status"), bd.get("quantity"), bd.get("expiration_date"))
+    return agg
+
+
+def from_doc(ing_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """食材文件上的彙總；舊資料沒有時回傳 None"""
+    stock = (ing_data or {}).get(STOCK_FIELD)
+    if not isinstance(stock, dict) or "batch_count" not in stock:
+        return None
+    agg = empty()
+    agg.update({k: stock.get(k) for k in agg})
+    agg["in_use_sum"] = _to_float(agg["in_use_sum"])
+    agg["unused_sum"] = _to_float(agg["unused_sum"])
+    agg["batch_count"] = int(agg["batch_count"] or 0)
+    return agg
+
+
+def stock_update(agg: Dict[str, Any]) -> Dict[str, Any]:
+    """寫回食材文件用的欄位（整個 stock map 覆蓋）"""
+    return {STOCK_FIELD: {**agg, "updated_at": firestore.SERVER_TIMESTAMP}}
+
+
+def active_batches_query(ing_ref):
+    return ing_ref.collection("batches").where("status", "in", list(ACTIVE_STATUSES))
+
+
+def read_active_batches_tx(transaction, ing_ref) -> Dict[str, Dict[str, Any]]:
+    """transaction 讀取階段：取回全部 in_use / unused 批次 {batch_id: data}"""
+    return {doc.id: (doc.to_dict() or {}) for doc in transaction.get(active_batches_query(ing_ref))}
+
+
+def load_tx(transaction, ing_ref, ing_data: Dict[str, Any]) -> Dict[str, Any]:
+    """transaction 讀取階段：優先用文件上的彙總，沒有才掃批次"""
+    agg = from_doc(ing_data)
+    if agg is None:
+        agg = summarize(read_active_batches_tx(transaction, ing_ref).values())
+    return agg
+
+
+def store_snapshot(db, store_name: str) -> Dict[str, List[Dict[str, Any]]]:
+    """一次 collection_group("batches") 查詢取回整店 in_use / unused 批次，依食材分組 {ingredient_id: [batch, ...]}"""
+    grouped: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    q = (
+        db.collection_group("batches")
+        .where("store", "==", store_name)
+        .where("status", "in", list(ACTIVE_STATUSES))
+    )
+    for doc in q.stream():
+        grouped[doc.reference.parent.parent.id].append(doc.to_dict() or {})
+    return grouped
+
+
+def backfill(db, ing_ref) -> Dict[str, Any]:
+    """
+    舊資料：掃這個食材的 batches 算出彙總，文件上還沒有 stock 欄位時一併寫回
+    （跟扣庫存一樣在 transaction 裡讀批次、寫彙總，不會蓋掉同時進行的扣庫存）
+    """
+
+    @firestore.transactional
+    def _tx(transaction):
+        snap = ing_ref.get(transaction=transaction)
+        agg = from_doc(snap.to_dict() or {}) if snap.exists else None
+        if agg is not None:
+            return agg
+        agg = summarize(read_active_batches_tx(transaction, ing_ref).values())
+        if snap.exists:
+            transaction.update(ing_ref, stock_update(agg))
+        return agg
+
+    try:
+        return _tx(db.transaction())
+    except Exception as e:
+        print(f"⚠️ 寫回 {ing_ref.id} 庫存彙總失敗：{e}")
+        return summarize(doc.to_dict() or {} for doc in active_batches_query(ing_ref).stream())
+
+
+def read_store(db, store_name: str, ing_docs) -> Dict[str, Dict[str, Any]]:
+    """
+    整店食材庫存彙總 {ingredient_id: agg}
+    有 stock 欄位的直接用；沒有的（舊資料）先由一次 store_snapshot() 補上，
+    store_snapshot 失敗或查不到批次的食材再各自掃 batches（backfill，順便寫回 stock 欄位）
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    missing = {}
+    for doc in ing_docs:
+        agg = from_doc(doc.to_dict() or {})
+        if agg is None:
+            missing[doc.id] = doc.reference
+        else:
+            out[doc.id] = agg
+
+    if missing:
+        snapshot: Dict[str, List[Dict[str, Any]]] = {}
+        try:
+            snapshot = store_snapshot(db, store_name)
+        except Exception as e:
+            print(f"⚠️ 讀取 {store_name} 批次失敗，改逐項讀取：{e}")
+        for ing_id, ing_ref in missing.items():
+            if snapshot.get(ing_id):
+                out[ing_id] = summarize(snapshot[ing_id])
+            else:
+                try:
+                    out[ing_id] = backfill(db, ing_ref)
+                except Exception as e:
+                    # 讀不到時不放進結果，由呼叫端退回父文件欄位
+                    print(f"⚠️ 讀取 {ing_id} 批次失敗：{e}")
+    return out
+
+
+def available(agg: Dict[str, Any]) -> float:
+    return _to_float(agg.get("in_use_sum")) + _to_float(agg.get("unused_sum"))
+
+
+def earliest(agg: Dict[str, Any]) -> Optional[str]:
+    dates = [d for d in (agg.get("in_use_earliest"), agg.get("unused_earliest")) if d]
+    return min(dates) if dates else None
+
@@ -0,0 +1,404 @@
+# routes/summary_store.py
+"""
+daily_summary 區間讀取：多家店 × 多天的 summary 文件一次用 db.get_all 分批抓回來
+
+stores/{store}/dates/{yyyymmdd}/daily_summary/summary
+- read_daily_summaries()：回傳每家店一條「逐日」陣列（不存在的日子為 None），順序與日期一致
+- 每批最多 SUMMARY_GET_ALL_CHUNK 個 ref，30 天 × 10 家店 = 300 個文件只需 1 次 RPC
+- aggregate_stores()：每份 summary 只讀一次，一趟同時累加 revenue / orders_count / items_count / 口味；
+  只要求需要的 metrics，get_all 也只投影（field_paths）那幾個欄位
+
+月 / 年彙總（完成訂單時與 daily_summary 在同一個 transaction 內累加）：
+  stores/{store}/months/{yyyymm}/monthly_summary/summary
+  stores/{store}/years/{yyyy}/yearly_summary/summary
+- stores/{store}/summary_meta/rollups.enabled_since 記錄這家店從哪天開始有累加月/年彙總；
+  該日期之後才開始的整月 / 整年直接讀彙總文件，其餘退回 daily_summary（backfill_rollups.py 重建後設為 00000000）
+- aggregate_range()：把區間拆成「整年 / 整月 / 零散日」，能用彙總文件的就不讀逐日文件
+
+分散式計數器（SUMMARY_SHARD_COUNT > 1）：
+- 每份 summary 拆成 summary、summary_1 … summary_{N-1}，完成訂單時隨機挑一片用 Increment 累加（不需 transaction），
+  避開單一文件每秒約 1 次寫入的上限
+- 讀取端一律讀 N 片後相加；N 只能調大不能調小（調小會漏讀舊的分片）
+"""
+import os
+from datetime import date, timedelta
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from google.api_core.exceptions import Conflict
+from google.cloud import firestore
+from google.cloud.firestore import Increment
+
+from firebase_config import db
+
+SUMMARY_GET_ALL_CHUNK = int(os.getenv("SUMMARY_GET_ALL_CHUNK", "300"))
+SUMMARY_SHARD_COUNT = max(1, int(os.getenv("SUMMARY_SHARD_COUNT", "1")))
+
+# metric → summary 文件上對應的欄位
+METRIC_FIELDS = {
+    "revenue": ("revenue",),
+    "orders_count": ("orders_count",),
+    "items_count": ("items_count",),
+    "flavors": ("flavor_counts", "flavor_labels"),
+}
+# 分片相加時要加總的欄位（其餘欄位取第一片）
+SUM_FIELDS = ("revenue", "orders_count", "items_count")
+SUM_MAP_FIELDS = ("flavor_counts", "flavor_revenue")
+ALL_METRICS = tuple(METRIC_FIELDS)
+
+ROLLUPS_ALWAYS = "00000000"  # backfill 完成後的 enabled_since：所有月份都可信
+
+_rollup_marked = set()  # 本行程已確認寫過 enabled_since 的分店
+
+
+def ymd(dt: date) -> str:
+    """date -> 'YYYYMMDD'"""
+    return f"{dt.year}{dt.month:02d}{dt.day:02d}"
+
+
+def iter_days(start_dt: date, end_dt_exclusive: date):
+    """yield date from start_dt (inclusive) to end_dt_exclusive (exclusive)"""
+    cur = start_dt
+    while cur < end_dt_exclusive:
+        yield cur
+        cur += timedelta(days=1)
+
+
+def shard_doc_id(shard: int = 0) -> str:
+    """第 0 片沿用原本的 summary 文件，其餘為 summary_{k}"""
+    return "summary" if shard == 0 else f"summary_{shard}"
+
+
+def daily_summary_ref(store: str, dt: Any, shard: int = 0):
+    day = dt if isinstance(dt, str) else ymd(dt)
+    return (db.collection("stores").document(store)
+              .collection("dates").document(day)
+              .collection("daily_summary").document(shard_doc_id(shard)))
+
+
+def monthly_summary_ref(store: str, yyyymm: str, shard: int = 0):
+    return (db.collection("stores").document(store)
+              .collection("months").document(yyyymm)
+              .collection("monthly_summary").document(shard_doc_id(shard)))
+
+
+def yearly_summary_ref(store: str, yyyy: str, shard: int = 0):
+    return (db.collection("stores").document(store)
+              .collection("years").document(yyyy)
+              .collection("yearly_summary").document(shard_doc_id(shard)))
+
+
+def all_shards(ref_fn, *args) -> List[Any]:
+    return [ref_fn(*args, shard=k) for k in range(SUMMARY_SHARD_COUNT)]
+
+
+def merge_shards(docs: Iterable[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """多片 summary 相加成一份；全部不存在回 None"""
+    merged: Optional[Dict[str, Any]] = None
+    for data in docs:
+        if not data:
+            continue
+        if merged is None:
+            merged = {k: (dict(v) if isinstance(v, dict) else v) for k, v in data.items()}
+            continue
+        for f in SUM_FIELDS:
+            if f in data:
+                merged[f] = _to_int(merged.get(f)) + _to_int(data.get(f))
+        for f in SUM_MAP_FIELDS:
+            target = merged.setdefault(f, {})
+            for k, v in (data.get(f) or {}).items():
+                target[k] = _to_int(target.get(k)) + _to_int(v)
+        merged.setdefault("flavor_labels", {}).update(data.get("flavor_labels") or {})
+    return merged
+
+
+def rollup_meta_ref(store: str):
+    return db.collection("stores").document(store).collection("summary_meta").document("rollups")
+
+
+def _field_paths(metrics: Optional[Sequence[str]]) -> Optional[List[str]]:
+    if metrics is None:
+        return None
+    unknown = [m for m in metrics if m not in METRIC_FIELDS]
+    if unknown:
+        raise ValueError(f"未知的 metric：{unknown}")
+    return [f for m in metrics for f in METRIC_FIELDS[m]]
+
+
+def get_all_chunked(refs: List[Any], field_paths: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """分批 get_all；回傳 {文件路徑: data}，只包含存在的文件。field_paths 給定時只抓這些欄位"""
+    found: Dict[str, Dict[str, Any]] = {}
+    for i in range(0, len(refs), SUMMARY_GET_ALL_CHUNK):
+        for snap in db.get_all(refs[i:i + SUMMARY_GET_ALL_CHUNK], field_paths=field_paths):
+            if snap.exists:
+                found[snap.reference.path] = snap.to_dict() or {}
+    return found
+
+
+def read_daily_summaries(stores: Iterable[str], start_dt: date, end_dt_exclusive: date,
+                         metrics: Optional[Sequence[str]] = None) -> Dict[str, List[Optional[Dict[str, Any]]]]:
+    """{store: [day0 summary 或 None, day1, ...]}，長度 = 區間天數；metrics=None 代表整份文件"""
+    field_paths = _field_paths(metrics)
+    stores = [s for s in dict.fromkeys(stores) if s]
+    days = list(iter_days(start_dt, end_dt_exclusive))
+    refs = {store: [all_shards(daily_summary_ref, store, d) for d in days] for store in stores}
+    found = get_all_chunked([ref for store_refs in refs.values() for shards in store_refs for ref in shards], field_paths)
+    return {
+        store: [merge_shards(found.get(ref.path) for ref in shards) for shards in store_refs]
+        for store, store_refs in refs.items()
+    }
+
+
+def read_daily_summary(store: str, start_dt: date, end_dt_exclusive: date,
+                       metrics: Optional[Sequence[str]] = None) -> List[Optional[Dict[str, Any]]]:
+    return read_daily_summaries([store], start_dt, end_dt_exclusive, metrics).get(store, [])
+
+
+def field_series(days: List[Optional[Dict[str, Any]]], field: str) -> List[int]:
+    """逐日陣列取出單一數值欄位（缺值 / 格式錯誤為 0）"""
+    series = []
+    for data in days:
+        try:
+            series.append(int((data or {}).get(field, 0) or 0))
+        except Exception:
+            series.append(0)
+    return series
+
+
+# =========================
+# 多指標單趟彙總
+# =========================
+def _to_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except Exception:
+        try:
+            return int(float(value))
+        except Exception:
+            return 0
+
+
+def empty_totals(metrics: Sequence[str] = ALL_METRICS) -> Dict[str, Any]:
+    totals: Dict[str, Any] = {m: 0 for m in metrics if m != "flavors"}
+    if "flavors" in metrics:
+        totals["flavor_counts"] = defaultdict(int)
+        totals["flavor_labels"] = {}
+    return totals
+
+
+def fold(totals: Dict[str, Any], data: Optional[Dict[str, Any]], metrics: Sequence[str] = ALL_METRICS) -> Dict[str, Any]:
+    """把一份 summary（或另一份 totals）累加進 totals；口味標籤以最後一次出現為準"""
+    if not data:
+        return totals
+    for m in metrics:
+        if m == "flavors":
+            for fid, cnt in (data.get("flavor_counts") or {}).items():
+                totals["flavor_counts"][fid] += _to_int(cnt)
+            totals["flavor_labels"].update(data.get("flavor_labels") or {})
+        else:
+            totals[m] += _to_int(data.get(m))
+    return totals
+
+
+def aggregate(days: Iterable[Optional[Dict[str, Any]]], metrics: Sequence[str] = ALL_METRICS) -> Dict[str, Any]:
+    totals = empty_totals(metrics)
+    for data in days:
+        fold(totals, data, metrics)
+    return totals
+
+
+def aggregate_stores(stores: Iterable[str], start_dt: date, end_dt_exclusive: date,
+                     metrics: Sequence[str] = ALL_METRICS) -> Dict[str, Dict[str, Any]]:
+    """
+    {store: {"revenue", "orders_count", "items_count", "flavor_counts", "flavor_labels"}}（只含要求的 metrics）
+    所有店、所有日子的 summary 一次 get_all，每份文件只讀一次
+    """
+    metrics = tuple(metrics)
+    per_store = read_daily_summaries(stores, start_dt, end_dt_exclusive, metrics)
+    return {store: aggregate(days, metrics) for store, days in per_store.items()}
+
+
+def combine(totals_list: Iterable[Dict[str, Any]], metrics: Sequence[str] = ALL_METRICS) -> Dict[str, Any]:
+    """多家店的 totals 合併成一份"""
+    combined = empty_totals(metrics)
+    for totals in totals_list:
+        fold(combined, totals, metrics)
+    return combined
+
+
+# =========================
+# 訂單 → summary 增量（daily / monthly / yearly 共用）
+# =========================
+def order_increments(order_data: Dict[str, Any]):
+    """
+    回傳 (total_price, total_qty, flavor_increments)；flavor_increments = [(mid, mname, qty, sub)]
+    允許使用 order 層級 total_price；沒有就由 items 小計
+    """
+    items = order_data.get("items", []) or []
+    total_qty = 0
+    total_price = 0
+    flavor_increments = []
+
+    has_total = isinstance(order_data.get("total_price"), (int, float))
+    if has_total:
+        total_price = int(order_data["total_price"])
+
+    for it in items:
+        mid = str(it.get("menu_id", "")).strip()
+        mname = it.get("menu_name") or mid
+        qty = 0
+        sub = 0
+        try:
+            qty = int(it.get("quantity", 0))
+        except Exception:
+            pass
+        try:
+            sub = int(it.get("subtotal", it.get("total", 0) or 0))
+        except Exception:
+            try:
+                sub = int(float(it.get("subtotal", it.get("total", 0) or 0)))
+            except Exception:
+                sub = 0
+
+        total_qty += max(qty, 0)
+        if not has_total:
+            total_price += max(sub, 0)
+
+        if mid:
+            flavor_increments.append((mid, mname, max(qty, 0), max(sub, 0)))
+
+    return total_price, total_qty, flavor_increments
+
+
+def rollup_refs(store: str, ymd_str: str, shard: int = 0):
+    """[(ref, 基礎欄位)]：daily / monthly / yearly 三份 summary（指定分片）"""
+    return [
+        (daily_summary_ref(store, ymd_str, shard),
+         {"store": store, "date": f"{ymd_str[:4]}-{ymd_str[4:6]}-{ymd_str[6:]}", "monthKey": ymd_str[:6]}),
+        (monthly_summary_ref(store, ymd_str[:6], shard), {"store": store, "monthKey": ymd_str[:6]}),
+        (yearly_summary_ref(store, ymd_str[:4], shard), {"store": store, "year": ymd_str[:4]}),
+    ]
+
+
+def increment_fields(order_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    一筆訂單要加到 summary 的欄位（巢狀 dict，給 set(merge=True) 用；menu_id 含「.」也不會被當成路徑）
+    同一口味出現在多個品項時數量會相加
+    """
+    total_price, total_qty, flavor_increments = order_increments(order_data)
+    counts: Dict[str, int] = defaultdict(int)
+    revenue: Dict[str, int] = defaultdict(int)
+    labels: Dict[str, str] = {}
+    for mid, mname, qty, sub in flavor_increments:
+        counts[mid] += int(qty)
+        revenue[mid] += int(sub)
+        labels[mid] = mname
+
+    fields: Dict[str, Any] = {
+        "revenue": Increment(int(total_price)),
+        "orders_count": Increment(1),
+        "items_count": Increment(int(total_qty)),
+        "last_updated_at": firestore.SERVER_TIMESTAMP,
+    }
+    # 空 map 在 merge 時會蓋掉整個欄位，沒有口味就不要帶
+    if counts:
+        fields["flavor_counts"] = {mid: Increment(v) for mid, v in counts.items()}
+        fields["flavor_revenue"] = {mid: Increment(v) for mid, v in revenue.items()}
+        fields["flavor_labels"] = labels
+    return fields
+
+
+def mark_rollups_enabled(store: str, ymd_str: str) -> None:
+    """第一次累加月/年彙總前記下日期（已存在就不動）；必須在累加之前呼叫"""
+    if store in _rollup_marked:
+        return
+    try:
+        rollup_meta_ref(store).create({"enabled_since": ymd_str})
+    except Conflict:
+        pass
+    _rollup_marked.add(store)
+
+
+# =========================
+# 區間彙總：整年 / 整月用彙總文件，其餘用 daily_summary
+# =========================
+def _next_month(d: date) -> date:
+    return date(d.year + 1, 1, 1) if d.month == 12 else date(d.year, d.month + 1, 1)
+
+
+def _segments(start_dt: date, end_dt_exclusive: date, since: Optional[str]):
+    """
+    把 [start, end) 拆成 ("year", yyyy) / ("month", yyyymm) / ("days", start, end)；
+    只有 enabled_since 早於該段起始日的整年 / 整月才用彙總文件
+    """
+    segments = []
+    cur = start_dt
+    while cur < end_dt_exclusive:
+        next_year = date(cur.year + 1, 1, 1)
+        next_month = _next_month(cur)
+        if since is not None and since < ymd(cur) and cur.month == 1 and cur.day == 1 and next_year <= end_dt_exclusive:
+            segments.append(("year", f"{cur.year}"))
+            cur = next_year
+        elif since is not None and since < ymd(cur) and cur.day == 1 and next_month <= end_dt_exclusive:
+            segments.append(("month", f"{cur.year}{cur.month:02d}"))
+            cur = next_month
+        else:
+            end = min(next_month, end_dt_exclusive)
+            if segments and segments[-1][0] == "days" and segments[-1][2] == cur:
+                segments[-1] = ("days", segments[-1][1], end)
+            else:
+                segments.append(("days", cur, end))
+            cur = end
+    return segments
+
+
+def rollups_enabled_since(stores: Iterable[str]) -> Dict[str, Optional[str]]:
+    stores = [s for s in dict.fromkeys(stores) if s]
+    found = get_all_chunked([rollup_meta_ref(s) for s in stores])
+    return {s: (found.get(rollup_meta_ref(s).path) or {}).get("enabled_since") for s in stores}
+
+
+def _aggregate_ranges(stores: Iterable[str], ranges: List[Tuple[date, date]],
+                      metrics: Sequence[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """{store: [每個區間的 totals]}；兩次 get_all：先讀各店 enabled_since，再一次抓所有彙總與逐日文件"""
+    metrics = tuple(metrics)
+    field_paths = _field_paths(metrics)
+    stores = [s for s in dict.fromkeys(stores) if s]
+    since = rollups_enabled_since(stores)
+
+    refs_by_store: Dict[str, List[List[Any]]] = {}
+    for store in stores:
+        per_range = []
+        for start_dt, end_dt_exclusive in ranges:
+            refs = []
+            for seg in _segments(start_dt, end_dt_exclusive, since.get(store)):
+                # 分片直接逐片 fold，相加結果與先合併再 fold 相同
+                if seg[0] == "year":
+                    refs.extend(all_shards(yearly_summary_ref, store, seg[1]))
+                elif seg[0] == "month":
+                    refs.extend(all_shards(monthly_summary_ref, store, seg[1]))
+                else:
+                    for d in iter_days(seg[1], seg[2]):
+                        refs.extend(all_shards(daily_summary_ref, store, d))
+            per_range.append(refs)
+        refs_by_store[store] = per_range
+
+    found = get_all_chunked([r for per_range in refs_by_store.values() for refs in per_range for r in refs], field_paths)
+    return {
+        store: [aggregate((found.get(r.path) for r in refs), metrics) for refs in per_range]
+        for store, per_range in refs_by_store.items()
+    }
+
+
+def aggregate_range(stores: Iterable[str], start_dt: date, end_dt_exclusive: date,
+                    metrics: Sequence[str] = ALL_METRICS) -> Dict[str, Dict[str, Any]]:
+    """同 aggregate_stores()，但整年 / 整月優先讀 yearly / monthly 彙總（一份文件取代最多 366 份）"""
+    per_store = _aggregate_ranges(stores, [(start_dt, end_dt_exclusive)], metrics)
+    return {store: totals[0] for store, totals in per_store.items()}
+
+
+def monthly_series(stores: Iterable[str], year: int,
+                   metrics: Sequence[str] = ALL_METRICS) -> Dict[str, List[Dict[str, Any]]]:
+    """{store: [1 月 totals, ..., 12 月 totals]}；不可信的月份退回 daily_summary"""
+    ranges = [(date(year, m, 1), _next_month(date(year, m, 1))) for m in range(1, 13)]
+    return _aggregate_ranges(stores, ranges, metrics)
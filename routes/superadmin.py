@@ -1,19 +1,26 @@
 # routes/superadmin.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from firebase_config import db
 from routes.auth import token_required
+from routes import catalog_index
+from routes.utils_geo import geocode_for_user
+from routes import fanout, stock_summary, summary_store
 from datetime import datetime, timedelta, date
 import calendar
-import requests
-from collections import defaultdict
 from google.cloud import firestore
 import json
 from google.cloud.firestore_v1 import FieldFilter
 import os
 import types # 用於檢查 generator 類型
+import time
 
 superadmin_bp = Blueprint("superadmin", __name__)
 
+# /get_store_locations 整體等待上限（秒）；超過就回傳已完成的部分
+STORE_LOCATIONS_TIMEOUT = float(os.getenv("STORE_LOCATIONS_TIMEOUT", "8"))
+# 庫存總覽：各分店同時查詢，整體最多等這麼久（秒）
+INVENTORY_OVERVIEW_TIMEOUT = float(os.getenv("INVENTORY_OVERVIEW_TIMEOUT", "20"))
+
 # ------------- 共用工具函式 -------------
 
 def _norm(s: str) -> str:
@@ -24,24 +31,12 @@ def _get_ing_doc_ref(store: str, ingredient_id: str | None, ingredient_name: str
     if ingredient_id:
         return col.document(ingredient_id)
     if ingredient_name:
-        # 名稱對應（大小寫不敏感，建議你日後在食材文件儲存 name_lower 以利索引）
-        q = col.where("name", "==", ingredient_name).limit(1).stream()
-        doc = next(q, None)
-        if doc:
-            return col.document(doc.id)
+        # 名稱對應（大小寫不敏感，走行程內食材名稱索引）
+        doc_id = catalog_index.get_ingredient_doc_id(store, ingredient_name)
+        if doc_id:
+            return col.document(doc_id)
     return None
 
-def _ymd(dt: date) -> str:
-    """date -> 'YYYYMMDD'"""
-    return f"{dt.year}{dt.month:02d}{dt.day:02d}"
-
-def _iter_days(start_dt: date, end_dt_exclusive: date):
-    """yield date from start_dt (inclusive) to end_dt_exclusive (exclusive)"""
-    cur = start_dt
-    while cur < end_dt_exclusive:
-        yield cur
-        cur += timedelta(days=1)
-
 def _month_range(year: int, month: int):
     """return (start_date, end_date_exclusive) of the month"""
     start_dt = date(year, month, 1)
@@ -51,68 +46,10 @@ def _month_range(year: int, month: int):
         end_dt = date(year, month + 1, 1)
     return start_dt, end_dt
 
-def _get_daily_summary(store_name: str, dt: date):
-    """讀取單日 summary（可能不存在）"""
-    doc_ref = (
-        db.collection("stores").document(store_name)
-          .collection("dates").document(_ymd(dt))
-          .collection("daily_summary").document("summary")
-    )
-    snap = doc_ref.get()
-    return snap.to_dict() if snap.exists else None
-
-def _ym_keys_for_year(year: int):
-    return [f"{year}{m:02d}" for m in range(1, 13)]
-
-def _monthly_doc_ref(store: str, yyyymm: str):
-    return (db.collection("stores").document(store)
-              .collection("months").document(yyyymm)
-              .collection("monthly_summary").document("summary"))
-
 def _sum_store_revenue_between(store_name: str, start_dt: date, end_dt_exclusive: date) -> int:
-    """用 daily_summary 累加指定區間的 revenue"""
-    total = 0
-    for d in _iter_days(start_dt, end_dt_exclusive):
-        data = _get_daily_summary(store_name, d)
-        if data:
-            total += int(data.get("revenue", 0))
-    return total
-
-def _sum_store_orders_between(store_name: str, start_dt: date, end_dt_exclusive: date) -> int:
-    """用 daily_summary 累加指定區間的 orders_count"""
-    total = 0
-    for d in _iter_days(start_dt, end_dt_exclusive):
-        data = _get_daily_summary(store_name, d)
-        if data:
-            total += int(data.get("orders_count", 0))
-    return total
-
-def _sum_store_flavor_counts_in_month(store_name: str, year: int, month: int):
-    """回傳 (counts_map, labels_map)，用當月每天的 flavor_counts 相加，labels 以最後一次出現為準"""
-    start_dt, end_dt = _month_range(year, month)
-    counts = defaultdict(int)
-    labels = {}
-    for d in _iter_days(start_dt, end_dt):
-        data = _get_daily_summary(store_name, d)
-        if not data:
-            continue
-        fc = data.get("flavor_counts", {}) or {}
-        for fid, cnt in fc.items():
-            try:
-                counts[fid] += int(cnt)
-            except Exception:
-                pass
-        fl = data.get("flavor_labels", {}) or {}
-        # 用最後一次看到的標籤覆蓋（通常一致）
-        for fid, name in fl.items():
-            labels[fid] = name
-    return counts, labels
-
-def _safe_int(x, default=0):
-    try:
-        return int(x)
-    except Exception:
-        return default
+    """累加指定區間的 revenue（整年 / 整月讀彙總文件，其餘 daily_summary；只投影 revenue）"""
+    totals = summary_store.aggregate_range([store_name], start_dt, end_dt_exclusive, ("revenue",))
+    return int(totals.get(store_name, {}).get("revenue", 0))
 
 # 固定菜單對照表（menu_id → 中文名稱）
 MENU_ID_TO_NAME = {
@@ -155,86 +92,18 @@ def _parse_date(val):
             return datetime.utcfromtimestamp(sec).date()
     return None
 
-def _sum_available_and_earliest_exp(ing_ref, parent_data: dict):
+def _sum_available_and_earliest_exp(agg, parent_data: dict):
     """
     回傳 (total_available, earliest_exp_date)
     total_available = sum(batches.status in ['in_use','unused'])
     earliest_exp_date = 上述可用批次中最早 expiration_date
-    若沒有 batches（舊資料），fallback parent quantity/expiration_date
+    agg 為 stock_summary.read_store() 的彙總；讀不到（None）時 fallback parent quantity/expiration_date
     """
-    total = 0.0
-    earliest = None
-
-    try:
-        batches_col = ing_ref.collection("batches")
-        for st in ("in_use", "unused"):
-            for b in batches_col.where("status", "==", st).stream():
-                bd = b.to_dict() or {}
-                q = _to_float(bd.get("quantity"), 0.0)
-                if q > 0:
-                    total += q
-                exp = _parse_date(bd.get("expiration_date"))
-                if exp:
-                    earliest = exp if (earliest is None or exp < earliest) else earliest
-        return total, earliest
-    except Exception:
-        # fallback：若 batches 讀不到，退回父文件
+    if agg is None:
         q = _to_float(parent_data.get("quantity"), 0.0)
         exp = _parse_date(parent_data.get("expiration_date"))
         return q, exp
-
-# ------------- 地圖：地址轉經緯度 -------------
-
-def geocode_address(address):
-    """
-    優先用 Google Geocoding；失敗再退回 OSM。
-    回傳 (lat, lon)；若都失敗回 (None, None)
-    """
-    api_key = os.getenv("GOOGLE_API_KEY")
-
-    # --- Google 優先 ---
-    if api_key:
-        try:
-            g_url = "https://maps.googleapis.com/maps/api/geocode/json"
-            params = {
-                "address": address,
-                "region": "tw",
-                "language": "zh-TW",
-                "key": api_key,
-            }
-            resp = requests.get(g_url, params=params, timeout=8)
-            resp.raise_for_status()
-            j = resp.json()
-            if j.get("status") == "OK" and j.get("results"):
-                loc = j["results"][0]["geometry"]["location"]
-                return float(loc["lat"]), float(loc["lng"])
-            else:
-                print(f"[geocode_address][Google] 失敗：{j.get('status')}")
-        except Exception as e:
-            print(f"[geocode_address][Google] 例外：{address} => {e}")
-
-    # --- OSM fallback ---
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            "q": address,
-            "format": "json",
-            "limit": 1,
-            "countrycodes": "tw",
-            "accept-language": "zh-TW",
-        }
-        headers = {"User-Agent": "yaoyao-superadmin-map"}
-        resp = requests.get(url, params=params, headers=headers, timeout=8)
-        resp.raise_for_status()
-        data = resp.json()
-        if data:
-            lat = float(data[0]["lat"])
-            lon = float(data[0]["lon"])
-            return lat, lon
-    except Exception as e:
-        print(f"[geocode_address][OSM] 失敗：{address} => {e}")
-
-    return None, None
+    return stock_summary.available(agg), _parse_date(stock_summary.earliest(agg))
 
 # ------------- API 區 -------------
 
@@ -257,11 +126,9 @@ def get_all_store_revenue():
     if range_type == "7days":
         start_dt = today - timedelta(days=6)
         labels = [(start_dt + timedelta(days=i)).strftime("%m/%d") for i in range(7)]
+        per_store = summary_store.read_daily_summaries(store_names, start_dt, today + timedelta(days=1), ("revenue",))
         for store in store_names:
-            revenues = []
-            for d in _iter_days(start_dt, today + timedelta(days=1)):
-                data = _get_daily_summary(store, d)
-                revenues.append(_safe_int(data.get("revenue")) if data else 0)
+            revenues = summary_store.field_series(per_store.get(store, [None] * 7), "revenue")
             result.append({"store_name": store, "dates": labels, "revenues": revenues})
 
     elif range_type == "month":
@@ -281,34 +148,19 @@ def get_all_store_revenue():
             labels.append(d.strftime("%m/%d"))
             d += timedelta(days=1)
 
+        per_store = summary_store.read_daily_summaries(store_names, start_dt, end_for_label, ("revenue",))
         for store in store_names:
-            revenues = []
-            d = start_dt
-            while d < end_for_label:
-                data = _get_daily_summary(store, d)
-                revenues.append(_safe_int(data.get("revenue")) if data else 0)
-                d += timedelta(days=1)
+            revenues = summary_store.field_series(per_store.get(store, [None] * len(labels)), "revenue")
             result.append({"store_name": store, "dates": labels, "revenues": revenues})
 
     elif range_type == "year":
         y = int(request.args.get("year", today.year))
-        ym_keys = _ym_keys_for_year(y)
-        labels = [f"{int(ym[4:6])}月" for ym in ym_keys]
+        labels = [f"{m}月" for m in range(1, 13)]
 
+        # 每月讀 monthly_summary（尚未有彙總的月份退回 daily_summary），所有店一次 get_all
+        per_store = summary_store.monthly_series(store_names, y, ("revenue",))
         for store in store_names:
-            refs = [_monthly_doc_ref(store, ym) for ym in ym_keys]
-            docs = db.get_all(refs)
-            month_to_rev = {}
-            for doc in docs:
-                parts = doc.reference.path.split("/")
-                yyyymm = parts[parts.index("months") + 1] if "months" in parts else None
-                if not yyyymm:
-                    continue
-                if doc.exists:
-                    data = doc.to_dict() or {}
-                    rev = float(data.get("total_revenue", data.get("revenue", 0)) or 0)
-                    month_to_rev[yyyymm] = round(rev, 2)
-            revenues = [month_to_rev.get(ym, 0) for ym in ym_keys]
+            revenues = [int(t["revenue"]) for t in per_store.get(store, [])] or [0] * 12
             result.append({"store_name": store, "dates": labels, "revenues": revenues})
     else:
         return jsonify({"error": "range 參數錯誤，允許值：7days / month / year"}), 400
@@ -334,10 +186,13 @@ def get_store_flavor_sales():
     store_names = user.get("store_ids", [])
     result = {}
 
+    start_dt, end_dt = _month_range(y, m)
+    per_store = summary_store.aggregate_range(store_names, start_dt, end_dt, ("flavors",))
     for store in store_names:
-        counts, labels = _sum_store_flavor_counts_in_month(store, y, m)
+        totals = per_store.get(store) or summary_store.empty_totals(("flavors",))
+        labels = totals["flavor_labels"]
         pie = []
-        for fid, qty in counts.items():
+        for fid, qty in totals["flavor_counts"].items():
             name = labels.get(fid, fid)
             pie.append({"name": name, "value": int(qty)})
         result[store] = pie
@@ -355,13 +210,11 @@ def get_summary_this_month():
     today = date.today()
     start_dt, end_dt = _month_range(today.year, today.month)
 
-    total_sales = 0
-    total_orders = 0
-    for store in store_names:
-        total_sales += _sum_store_revenue_between(store, start_dt, end_dt)
-        total_orders += _sum_store_orders_between(store, start_dt, end_dt)
+    # 每份 summary 只讀一次，revenue 與 orders_count 同一趟累加
+    metrics = ("revenue", "orders_count")
+    totals = summary_store.combine(summary_store.aggregate_range(store_names, start_dt, end_dt, metrics).values(), metrics)
 
-    return jsonify({"total_sales": int(total_sales), "total_orders": int(total_orders)}), 200
+    return jsonify({"total_sales": int(totals["revenue"]), "total_orders": int(totals["orders_count"])}), 200
 
 @superadmin_bp.route("/get_top_flavors", methods=["GET"])
 @token_required
@@ -380,16 +233,12 @@ def get_top_flavors():
         return jsonify({"error": "月份格式錯誤，需為 YYYY-MM"}), 400
 
     store_names = user.get("store_ids", [])
-    total_counts = defaultdict(int)
-    latest_labels = {}
-
-    for store in store_names:
-        counts, labels = _sum_store_flavor_counts_in_month(store, y, m)
-        for fid, qty in counts.items():
-            total_counts[fid] += int(qty)
-        latest_labels.update(labels)
+    start_dt, end_dt = _month_range(y, m)
+    per_store = summary_store.aggregate_range(store_names, start_dt, end_dt, ("flavors",))
+    totals = summary_store.combine((per_store[s] for s in store_names if s in per_store), ("flavors",))
+    latest_labels = totals["flavor_labels"]
 
-    top10 = sorted(total_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+    top10 = sorted(totals["flavor_counts"].items(), key=lambda x: x[1], reverse=True)[:10]
     result = [{"name": latest_labels.get(fid, fid), "value": int(qty)} for fid, qty in top10]
     return jsonify(result), 200
 
@@ -416,24 +265,13 @@ def get_inventory_by_store():
     result = []
     ing_col = db.collection("stores").document(store).collection("ingredients")
 
-    for doc in ing_col.stream():
+    ing_docs = list(ing_col.stream())
+    aggs = stock_summary.read_store(db, store, ing_docs)
+
+    for doc in ing_docs:
         data = doc.to_dict() or {}
-        ing_ref = doc.reference
-        total = 0.0
-        earliest = None
-        try:
-            batches = ing_ref.collection("batches")
-            for st in ("in_use", "unused"):
-                for b in batches.where("status", "==", st).stream():
-                    bd = b.to_dict() or {}
-                    qty = _to_float(bd.get("quantity"))
-                    total += qty
-                    exp = _parse_date(bd.get("expiration_date"))
-                    if exp:
-                        earliest = exp if earliest is None or exp < earliest else earliest
-        except Exception:
-            total = _to_float(data.get("quantity"))
-            earliest = _parse_date(data.get("expiration_date"))
+        total, earliest = _sum_available_and_earliest_exp(aggs.get(doc.id), data)
+        data.pop(stock_summary.STOCK_FIELD, None)
 
         data["quantity"] = int(round(total))
         data["expiration_date"] = earliest.isoformat() if earliest else None
@@ -461,8 +299,9 @@ def get_store_revenue_rank():
     store_names = user.get("store_ids", [])
     store_sales = []
 
+    per_store = summary_store.aggregate_range(store_names, start_dt, end_dt, ("revenue",))
     for store in store_names:
-        total = _sum_store_revenue_between(store, start_dt, end_dt)
+        total = per_store.get(store, {}).get("revenue", 0)
         store_sales.append({"store_name": store, "total_sales": int(total)})
 
     store_sales.sort(key=lambda x: x["total_sales"], reverse=True)
@@ -498,30 +337,42 @@ def get_store_locations():
     else:
         return jsonify({"error": "range 參數錯誤，允許值：7days / month / year"}), 400
 
-    users_ref = db.collection("users")
-    docs = users_ref.stream()
-    store_list = []
-    for doc in docs:
+    stores = []
+    for doc in db.collection("users").stream():
         data = doc.to_dict() or {}
-        role = data.get("role", "")
-        if role not in ["developer", "staff"]:
+        if data.get("role", "") not in ["developer", "staff"]:
             continue
+        stores.append((doc.id, data))
+
+    # 每家店的營收彙總與 geocoding 同時送出，整體最多等 STORE_LOCATIONS_TIMEOUT 秒；
+    # 逾時或失敗的欄位回 0 / None，並在該筆標記 partial
+    tasks = {}
+    for idx, (username, data) in enumerate(stores):
         store_name = data.get("store_name", "")
-        address = data.get("address", "")
-        revenue = 0
         if store_name:
-            try:
-                revenue = _sum_store_revenue_between(store_name, start_dt, end_dt)
-            except Exception as e:
-                print(f"[get_store_locations] 營收查詢失敗 {store_name}: {e}")
-        lat, lon = geocode_address(address)
-        store_list.append({
-            "store_name": store_name,
-            "address": address,
+            tasks[(idx, "revenue")] = (lambda s=store_name: _sum_store_revenue_between(s, start_dt, end_dt))
+        tasks[(idx, "geo")] = (lambda d=data, u=username: geocode_for_user(d, username=u))
+    res = fanout.run_all(tasks, timeout=STORE_LOCATIONS_TIMEOUT)
+    for key, err in res.errors.items():
+        print(f"[get_store_locations] 查詢失敗 {stores[key[0]][1].get('store_name', '')} {key[1]}: {err}")
+    if res.timed_out:
+        print(f"[get_store_locations] 逾時 {len(res.timed_out)} 項（{res.elapsed_seconds:.2f}s）")
+
+    store_list = []
+    for idx, (username, data) in enumerate(stores):
+        lat, lon = res.get((idx, "geo")) or (None, None)
+        item = {
+            "store_name": data.get("store_name", ""),
+            "address": data.get("address", ""),
             "latitude": lat,
             "longitude": lon,
-            "revenue": int(revenue),
-        })
+            "revenue": int(res.get((idx, "revenue")) or 0),
+        }
+        incomplete = [k[1] for k in list(res.errors) + res.timed_out if k[0] == idx]
+        if incomplete:
+            item["partial"] = True
+            item["incomplete_fields"] = sorted(incomplete)
+        store_list.append(item)
 
     return jsonify(store_list), 200
 
@@ -583,7 +434,8 @@ def transfer_ingredient():
         if not from_snap.exists or not to_snap.exists:
             raise ValueError("ingredient missing")
 
-        to_data = to_snap.to_dict()
+        from_data = from_snap.to_dict() or {}
+        to_data = to_snap.to_dict() or {}
 
         # 找來源 in_use 批次
         inuse_docs = list(
@@ -603,33 +455,50 @@ def transfer_ingredient():
             raise ValueError("not enough stock")
 
         new_qty = cur_qty - qty
+        new_status = "depleted" if new_qty == 0 else "in_use"
+        # 若目的沒有 active 批次 → 直接 in_use
+        to_status = "in_use" if not to_data.get("current_batch_id") else "unused"
+
+        # 庫存彙總（讀取階段）：來源批次用完會改變效期，要重讀全部批次；否則直接減量
+        from_agg = stock_summary.from_doc(from_data)
+        if from_agg is None or new_status == "depleted":
+            from_active = stock_summary.read_active_batches_tx(tx, from_ref)
+            from_active[b.id] = {**bd, "quantity": new_qty, "status": new_status}
+            from_agg = stock_summary.summarize(from_active.values())
+        else:
+            from_agg["in_use_sum"] -= qty
+        to_agg = stock_summary.add_batch(
+            stock_summary.load_tx(tx, to_ref, to_data), to_status, qty, bd.get("expiration_date")
+        )
 
         # 更新來源
         tx.update(b.reference, {
             "quantity": new_qty,
-            "status": "depleted" if new_qty == 0 else "in_use"
+            "status": new_status
         })
+        tx.update(from_ref, stock_summary.stock_update(from_agg))
 
         # 新增目的批次
         new_batch_ref = to_ref.collection("batches").document()
         tx.set(new_batch_ref, {
+            "store": to_store,
             "quantity": qty,
             "unit": unit,
-            "status": "unused",
+            "status": to_status,
             "created_at": firestore.SERVER_TIMESTAMP,
             "expiration_date": bd.get("expiration_date"),
             "note": f"from {from_store}"
         })
 
-        # 若目的沒有 active 批次 → 直接 in_use
-        if not to_data.get("current_batch_id"):
-            tx.update(new_batch_ref, {"status": "in_use"})
-            tx.update(to_ref, {
+        to_upd = stock_summary.stock_update(to_agg)
+        if to_status == "in_use":
+            to_upd.update({
                 "current_batch_id": new_batch_ref.id,
                 "quantity": qty,
                 "status": "in_stock"
             })
-        
+        tx.update(to_ref, to_upd)
+
         # [FIX] 寫入交易紀錄
         log_ref = db.collection("transaction").document()
         tx.set(log_ref, {
@@ -694,9 +563,78 @@ def transfer_logs():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _store_inventory(store: str):
+    """單一分店的庫存：{"items": {食材名稱: {unit, quantity, earliest_expiration}}, "elapsed_ms": 耗時}"""
+    t0 = time.perf_counter()
+    ing_docs = list(db.collection("stores").document(store).collection("ingredients").stream())
+    aggs = stock_summary.read_store(db, store, ing_docs)
+
+    items = {}
+    for ing_doc in ing_docs:
+        ing = ing_doc.to_dict() or {}
+        name = (ing.get("name") or "").strip()
+        if not name:
+            continue
+
+        unit = (ing.get("unit") or "").strip()
+        store_total, store_earliest = _sum_available_and_earliest_exp(aggs.get(ing_doc.id), ing)
+
+        item = items.setdefault(name, {"unit": unit, "quantity": 0.0, "earliest_expiration": None})
+        if not item["unit"] and unit:
+            item["unit"] = unit
+        item["quantity"] += float(store_total)
+        if store_earliest:
+            cur = item["earliest_expiration"]
+            if (cur is None) or (store_earliest.isoformat() < cur):
+                item["earliest_expiration"] = store_earliest.isoformat()
+
+    return {"items": items, "elapsed_ms": round((time.perf_counter() - t0) * 1000)}
+
+
+def _merge_store_inventory(agg: dict, items: dict) -> None:
+    """把一家店的結果併進全公司彙總 agg（每家店完成就併，不必等全部）"""
+    for name, item in items.items():
+        if name not in agg:
+            agg[name] = {
+                "name": name,
+                "unit": item["unit"],
+                "total_quantity": 0.0,
+                "earliest_expiration": None,
+                "out_of_stock_store_count": 0,
+            }
+        row = agg[name]
+
+        if not row["unit"] and item["unit"]:
+            row["unit"] = item["unit"]
+
+        row["total_quantity"] += item["quantity"]
+
+        store_earliest = item["earliest_expiration"]
+        if store_earliest:
+            cur = row["earliest_expiration"]
+            if (cur is None) or (store_earliest < cur):
+                row["earliest_expiration"] = store_earliest
+
+        if item["quantity"] <= 0:
+            row["out_of_stock_store_count"] += 1
+
+
+def _overview_rows(agg: dict) -> list:
+    rows = list(agg.values())
+    rows.sort(key=lambda r: r["name"])
+    return rows
+
+
 @superadmin_bp.route("/inventory_overview", methods=["GET"])
 @token_required
 def inventory_overview():
+    """
+    全分店庫存總覽：每家店各自一個工作同時查（fanout），整體最多等 INVENTORY_OVERVIEW_TIMEOUT 秒
+    - 預設回傳 {"rows": [...], "store_timings": {店名: 毫秒}, "failed_stores": {店名: 原因}}
+    - ?stream=1（或 Accept: application/x-ndjson）改成 NDJSON 串流：
+      每家店完成就送一行 {"type": "store", "store", "elapsed_ms", "rows"}，
+      最後一行 {"type": "summary", "rows", "store_timings", "failed_stores"} 為全公司彙總
+    """
     user = request.user
     if user.get("role") != "superadmin":
         return jsonify({"error": "你不是企業主"}), 403
@@ -705,45 +643,43 @@ def inventory_overview():
     if not store_names:
         return jsonify({"rows": []}), 200
 
-    agg = {}
+    streaming = (
+        request.args.get("stream", "").lower() in ("1", "true", "ndjson")
+        or "application/x-ndjson" in request.headers.get("Accept", "")
+    )
+    tasks = {store: (lambda s=store: _store_inventory(s)) for store in store_names}
+    agg, timings, failed = {}, {}, {}
+
+    def _collect():
+        """依完成順序交出每家店的結果，同時併進 agg / timings / failed"""
+        for store, value, error in fanout.iter_completed(tasks, timeout=INVENTORY_OVERVIEW_TIMEOUT):
+            if error is None:
+                _merge_store_inventory(agg, value["items"])
+                timings[store] = value["elapsed_ms"]
+            else:
+                failed[store] = error
+                print(f"[inventory_overview] {store} 查詢失敗：{error}")
+            yield store, value, error
+
+    if streaming:
+        def _generate():
+            for store, value, error in _collect():
+                line = {"type": "store", "store": store}
+                if error is None:
+                    line["elapsed_ms"] = value["elapsed_ms"]
+                    line["rows"] = [{"name": name, **item} for name, item in sorted(value["items"].items())]
+                else:
+                    line["error"] = error
+                yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+            summary = {"type": "summary", "rows": _overview_rows(agg), "store_timings": timings, "failed_stores": failed}
+            yield json.dumps(summary, ensure_ascii=False, default=str) + "\n"
+
+        return Response(_generate(), mimetype="application/x-ndjson")
+
     try:
-        for store in store_names:
-            ing_col = db.collection("stores").document(store).collection("ingredients")
-            for ing_doc in ing_col.stream():
-                ing = ing_doc.to_dict() or {}
-                name = (ing.get("name") or "").strip()
-                if not name:
-                    continue
-
-                unit = (ing.get("unit") or "").strip()
-                ing_ref = ing_doc.reference
-
-                store_total, store_earliest = _sum_available_and_earliest_exp(ing_ref, ing)
-
-                if name not in agg:
-                    agg[name] = {
-                        "name": name,
-                        "unit": unit,
-                        "total_quantity": 0.0,
-                        "earliest_expiration": None,
-                        "out_of_stock_store_count": 0,
-                    }
-
-                if not agg[name]["unit"] and unit:
-                    agg[name]["unit"] = unit
-
-                agg[name]["total_quantity"] += float(store_total)
-
-                if store_earliest:
-                    cur = agg[name]["earliest_expiration"]
-                    if (cur is None) or (store_earliest.isoformat() < cur):
-                        agg[name]["earliest_expiration"] = store_earliest.isoformat()
-
-                if float(store_total) <= 0:
-                    agg[name]["out_of_stock_store_count"] += 1
-
-        rows = list(agg.values())
-        rows.sort(key=lambda r: r["name"])
-        return jsonify({"rows": rows}), 200
+        for _ in _collect():
+            pass
+        print(f"[inventory_overview] 各店耗時(ms)：{timings}")
+        return jsonify({"rows": _overview_rows(agg), "store_timings": timings, "failed_stores": failed}), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
@@ -1,35 +1,247 @@
 # utils_geo.py
+"""
+地址 → 經緯度（唯一的 geocoding 入口）
+
+查詢順序：行程內 LRU → Firestore geo_cache/{地址雜湊} → Google → OSM Nominatim
+- 成功結果永久保存在 geo_cache；外部 API 明確回答查無此地址（Google ZERO_RESULTS / Nominatim 空結果）時
+  也記錄在 geo_cache（negative cache），GEO_NEGATIVE_TTL 秒內不再打外部 API
+- 逾時 / 5xx / 網路錯誤不寫 geo_cache，只在本行程 GEO_ERROR_BACKOFF 秒內不重試
+- geocode_for_user() 會優先用使用者文件上的 latitude/longitude，並把新查到的座標寫回 user / store 文件
+"""
+import hashlib
 import os
-import requests
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
 import certifi
-from urllib.parse import urlencode
-from typing import Optional, Tuple, List
+import requests
+from google.cloud import firestore
+
+from firebase_config import db
+from routes.auth import invalidate_user
+
+TIMEOUT = 8
+GEO_CACHE_COLLECTION = "geo_cache"
+GEO_LRU_SIZE = int(os.getenv("GEO_LRU_SIZE", "512"))
+GEO_NEGATIVE_TTL = float(os.getenv("GEO_NEGATIVE_TTL", "3600"))
+GEO_ERROR_BACKOFF = float(os.getenv("GEO_ERROR_BACKOFF", "60"))
+
+LatLng = Tuple[float, float]
 
-TIMEOUT = 6
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+_lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_lru_lock = threading.Lock()
+_written_back = set()  # (username, 正規化地址)：本行程已寫回過座標的就不再重寫
 
-def _get(url, headers=None, timeout=TIMEOUT):
+
+def normalize_address(addr: Any) -> str:
+    """快取用的地址正規化：去頭尾空白、合併空白、台→臺、英文字轉小寫"""
+    s = re.sub(r"\s+", " ", str(addr or "")).strip()
+    return s.replace("台", "臺").lower()
+
+
+def _cache_id(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _get(url, params=None, headers=None, timeout=TIMEOUT):
     try:
-        return requests.get(url, headers=headers or {}, timeout=timeout, verify=certifi.where())
-    except Exception:
+        r = requests.get(url, params=params, headers=headers or {}, timeout=timeout, verify=certifi.where())
+        r.raise_for_status()
+        return r
+    except Exception as e:
+        print(f"[utils_geo] HTTP 失敗：{url} => {e}")
         return None
 
-def geocode_google(addr: str) -> Optional[Tuple[float, float]]:
-    """用 Google Maps API 轉換地址 → (lat, lng)"""
-    if not GOOGLE_API_KEY:
-        return None
-    q = urlencode({"address": addr, "key": GOOGLE_API_KEY, "region": "tw", "language": "zh-TW"})
-    r = _get(f"https://maps.googleapis.com/maps/api/geocode/json?{q}")
-    if r and r.ok:
+
+def _google(addr: str) -> Tuple[Optional[LatLng], bool]:
+    """(座標, 是否有明確答案)；查無此地址為 (None, True)，連線 / 服務錯誤為 (None, False)"""
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        return None, True
+    params = {"address": addr, "key": api_key, "region": "tw", "language": "zh-TW"}
+    r = _get("https://maps.googleapis.com/maps/api/geocode/json", params=params)
+    if r is None:
+        return None, False
+    try:
         js = r.json()
         if js.get("status") == "OK" and js.get("results"):
             loc = js["results"][0]["geometry"]["location"]
-            return float(loc["lat"]), float(loc["lng"])
+            return (float(loc["lat"]), float(loc["lng"])), True
+    except Exception as e:
+        print(f"[utils_geo][Google] 回應格式錯誤：{e}")
+        return None, False
+    print(f"[utils_geo][Google] 失敗：{js.get('status')}")
+    return None, js.get("status") == "ZERO_RESULTS"
+
+
+def geocode_google(addr: str) -> Optional[LatLng]:
+    """用 Google Maps API 轉換地址 → (lat, lng)"""
+    return _google(addr)[0]
+
+
+def _osm(addr: str) -> Tuple[Optional[LatLng], bool]:
+    """(座標, 是否有明確答案)；空結果為 (None, True)，連線 / 服務錯誤為 (None, False)"""
+    params = {
+        "q": addr,
+        "format": "json",
+        "limit": 1,
+        "countrycodes": "tw",
+        "accept-language": "zh-TW",
+    }
+    r = _get("https://nominatim.openstreetmap.org/search", params=params,
+             headers={"User-Agent": "yaoyao-backend/1.0"})
+    if r is None:
+        return None, False
+    try:
+        data = r.json()
+        if data:
+            return (float(data[0]["lat"]), float(data[0]["lon"])), True
+    except Exception as e:
+        print(f"[utils_geo][OSM] 回應格式錯誤：{e}")
+        return None, False
+    return None, isinstance(data, list)
+
+
+def geocode_osm(addr: str) -> Optional[LatLng]:
+    """OpenStreetMap Nominatim（Google 失敗時的備援）"""
+    return _osm(addr)[0]
+
+
+# =========================
+# 快取
+# =========================
+def _lru_get(key: str) -> Optional[Dict[str, Any]]:
+    with _lru_lock:
+        entry = _lru.get(key)
+        if entry is None:
+            return None
+        if entry.get("expires_at") and entry["expires_at"] <= time.time():
+            _lru.pop(key, None)
+            return None
+        _lru.move_to_end(key)
+        return entry
+
+
+def _lru_put(key: str, entry: Dict[str, Any]) -> None:
+    with _lru_lock:
+        _lru[key] = entry
+        _lru.move_to_end(key)
+        while len(_lru) > GEO_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def _store_get(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        snap = db.collection(GEO_CACHE_COLLECTION).document(key).get()
+    except Exception as e:
+        print(f"[utils_geo] geo_cache 讀取失敗：{e}")
+        return None
+    if not snap.exists:
+        return None
+    data = snap.to_dict() or {}
+    if data.get("status") == "ok" and data.get("lat") is not None:
+        return {"lat": float(data["lat"]), "lng": float(data["lng"]), "expires_at": None}
+    retry_after = float(data.get("retry_after") or 0)
+    if data.get("status") == "failed" and retry_after > time.time():
+        return {"lat": None, "lng": None, "expires_at": retry_after}
     return None
 
-def geocode_best_effort(addr: str) -> Tuple[Optional[float], Optional[float], List[str]]:
-    """目前只用 Google，之後可加 Mapbox/OSM"""
-    latlng = geocode_google(addr)
+
+def _store_put(key: str, address: str, normalized: str, latlng: Optional[LatLng], source: str) -> None:
+    payload: Dict[str, Any] = {
+        "address": address,
+        "normalized": normalized,
+        "source": source,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
     if latlng:
-        return latlng[0], latlng[1], []
-    return None, None, ["geocode:google failed"]
+        payload.update({"status": "ok", "lat": latlng[0], "lng": latlng[1], "retry_after": None})
+    else:
+        payload.update({"status": "failed", "lat": None, "lng": None, "retry_after": time.time() + GEO_NEGATIVE_TTL})
+    try:
+        db.collection(GEO_CACHE_COLLECTION).document(key).set(payload)
+    except Exception as e:
+        print(f"[utils_geo] geo_cache 寫入失敗：{e}")
+
+
+def geocode_address(address: Any) -> Tuple[Optional[float], Optional[float]]:
+    """
+    回傳 (lat, lng)；查不到回 (None, None)
+    明確查無此地址記在 geo_cache GEO_NEGATIVE_TTL 秒；外部 API 出錯只在本行程 GEO_ERROR_BACKOFF 秒內不重試
+    """
+    normalized = normalize_address(address)
+    if not normalized:
+        return None, None
+    key = _cache_id(normalized)
+
+    entry = _lru_get(key)
+    if entry is None:
+        entry = _store_get(key)
+        if entry is None:
+            (latlng, google_ok), source = _google(str(address)), "google"
+            osm_ok = True
+            if latlng is None:
+                (latlng, osm_ok), source = _osm(str(address)), "osm"
+            if latlng:
+                _store_put(key, str(address), normalized, latlng, source)
+                print(f"📍({source}) 地址轉換成功：{address} → {latlng}")
+                entry = {"lat": latlng[0], "lng": latlng[1], "expires_at": None}
+            elif google_ok and osm_ok:
+                _store_put(key, str(address), normalized, None, "none")
+                print(f"❌ 地址轉換失敗（查無此地址）：{address}")
+                entry = {"lat": None, "lng": None, "expires_at": time.time() + GEO_NEGATIVE_TTL}
+            else:
+                # 連線 / 服務錯誤不代表地址不存在：不寫 geo_cache，其他 worker 與稍後的請求照常重試
+                print(f"⚠️ 地址轉換失敗（外部 API 錯誤，{GEO_ERROR_BACKOFF:.0f} 秒後重試）：{address}")
+                entry = {"lat": None, "lng": None, "expires_at": time.time() + GEO_ERROR_BACKOFF}
+        _lru_put(key, entry)
+
+    return entry["lat"], entry["lng"]
+
+
+def geocode_for_user(user: Dict[str, Any], username: Optional[str] = None) -> Tuple[Optional[float], Optional[float]]:
+    """
+    使用者 / 分店座標：
+    - user 文件上已有 latitude/longitude 且 geocoded_address 與目前地址相同 → 直接用
+    - 否則查 geocode_address()，成功就寫回 users/{username} 與 stores/{store_name}
+    """
+    address = (user or {}).get("address")
+    if not address:
+        return None, None
+
+    lat, lng = user.get("latitude"), user.get("longitude")
+    if lat is not None and lng is not None and normalize_address(user.get("geocoded_address")) == normalize_address(address):
+        return float(lat), float(lng)
+
+    lat, lng = geocode_address(address)
+    if lat is None:
+        return None, None
+
+    # request.user 可能來自 token claims（沒有座標欄位），同一地址每個行程只寫回一次
+    username = username or user.get("username")
+    written_key = (username or user.get("store_name"), normalize_address(address))
+    if written_key in _written_back:
+        return lat, lng
+
+    coords = {"latitude": lat, "longitude": lng, "geocoded_address": address}
+    try:
+        if username:
+            db.collection("users").document(username).update(coords)
+            invalidate_user(username)
+        if user.get("store_name"):
+            db.collection("stores").document(user["store_name"]).set(coords, merge=True)
+        _written_back.add(written_key)
+    except Exception as e:
+        print(f"[utils_geo] 座標寫回失敗：{username} => {e}")
+    return lat, lng
+
+
+def geocode_best_effort(addr: str) -> Tuple[Optional[float], Optional[float], List[str]]:
+    """相容舊介面：回傳 (lat, lng, errors)"""
+    lat, lng = geocode_address(addr)
+    if lat is not None:
+        return lat, lng, []
+    return None, None, ["geocode: google/osm failed"]
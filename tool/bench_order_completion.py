@@ -0,0 +1,207 @@
+# tool/bench_order_completion.py
+"""
+完成訂單延遲的前後對照：
+  legacy ：改版前的流程，依序 讀訂單 → 逐品項讀食譜、逐食材查文件並各開一個扣庫存 transaction
+           → 寫 completed_orders → running total transaction ×2 → 刪除 pending
+           （往返次數與改版前相同；扣庫存 / 彙總寫入的是現行資料格式，測完資料仍一致）
+  atomic ：orders._complete_order_atomic()，扣庫存 + 搬移 + running total + 旗標 + 刪除 全部一個 transaction
+  bulk   ：orders._complete_orders_bulk()，整批訂單一個 transaction（complete_multiple_orders 的路徑）
+
+每種模式先用 _create_order_logic 建立 --count 張測試訂單，再逐張完成並計時，印出平均 / p50 / p95 / 最大值；
+bulk 模式是整批一次完成，印出整批耗時（樣本為平均到每張的耗時）。
+
+⚠️ 會真的扣指定分店的庫存、寫入當天營收彙總，請對測試分店執行
+
+用法（在專案根目錄，以模組方式執行才找得到 firebase_config）：
+    python -m tool.bench_order_completion --store 測試店 --menu-id <menu_id> --count 20
+    python -m tool.bench_order_completion --store 測試店 --menu-id <menu_id> --mode atomic
+"""
+import argparse
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from google.cloud import firestore
+
+from firebase_config import db
+from routes import orders, summary_store
+
+
+# =========================
+# 改版前的完成訂單流程（逐步重現當時的 Firestore 往返）
+# =========================
+def _legacy_find_recipe(menu_id, menu_name):
+    """改版前：每個品項都直接查根目錄 recipes（id → 名稱 → where 查詢），沒有行程內索引"""
+    recipes_col = db.collection("recipes")
+    for key in (menu_id, menu_name):
+        if key:
+            snap = recipes_col.document(str(key)).get()
+            if snap.exists:
+                return snap.to_dict() or {}
+    for field, value in (("menu_id", menu_id), ("name", menu_name)):
+        if value:
+            docs = list(recipes_col.where(field, "==", value).limit(1).stream())
+            if docs:
+                return docs[0].to_dict() or {}
+    raise ValueError(f"找不到產品「{menu_name}」的食譜設定(recipes)，無法扣庫存！")
+
+
+def _legacy_deduct(store_name: str, items: list) -> None:
+    """改版前：每個品項查食譜、每種食材 where 查一次、每種食材各開一個扣庫存 transaction"""
+    for item in items:
+        try:
+            quantity = float(item.get("quantity", 1))
+        except Exception:
+            quantity = 1.0
+        recipe = _legacy_find_recipe(item.get("menu_id"), item.get("menu_name"))
+        ingredients_map = recipe.get("ingredients")
+        if not isinstance(ingredients_map, dict):
+            ingredients_map = {k: v for k, v in recipe.items() if isinstance(v, dict) and "amount" in v}
+
+        for ing_name, detail in ingredients_map.items():
+            amount = float((detail or {}).get("amount", 0) or 0)
+            if amount <= 0:
+                continue
+            ing_doc = next(
+                db.collection("stores").document(store_name).collection("ingredients")
+                  .where("name", "==", ing_name).limit(1).stream(),
+                None,
+            )
+            if not ing_doc:
+                raise ValueError(f"食譜需要「{ing_name}」，但在 {store_name} 庫存中找不到！")
+            ingredient_unit = orders.normalize_unit((ing_doc.to_dict() or {}).get("unit"))
+            recipe_unit = orders.normalize_unit((detail or {}).get("unit"))
+            if recipe_unit != ingredient_unit:
+                amount = orders.convert_amount(ingredient_unit, recipe_unit, amount)
+            # 單一食材的 transaction：讀食材 + 目前批次（不夠時再查預備批次）再寫回，跟改版前的往返次數相同；
+            # 用現行的版本是為了同時維護食材上的庫存彙總，測完不會留下對不上的資料
+            orders.consume_ingredient_with_batches(store_name, ing_doc.id, float(amount) * quantity)
+
+
+def _legacy_running_total(store_name: str, ymd: str, doc_id: str, order_data: dict) -> str:
+    """改版前：一個 transaction 讀防重旗標 → 累加 → 打旗標（寫入的文件改成現行的日 / 月 / 年彙總）"""
+    flag_ref = orders._applied_flag_ref(store_name, ymd, doc_id)
+    summary_store.mark_rollups_enabled(store_name, ymd)
+    increments = summary_store.increment_fields(order_data)
+
+    @firestore.transactional
+    def _txn(transaction):
+        if flag_ref.get(transaction=transaction).exists:
+            return "already_applied"
+        for ref, base in summary_store.rollup_refs(store_name, ymd):
+            transaction.set(ref, {**base, **increments}, merge=True)
+        transaction.set(flag_ref, {"order_id": doc_id, "applied_at": firestore.SERVER_TIMESTAMP})
+        return "applied"
+
+    return _txn(db.transaction())
+
+
+def _legacy_complete(store_name: str, order_id: str) -> None:
+    """
+    改版前 complete_order 的流程，每一步各自往返：
+      讀訂單 → 逐品項查食譜 / 逐食材查文件並各開一個扣庫存 transaction
+      → 寫 completed_orders → running total transaction（當時的程式呼叫了兩次）→ 刪除 pending
+    """
+    order_ref = db.collection("stores").document(store_name).collection("orders").document(order_id)
+    order_doc = order_ref.get()
+    if not order_doc.exists:
+        raise LookupError("訂單不存在")
+    order_data = order_doc.to_dict() or {}
+
+    _legacy_deduct(store_name, order_data.get("items", []))
+
+    ymd = orders.taipei_today_str_from_utc(datetime.utcnow())
+    doc_id = f"{ymd}-{order_data.get('order_number', 0)}"
+    order_data.update({
+        "order_id": order_id,   # 改版前沒有；補上讓 /order_status 查得到，不影響往返次數
+        "status": "completed",
+        "used_in_inventory_refresh": False,
+        "completed_at": firestore.SERVER_TIMESTAMP,
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "store_name": store_name,
+    })
+    (db.collection("stores").document(store_name)
+       .collection("dates").document(ymd)
+       .collection("completed_orders").document(doc_id)).set(order_data)
+    _legacy_running_total(store_name, ymd, doc_id, order_data)
+    _legacy_running_total(store_name, ymd, doc_id, order_data)
+    order_ref.delete()
+
+
+MODES = {
+    "legacy": _legacy_complete,
+    "atomic": orders._complete_order_atomic,
+    "bulk": None,
+}
+
+
+def bench(mode: str, store_name: str, menu_id: str, count: int, quantity: int):
+    order_ids = []
+    for _ in range(count):
+        order_id, _, _ = orders._create_order_logic(store_name, [{"menu_id": menu_id, "quantity": quantity}])
+        order_ids.append(order_id)
+
+    complete = MODES[mode] or orders._complete_order_atomic
+    complete(store_name, order_ids[0])  # 暖身：建立食譜 / 食材索引與 gRPC 連線，不計時
+
+    if mode == "bulk":
+        t0 = time.perf_counter()
+        report = orders._complete_orders_bulk(store_name, order_ids[1:])
+        elapsed = (time.perf_counter() - t0) * 1000
+        failed = [r for r in report.values() if r["status"] != "completed"]
+        if failed:
+            raise RuntimeError(f"{len(failed)} 張訂單未完成：{failed[0].get('error')}")
+        print(f"   bulk：{len(order_ids) - 1} 張共 {elapsed:.0f}ms")
+        return [elapsed / max(len(order_ids) - 1, 1)] * (len(order_ids) - 1)
+
+    samples = []
+    for order_id in order_ids[1:]:
+        t0 = time.perf_counter()
+        complete(store_name, order_id)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _report(mode, samples):
+    if not samples:
+        print(f"{mode:>7}: 沒有樣本（--count 至少要 2）")
+        return
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(len(ordered) * 0.95)) - 1)]
+    print(f"{mode:>7}: n={len(samples)} 平均={statistics.mean(samples):.0f}ms "
+          f"p50={statistics.median(samples):.0f}ms p95={p95:.0f}ms 最大={ordered[-1]:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="完成訂單延遲：舊流程 vs 單一 transaction vs 整批")
+    parser.add_argument("--store", required=True, help="測試分店（會真的扣庫存）")
+    parser.add_argument("--menu-id", required=True, help="要下單的菜單 id（需有食譜與庫存）")
+    parser.add_argument("--count", type=int, default=20, help="每種模式的訂單數（第一張為暖身不計時）")
+    parser.add_argument("--quantity", type=int, default=1, help="每張訂單的數量")
+    parser.add_argument("--mode", choices=["all", *MODES], default="all")
+    args = parser.parse_args()
+
+    modes = list(MODES) if args.mode == "all" else [args.mode]
+    results = {}
+    for mode in modes:
+        print(f"▶ {mode}：完成 {args.count} 張訂單 ...")
+        try:
+            results[mode] = bench(mode, args.store, args.menu_id, args.count, args.quantity)
+        except Exception as e:
+            print(f"❌ {mode} 失敗：{e}")
+            return 1
+
+    print("=" * 60)
+    for mode in modes:
+        _report(mode, results[mode])
+    if results.get("legacy"):
+        for mode in ("atomic", "bulk"):
+            if results.get(mode):
+                speedup = statistics.median(results["legacy"]) / max(statistics.median(results[mode]), 1e-9)
+                print(f"{mode} 相對 legacy 的 p50 加速：{speedup:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+# tool/export_numpy_models.py
+"""
+把 models/ 內各口味的 Keras 模型（.h5）匯出成純 NumPy 權重（*_lstm.npz），
+並用真實歷史資料 + 隨機輸入比對 Keras 與 NumPy 的預測，超出容許誤差就失敗。
+
+用法（在專案根目錄，需安裝 TensorFlow）：
+    python tool/export_numpy_models.py
+"""
+import sys
+
+import joblib
+import numpy as np
+
+try:
+    from tool import model_registry, numpy_lstm
+    from tool.lstm_predict_all import SEQ_LEN, build_forecast_inputs, get_history
+except ImportError:
+    import model_registry  # 直接在 tool/ 底下執行時
+    import numpy_lstm
+    from lstm_predict_all import SEQ_LEN, build_forecast_inputs, get_history
+
+# 比對的是 scaled 空間（0~1）的輸出，float32 累積誤差遠小於此
+ATOL = 1e-4
+
+
+def export_all(atol: float = ATOL) -> bool:
+    from tensorflow.keras.models import load_model
+
+    pivot_df, flavors = get_history()
+    rng = np.random.default_rng(0)
+    ok = True
+
+    for flavor in flavors:
+        h5_path, scaler_path = model_registry.model_paths(flavor)
+        npz_path = model_registry.numpy_model_path(flavor)
+        try:
+            keras_model = load_model(h5_path, compile=False)
+        except Exception as e:
+            print(f"⚠️ 略過 {flavor}：無法載入 {h5_path}（{e}）")
+            continue
+
+        numpy_lstm.export_keras_model(keras_model, npz_path)
+        np_model = numpy_lstm.NumpySequential.load(npz_path)
+
+        scaler = joblib.load(scaler_path)
+        X, _, _ = build_forecast_inputs([flavor], pivot_df, {flavor: scaler}, SEQ_LEN)
+        n_features = X.shape[-1]
+        x = np.concatenate([X, rng.random((16, SEQ_LEN, n_features))]).astype(np.float32)
+
+        expected = keras_model.predict(x, verbose=0)
+        actual = np_model.predict(x)
+        diff = float(np.max(np.abs(expected - actual)))
+        status = "✅" if diff <= atol else "❌"
+        print(f"{status} {flavor} → {npz_path}  max|keras-numpy|={diff:.2e}")
+        ok = ok and diff <= atol
+
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if export_all() else 1)
@@ -4,6 +4,8 @@ from firebase_admin import credentials, firestore
 from typing import Dict, Any, Tuple, Optional
 from datetime import datetime, date, timezone
 
+from routes import stock_summary
+
 db = None
 
 # ====== 初始化 ======
@@ -117,6 +119,8 @@ def fetch_ingredient_inventory(store_name: str) -> Dict[str, Dict[str, Any]]:
       （忽略 depleted）
     - expiration_date = 在上述可用批次中，挑最早的 expiration_date（若有）
     - 若某食材沒有 batches（舊資料），fallback 用父文件 quantity/expiration_date
+    - 上述數字直接讀食材文件上的 stock 彙總（routes/stock_summary.py），不再逐一查 batches；
+      舊資料沒有彙總時再補一次整店 collection_group 批次查詢
     - key：一律用『食材名稱大寫』，方便跟食譜需求對齊
     """
     init_firebase()
@@ -126,7 +130,10 @@ def fetch_ingredient_inventory(store_name: str) -> Dict[str, Dict[str, Any]]:
     ingredients_ref = db.collection("stores").document(store_name).collection("ingredients")
     inventory: Dict[str, Dict[str, Any]] = {}
 
-    for doc in ingredients_ref.stream():
+    ing_docs = list(ingredients_ref.stream())
+    aggs = stock_summary.read_store(db, store_name, ing_docs)
+
+    for doc in ing_docs:
         data = doc.to_dict() or {}
 
         name = (data.get("name") or doc.id or "").strip()
@@ -136,28 +143,15 @@ def fetch_ingredient_inventory(store_name: str) -> Dict[str, Dict[str, Any]]:
         key = name.upper()
         unit = data.get("unit", "")
 
-        batches_ref = ingredients_ref.document(doc.id).collection("batches")
-
         total = 0.0
         earliest: Optional[date] = None
-        has_any_batch = False
 
-        try:
-            # 用兩次 where 最穩（避免 in() 在不同環境的兼容問題）
-            for st in ("in_use", "unused"):
-                for b in batches_ref.where("status", "==", st).stream():
-                    has_any_batch = True
-                    bd = b.to_dict() or {}
-                    qty = _to_float(bd.get("quantity"), 0.0)
-                    if qty > 0:
-                        total += qty
-
-                    exp = _parse_to_date(bd.get("expiration_date"))
-                    if exp:
-                        earliest = exp if (earliest is None or exp < earliest) else earliest
-        except Exception:
-            # 批次讀取失敗：退回父文件
-            has_any_batch = False
+        # 庫存彙總（批次讀取失敗時不會有 agg → 退回父文件）
+        agg = aggs.get(doc.id)
+        has_any_batch = bool(agg and agg["batch_count"] > 0)
+        if has_any_batch:
+            total = stock_summary.available(agg)
+            earliest = _parse_to_date(stock_summary.earliest(agg))
 
         if not has_any_batch:
             total = _to_float(data.get("quantity"), 0.0)
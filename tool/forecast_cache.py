@@ -0,0 +1,172 @@
+# tool/forecast_cache.py
+"""
+預測結果快取：同一天、同樣天氣、同一版模型的預測直接重用
+
+key = (口味集合, 歷史資料最後日期, 今天日期, 四捨五入後的天氣向量, 模型檔案版本)
+- 行程內：dict + TTL
+- 設定 FORECAST_CACHE_PATH（例如 /tmp/yaoyao_forecast.sqlite）時，另寫入本機 SQLite，
+  同一台機器上的 gunicorn worker 共用
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", "3600"))
+FORECAST_CACHE_MAX_ENTRIES = int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "256"))
+FORECAST_CACHE_PATH = os.getenv("FORECAST_CACHE_PATH", "")
+
+# 天氣輸入四捨五入的粒度：雨量(降雨機率) 5、氣溫 0.5 度，差一點點的天氣共用同一筆預測
+RAINFALL_STEP = 5.0
+TEMPERATURE_STEP = 0.5
+
+_lock = threading.Lock()
+_memory: Dict[str, Dict[str, Any]] = {}
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def _round_to(value: Any, step: float) -> float:
+    try:
+        return round(round(float(value) / step) * step, 2)
+    except Exception:
+        return 0.0
+
+
+def weather_vector(future_weather: Iterable[Dict[str, Any]]) -> List[List[float]]:
+    return [
+        [_round_to(day.get("rainfall"), RAINFALL_STEP), _round_to(day.get("temperature"), TEMPERATURE_STEP)]
+        for day in (future_weather or [])
+    ]
+
+
+def make_key(namespace: str, **parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{namespace}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+def forecast_key(flavors: Iterable[str], last_history_date: Any, today: Any,
+                 future_weather: Iterable[Dict[str, Any]], model_version: str) -> str:
+    return make_key(
+        "forecast",
+        flavors=sorted(str(f) for f in flavors),
+        last_history_date=str(last_history_date),
+        today=str(today),
+        weather=weather_vector(future_weather),
+        model_version=model_version,
+    )
+
+
+# =========================
+# SQLite（選用，跨 worker 共用）
+# =========================
+def _connect() -> Optional[sqlite3.Connection]:
+    if not FORECAST_CACHE_PATH:
+        return None
+    conn = sqlite3.connect(FORECAST_CACHE_PATH, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS forecast_cache ("
+        " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    return conn
+
+
+def _disk_get(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        conn = _connect()
+        if conn is None:
+            return None
+        with conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM forecast_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        conn.close()
+        if row:
+            return {"value": json.loads(row[0]), "expires_at": row[1]}
+    except Exception as e:
+        print(f"[forecast_cache] SQLite 讀取失敗：{e}")
+    return None
+
+
+def _disk_put(key: str, value: Any, expires_at: float) -> None:
+    try:
+        conn = _connect()
+        if conn is None:
+            return
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO forecast_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+            conn.execute("DELETE FROM forecast_cache WHERE expires_at <= ?", (time.time(),))
+        conn.close()
+    except Exception as e:
+        print(f"[forecast_cache] SQLite 寫入失敗：{e}")
+
+
+# =========================
+# 對外介面
+# =========================
+def get(key: str) -> Optional[Any]:
+    now = time.time()
+    with _lock:
+        entry = _memory.get(key)
+        if entry and entry["expires_at"] > now:
+            _stats["hits"] += 1
+            return entry["value"]
+        _memory.pop(key, None)
+
+    entry = _disk_get(key)
+    if entry is not None:
+        with _lock:
+            _memory[key] = entry
+            _stats["disk_hits"] += 1
+        return entry["value"]
+
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+
+def put(key: str, value: Any, ttl: float = FORECAST_CACHE_TTL) -> None:
+    expires_at = time.time() + ttl
+    with _lock:
+        if len(_memory) >= FORECAST_CACHE_MAX_ENTRIES:
+            # 先清過期，還是太多就丟最早到期的
+            now = time.time()
+            for k in [k for k, e in _memory.items() if e["expires_at"] <= now]:
+                _memory.pop(k, None)
+            while len(_memory) >= FORECAST_CACHE_MAX_ENTRIES:
+                _memory.pop(min(_memory, key=lambda k: _memory[k]["expires_at"]))
+        _memory[key] = {"value": value, "expires_at": expires_at}
+    _disk_put(key, value, expires_at)
+
+
+def get_or_compute(key: str, compute: Callable[[], Any], ttl: float = FORECAST_CACHE_TTL) -> Any:
+    value = get(key)
+    if value is None:
+        value = compute()
+        if value is not None:
+            put(key, value, ttl)
+    return value
+
+
+def clear() -> None:
+    with _lock:
+        _memory.clear()
+    try:
+        conn = _connect()
+        if conn is not None:
+            with conn:
+                conn.execute("DELETE FROM forecast_cache")
+            conn.close()
+    except Exception as e:
+        print(f"[forecast_cache] SQLite 清除失敗：{e}")
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {**_stats, "entries": len(_memory), "sqlite_path": FORECAST_CACHE_PATH or None}
@@ -1,57 +1,135 @@
 # lstm_predict_all.py
 import os
+import json
+import time
+import hashlib
+import threading
 import pandas as pd
 import numpy as np
-import joblib
-from tensorflow.keras.models import load_model
 from datetime import timedelta
 
-MODEL_DIR = "models"
+try:
+    from tool import model_registry, numpy_lstm
+except ImportError:
+    import model_registry  # 直接在 tool/ 底下執行 CLI 時
+    import numpy_lstm
+
+MODEL_DIR = model_registry.MODEL_DIR
 SEQ_LEN = 7
 PRED_DAYS = 3
 
-# === 載入資料 ===
-df = pd.read_excel("adjusted_projectdata_v5_limited.xlsx")
-df['sales'] = df['adjusted_sales_v5']
-df['date'] = pd.to_datetime(df['date'])
-df['weekday'] = df['date'].dt.weekday
-df = df.sort_values(by=['flavor', 'date'])
+HISTORY_XLSX = "adjusted_projectdata_v5_limited.xlsx"
+# Excel 轉出來的欄式快取（.npy 可 memory-map + .json 欄位資訊），依來源檔 mtime/size 命名
+HISTORY_CACHE_DIR = os.getenv("HISTORY_CACHE_DIR", os.path.join(".cache", "history"))
 
-pivot_df = df.pivot_table(index='date', columns='flavor', values=['sales', 'rainfall', 'temperature', 'weekday'])
-pivot_df = pivot_df.fillna(0)
-pivot_df.columns = ['{}_{}'.format(var, flavor) for var, flavor in pivot_df.columns]
+_history = None
+_history_lock = threading.Lock()
 
-# ✅ Firebase 口味名稱清單
-flavors = df['flavor'].unique()
 
-# ✅ 檔名對照：Firebase名稱 → 模型資料夾名稱
-flavor_map = {
-    "珍珠鮮奶油": "珍珠奶油",
-    "黑芝麻鮮奶油": "黑芝麻奶油",
-    # 其他口味就直接用自己名字
-}
+# === 載入資料（第一次預測才讀；不在 import 時解析 Excel）===
+def _read_history_excel(path):
+    df = pd.read_excel(path)
+    df['sales'] = df['adjusted_sales_v5']
+    df['date'] = pd.to_datetime(df['date'])
+    df['weekday'] = df['date'].dt.weekday
+    df = df.sort_values(by=['flavor', 'date'])
 
-# === 載入模型與 scaler ===
-def load_models_and_data():
-    models = {}
-    scalers = {}
-    missing_flavors = []
+    pivot_df = df.pivot_table(index='date', columns='flavor', values=['sales', 'rainfall', 'temperature', 'weekday'])
+    pivot_df = pivot_df.fillna(0)
+    pivot_df.columns = ['{}_{}'.format(var, flavor) for var, flavor in pivot_df.columns]
+
+    # ✅ Firebase 口味名稱清單
+    flavors = [str(f) for f in df['flavor'].unique()]
+    return pivot_df, flavors
+
+
+def _history_cache_key(path):
+    st = os.stat(path)
+    raw = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def _history_cache_paths(key):
+    base = os.path.join(HISTORY_CACHE_DIR, f"history_{key}")
+    return base + ".npy", base + ".json"
+
+
+def _save_history_cache(key, pivot_df, flavors):
+    npy_path, meta_path = _history_cache_paths(key)
+    os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+    meta = {
+        "columns": list(pivot_df.columns),
+        "index": [d.isoformat() for d in pivot_df.index],
+        "flavors": list(flavors),
+    }
+    # 先寫暫存檔再 rename，避免多個 worker 同時寫出半個檔案
+    tmp_npy = f"{npy_path}.{os.getpid()}.tmp.npy"
+    tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+    np.save(tmp_npy, pivot_df.to_numpy(dtype=np.float64))
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_npy, npy_path)
+    os.replace(tmp_meta, meta_path)
+
+
+def _load_history_cache(key):
+    npy_path, meta_path = _history_cache_paths(key)
+    if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    values = np.load(npy_path, mmap_mode="r")
+    pivot_df = pd.DataFrame(values, index=pd.DatetimeIndex(meta["index"]), columns=meta["columns"], copy=False)
+    return pivot_df, meta["flavors"]
 
-    for flavor in flavors:
-        mapped_name = flavor_map.get(flavor, flavor)
-        model_path = f"{MODEL_DIR}/{mapped_name}_model.h5"
-        scaler_path = f"{MODEL_DIR}/{mapped_name}_scaler.pkl"
 
-        if os.path.exists(model_path) and os.path.exists(scaler_path):
+def get_history():
+    """回傳 (pivot_df, flavors)；第一次呼叫才載入，優先使用欄式快取"""
+    global _history
+    if _history is not None:
+        return _history
+    with _history_lock:
+        if _history is not None:
+            return _history
+        t0 = time.perf_counter()
+        key = _history_cache_key(HISTORY_XLSX)
+        loaded = None
+        try:
+            loaded = _load_history_cache(key)
+        except Exception as e:
+            print(f"⚠️ 歷史資料快取讀取失敗，改讀 Excel：{e}")
+        source = "cache"
+        if loaded is None:
+            loaded = _read_history_excel(HISTORY_XLSX)
+            source = "excel"
             try:
-                models[flavor] = load_model(model_path, compile=False)
-                scalers[flavor] = joblib.load(scaler_path)
-                print(f"✅ 成功載入模型與 scaler：{flavor}（實際檔名：{mapped_name}）")
+                _save_history_cache(key, *loaded)
             except Exception as e:
-                print(f"❌ 載入失敗：{flavor} → {str(e)}")
-        else:
-            print(f"⚠️ 缺少模型或 scaler 檔案：{mapped_name}")
-            missing_flavors.append(flavor)
+                print(f"⚠️ 歷史資料快取寫入失敗：{e}")
+        _history = loaded
+        print(f"📚 歷史資料載入完成（{source}，{time.perf_counter() - t0:.2f}s）")
+        return _history
+
+
+def __getattr__(name):
+    # 相容舊用法：lstm_predict_all.pivot_df / lstm_predict_all.flavors
+    if name == "pivot_df":
+        return get_history()[0]
+    if name == "flavors":
+        return get_history()[1]
+    raise AttributeError(name)
+
+# ✅ 檔名對照：Firebase名稱 → 模型資料夾名稱（定義在 model_registry）
+flavor_map = model_registry.FLAVOR_FILE_MAP
+
+# === 載入模型與 scaler（每個 worker 只載一次，之後直接取常駐快取）===
+def load_models_and_data():
+    # 檔案被重新訓練覆蓋時丟掉舊快取（有節流，不會每次都 stat）
+    model_registry.reload_if_changed()
+
+    pivot_df, flavors = get_history()
+    models, scalers = model_registry.get_models(flavors)
+    missing_flavors = [f for f in flavors if f not in models]
 
     print(f"📦 總共載入模型數：{len(models)} / {len(flavors)}")
     if missing_flavors:
@@ -82,6 +160,123 @@ def forecast_next_sales(flavor, pivot_df, model, scaler, future_weather, seq_len
 
     return y_pred_inv.round(1)
 
+# === 批次預測：所有口味一次組輸入、每組模型只呼叫一次 ===
+_stacked_models = {}  # tuple(flavors) -> (tuple(id(model)), stacked_model)
+
+
+def build_forecast_inputs(flavors, pivot_df, scalers, seq_len=SEQ_LEN):
+    """
+    用 NumPy 一次組出所有口味的輸入張量
+    回傳 (X, scale, min_)：X 形狀 (flavor, seq_len, features)，scale/min_ 形狀 (flavor, features+1)
+    欄位順序與 forecast_next_sales 相同：rainfall, temperature, weekday, sales
+    """
+    flavors = list(flavors)
+    cols = []
+    for flavor in flavors:
+        cols += [f'rainfall_{flavor}', f'temperature_{flavor}', f'weekday_{flavor}', f'sales_{flavor}']
+    n_cols = 4
+
+    window = pivot_df[cols].to_numpy(dtype=np.float64)[-seq_len:]          # (seq_len, F*4)
+    window = window.reshape(seq_len, len(flavors), n_cols).transpose(1, 0, 2)  # (F, seq_len, 4)
+
+    # MinMaxScaler.transform 就是 X * scale_ + min_，整批一起算
+    scale = np.ones((len(flavors), n_cols))
+    min_ = np.zeros((len(flavors), n_cols))
+    scaled = np.empty_like(window)
+    for i, flavor in enumerate(flavors):
+        scaler = scalers[flavor]
+        if hasattr(scaler, "scale_") and hasattr(scaler, "min_") and not getattr(scaler, "clip", False):
+            scale[i], min_[i] = scaler.scale_, scaler.min_
+        else:
+            scaled[i] = scaler.transform(window[i])
+            scale[i] = np.nan  # 標記：這個口味已自行 transform
+    vec = ~np.isnan(scale[:, 0])
+    scaled[vec] = window[vec] * scale[vec, None, :] + min_[vec, None, :]
+
+    return scaled[:, :, :-1], scale, min_
+
+
+def _architecture_key(model):
+    try:
+        return (tuple(model.input_shape), tuple(w.shape for w in model.get_weights()))
+    except Exception:
+        return ("model", id(model))
+
+
+def _stacked_model(flavors, models):
+    """同架構的多個口味模型包成一個多輸入 / 多輸出的模型，只呼叫一次 predict"""
+    key = tuple(flavors)
+    ids = tuple(id(models[f]) for f in flavors)
+    cached = _stacked_models.get(key)
+    if cached and cached[0] == ids:
+        return cached[1]
+
+    if all(isinstance(models[f], numpy_lstm.NumpySequential) for f in flavors):
+        stacked = numpy_lstm.StackedNumpySequential([models[f] for f in flavors])
+        _stacked_models[key] = (ids, stacked)
+        return stacked
+
+    import keras  # 只有真的用 Keras 模型時才匯入
+
+    inputs = [keras.Input(shape=tuple(models[f].input_shape[1:])) for f in flavors]
+    outputs = [models[f](inp) for f, inp in zip(flavors, inputs)]
+    stacked = keras.Model(inputs=inputs, outputs=outputs)
+    _stacked_models[key] = (ids, stacked)
+    return stacked
+
+
+def _predict_grouped(flavors, models, X):
+    """回傳 (flavor, pred_days) 的 scaled 預測；同架構的口味合併成一次呼叫"""
+    groups = {}
+    for i, flavor in enumerate(flavors):
+        groups.setdefault(_architecture_key(models[flavor]), []).append(i)
+
+    y_scaled = [None] * len(flavors)
+    for idxs in groups.values():
+        group_flavors = [flavors[i] for i in idxs]
+        if len(idxs) > 1:
+            try:
+                stacked = _stacked_model(group_flavors, models)
+                outs = stacked.predict_on_batch([X[i:i + 1] for i in idxs])
+                for i, out in zip(idxs, outs):
+                    y_scaled[i] = np.asarray(out).reshape(-1)
+                continue
+            except Exception as e:
+                print(f"⚠️ 合併模型失敗，改為逐一預測：{e}")
+        for i in idxs:
+            model = models[flavors[i]]
+            if hasattr(model, "predict_on_batch"):
+                out = model.predict_on_batch(X[i:i + 1])
+            else:
+                out = model.predict(X[i:i + 1], verbose=0)
+            y_scaled[i] = np.asarray(out).reshape(-1)
+    return np.stack(y_scaled)
+
+
+def forecast_all_sales(flavors, pivot_df, models, scalers, future_weather, seq_len=SEQ_LEN, pred_days=PRED_DAYS):
+    """
+    forecast_next_sales 的批次版：回傳 {flavor: 未來 pred_days 天預測（round 1）}
+    只處理 models / scalers 都有的口味。
+    future_weather 與 forecast_next_sales 相同只作介面保留：模型輸入取最近 seq_len 天的歷史資料。
+    """
+    flavors = [f for f in flavors if models.get(f) is not None and scalers.get(f) is not None]
+    if not flavors:
+        return {}
+
+    X, scale, min_ = build_forecast_inputs(flavors, pivot_df, scalers, seq_len)
+    y_scaled = _predict_grouped(flavors, models, X)[:, :pred_days]
+
+    result = {}
+    for i, flavor in enumerate(flavors):
+        if np.isnan(scale[i, -1]):
+            dummy = np.zeros((pred_days, scale.shape[1]))
+            dummy[:, -1] = y_scaled[i]
+            y_inv = scalers[flavor].inverse_transform(dummy)[:, -1]
+        else:
+            y_inv = (y_scaled[i] - min_[i, -1]) / scale[i, -1]
+        result[flavor] = y_inv.round(1)
+    return result
+
 # ✅ CLI 測試入口
 if __name__ == '__main__':
     models, scalers, pivot_df, flavors = load_models_and_data()
@@ -0,0 +1,243 @@
+# tool/model_registry.py
+"""
+LSTM 模型 / scaler 常駐快取（每個 worker 只載入一次）
+
+- get(flavor)：第一次用到才載入（lazy）；warm_up() 可在啟動時預先全部載入
+- reload_if_changed()：比對 models/ 內檔案的 mtime/size，有變動的口味才重新載入
+- stats()：回報每個口味的載入時間、權重大小與載入前後 RSS 差
+- 預設用純 NumPy 推論（models/*_lstm.npz，由 tool/export_numpy_models.py 匯出），
+  worker 不必匯入 TensorFlow；沒有 .npz 的口味或 INFERENCE_BACKEND=keras 才載入 .h5
+"""
+import os
+import json
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import joblib
+
+try:
+    from tool import numpy_lstm
+except ImportError:
+    import numpy_lstm  # 直接在 tool/ 底下執行 CLI 時
+
+MODEL_DIR = "models"
+
+# ✅ 檔名對照：Firebase名稱 → 模型資料夾名稱
+FLAVOR_FILE_MAP = {
+    "珍珠鮮奶油": "珍珠奶油",
+    "黑芝麻鮮奶油": "黑芝麻奶油",
+    # 其他口味就直接用自己名字
+}
+
+# numpy：優先用匯出的 .npz；keras：一律載入 .h5（需要 TensorFlow）
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "numpy").lower()
+
+# reload_if_changed() 最短檢查間隔（秒），避免每個 request 都 stat 一輪
+RELOAD_CHECK_INTERVAL = float(os.getenv("MODEL_RELOAD_CHECK_SECONDS", "30"))
+
+_entries: Dict[str, Dict[str, Any]] = {}
+_flavor_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+_last_reload_check = 0.0
+
+
+def model_paths(flavor: str) -> Tuple[str, str]:
+    mapped_name = FLAVOR_FILE_MAP.get(flavor, flavor)
+    return f"{MODEL_DIR}/{mapped_name}_model.h5", f"{MODEL_DIR}/{mapped_name}_scaler.pkl"
+
+
+def numpy_model_path(flavor: str) -> str:
+    mapped_name = FLAVOR_FILE_MAP.get(flavor, flavor)
+    return f"{MODEL_DIR}/{mapped_name}_lstm.npz"
+
+
+def _file_signature(*paths: str) -> Optional[Tuple[Tuple[int, int], ...]]:
+    sig = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            return None
+        sig.append((st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def _current_rss_bytes() -> Optional[int]:
+    """目前行程 RSS（Linux /proc；其他平台回 None）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+
+def _flavor_lock(flavor: str) -> threading.Lock:
+    with _lock:
+        return _flavor_locks.setdefault(flavor, threading.Lock())
+
+
+def _load_keras_model(model_path: str):
+    from tensorflow.keras.models import load_model  # 延後匯入：真的要載 Keras 模型時才付 TensorFlow 的成本
+    return load_model(model_path, compile=False)
+
+
+def _load_entry(flavor: str) -> Optional[Dict[str, Any]]:
+    h5_path, scaler_path = model_paths(flavor)
+    npz_path = numpy_model_path(flavor)
+
+    backend = "keras"
+    model_path = h5_path
+    if INFERENCE_BACKEND == "numpy":
+        if os.path.exists(npz_path):
+            backend, model_path = "numpy", npz_path
+        else:
+            print(f"⚠️ 找不到 {npz_path}，{flavor} 改用 Keras 模型（請執行 tool/export_numpy_models.py）")
+
+    signature = _file_signature(model_path, scaler_path)
+    if signature is None:
+        print(f"⚠️ 缺少模型或 scaler 檔案：{model_path} / {scaler_path}")
+        return None
+
+    rss_before = _current_rss_bytes()
+    t0 = time.perf_counter()
+    try:
+        if backend == "numpy":
+            model = numpy_lstm.NumpySequential.load(model_path)
+        else:
+            model = _load_keras_model(model_path)
+        scaler = joblib.load(scaler_path)
+    except Exception as e:
+        print(f"❌ 載入失敗：{flavor} → {str(e)}")
+        return None
+    load_seconds = time.perf_counter() - t0
+    rss_after = _current_rss_bytes()
+
+    try:
+        param_bytes = int(sum(w.nbytes for w in model.get_weights()))
+    except Exception:
+        param_bytes = None
+
+    print(f"✅ 成功載入模型與 scaler：{flavor}（{backend}：{model_path}，{load_seconds:.2f}s）")
+    return {
+        "model": model,
+        "backend": backend,
+        "scaler": scaler,
+        "model_path": model_path,
+        "scaler_path": scaler_path,
+        "signature": signature,
+        "loaded_at": time.time(),
+        "load_seconds": load_seconds,
+        "param_bytes": param_bytes,
+        "rss_delta_bytes": (rss_after - rss_before) if (rss_before is not None and rss_after is not None) else None,
+    }
+
+
+def model_version(flavors: Iterable[str]) -> str:
+    """
+    目前會被使用的模型檔案版本（路徑 + mtime/size）的雜湊，不需要先載入模型；
+    給預測快取當 key，模型重新訓練 / 匯出後 key 自然改變。
+    已載入的模型跟檔案對不上時先丟掉快取（不等 reload_if_changed 的檢查間隔），
+    確保新 key 底下的預測一定是新模型算的
+    """
+    parts = []
+    stale = False
+    for flavor in sorted(flavors):
+        h5_path, scaler_path = model_paths(flavor)
+        npz_path = numpy_model_path(flavor)
+        model_path = npz_path if (INFERENCE_BACKEND == "numpy" and os.path.exists(npz_path)) else h5_path
+        signature = _file_signature(model_path, scaler_path)
+        entry = _entries.get(flavor)
+        if entry is not None and (entry["model_path"], entry["signature"]) != (model_path, signature):
+            stale = True
+        parts.append([flavor, model_path, signature])
+    if stale:
+        reload_if_changed(force=True)
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def get(flavor: str) -> Optional[Dict[str, Any]]:
+    """回傳 {"model", "scaler", ...}；檔案不存在或載入失敗回 None"""
+    entry = _entries.get(flavor)
+    if entry is not None:
+        return entry
+    with _flavor_lock(flavor):
+        entry = _entries.get(flavor)
+        if entry is None:
+            entry = _load_entry(flavor)
+            if entry is not None:
+                _entries[flavor] = entry
+    return entry
+
+
+def get_models(flavors: Iterable[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """回傳 (models, scalers)，只包含成功載入的口味"""
+    models, scalers = {}, {}
+    for flavor in flavors:
+        entry = get(flavor)
+        if entry is not None:
+            models[flavor] = entry["model"]
+            scalers[flavor] = entry["scaler"]
+    return models, scalers
+
+
+def warm_up(flavors: Iterable[str]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    models, _ = get_models(flavors)
+    print(f"🔥 模型預熱完成：{len(models)} 個，耗時 {time.perf_counter() - t0:.2f}s")
+    return stats()
+
+
+def reload(flavor: Optional[str] = None) -> None:
+    """丟掉快取，下次 get() 重新載入；flavor=None 代表全部"""
+    with _lock:
+        if flavor is None:
+            _entries.clear()
+        else:
+            _entries.pop(flavor, None)
+
+
+def reload_if_changed(force: bool = False) -> list:
+    """
+    熱更新掛勾：models/ 內檔案被覆蓋（重新訓練）時，丟掉對應口味的快取。
+    回傳被丟掉的口味清單；預設最多每 RELOAD_CHECK_INTERVAL 秒檢查一次。
+    """
+    global _last_reload_check
+    now = time.monotonic()
+    if not force and (now - _last_reload_check) < RELOAD_CHECK_INTERVAL:
+        return []
+    _last_reload_check = now
+
+    changed = []
+    for flavor, entry in list(_entries.items()):
+        npz_appeared = (INFERENCE_BACKEND == "numpy" and entry["backend"] == "keras"
+                        and os.path.exists(numpy_model_path(flavor)))
+        if npz_appeared or _file_signature(entry["model_path"], entry["scaler_path"]) != entry["signature"]:
+            changed.append(flavor)
+            reload(flavor)
+    if changed:
+        print(f"♻️ 偵測到模型檔案變動，重新載入：{changed}")
+    return changed
+
+
+def stats() -> Dict[str, Any]:
+    flavors = {}
+    for flavor, entry in _entries.items():
+        flavors[flavor] = {
+            "backend": entry["backend"],
+            "model_path": entry["model_path"],
+            "loaded_at": entry["loaded_at"],
+            "load_seconds": round(entry["load_seconds"], 4),
+            "param_bytes": entry["param_bytes"],
+            "rss_delta_bytes": entry["rss_delta_bytes"],
+        }
+    return {
+        "inference_backend": INFERENCE_BACKEND,
+        "loaded_count": len(flavors),
+        "total_load_seconds": round(sum(f["load_seconds"] for f in flavors.values()), 4),
+        "rss_bytes": _current_rss_bytes(),
+        "flavors": flavors,
+    }
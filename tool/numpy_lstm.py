@@ -0,0 +1,180 @@
+# tool/numpy_lstm.py
+"""
+純 NumPy 的 LSTM 推論（不需 TensorFlow）
+
+train_and_save_models.build_model 的架構只有 LSTM → Dropout → LSTM → Dropout → Dense，
+推論時 Dropout 不作用，所以只要把 Keras 權重匯出成 .npz 就能用 NumPy 跑同樣的前向傳播。
+- export_keras_model(model, path)：Keras 模型 → .npz（匯出時才需要 TensorFlow）
+- NumpySequential.load(path)：讀 .npz，提供 predict / predict_on_batch
+- StackedNumpySequential：同架構的多個口味權重疊成一組，一次算完所有口味
+"""
+import json
+from typing import Any, Dict, List
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+_ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0.0),
+    "tanh": np.tanh,
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "hard_sigmoid": lambda x: np.clip(0.2 * x + 0.5, 0.0, 1.0),
+}
+
+
+def _activation(name: str):
+    if name not in _ACTIVATIONS:
+        raise ValueError(f"不支援的 activation：{name}")
+    return _ACTIVATIONS[name]
+
+
+# =========================
+# 匯出（需要 Keras 模型物件）
+# =========================
+def export_keras_model(model, path: str) -> Dict[str, Any]:
+    """把 Keras Sequential（LSTM / Dense / Dropout）匯出成 .npz，回傳層設定"""
+    layers: List[Dict[str, Any]] = []
+    arrays: Dict[str, np.ndarray] = {}
+
+    for layer in model.layers:
+        kind = type(layer).__name__
+        cfg = layer.get_config()
+        if kind in ("Dropout", "InputLayer"):
+            continue
+        if kind == "LSTM":
+            if cfg.get("go_backwards") or cfg.get("stateful"):
+                raise ValueError(f"{layer.name}：不支援 go_backwards / stateful LSTM")
+            spec = {
+                "type": "lstm",
+                "units": int(cfg["units"]),
+                "activation": cfg.get("activation", "tanh"),
+                "recurrent_activation": cfg.get("recurrent_activation", "sigmoid"),
+                "return_sequences": bool(cfg.get("return_sequences", False)),
+            }
+            names = ("kernel", "recurrent_kernel", "bias")
+        elif kind == "Dense":
+            spec = {"type": "dense", "units": int(cfg["units"]), "activation": cfg.get("activation", "linear")}
+            names = ("kernel", "bias")
+        else:
+            raise ValueError(f"{layer.name}：不支援的層類型 {kind}")
+
+        weights = layer.get_weights()
+        if len(weights) != len(names):
+            raise ValueError(f"{layer.name}：權重數量不符（use_bias=False 尚未支援）")
+        idx = len(layers)
+        for name, w in zip(names, weights):
+            arrays[f"l{idx}_{name}"] = np.asarray(w, dtype=np.float32)
+        _activation(spec["activation"])
+        if spec["type"] == "lstm":
+            _activation(spec["recurrent_activation"])
+        layers.append(spec)
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "input_shape": [None if d is None else int(d) for d in model.input_shape],
+        "layers": layers,
+    }
+    np.savez(path, __meta__=np.array(json.dumps(meta)), **arrays)
+    return meta
+
+
+# =========================
+# 前向傳播（第 0 軸 = 口味，單一模型就是 1）
+# =========================
+def _lstm_forward(x, kernel, recurrent_kernel, bias, spec):
+    # x: (F, B, T, in)；kernel: (F, in, 4u)；recurrent_kernel: (F, u, 4u)；bias: (F, 4u)
+    act = _activation(spec["activation"])
+    rec_act = _activation(spec["recurrent_activation"])
+    units = spec["units"]
+    F, B, T, _ = x.shape
+
+    # 輸入投影一次算完所有時間步，迴圈內只剩 recurrent 部分
+    x_proj = np.einsum("fbti,fij->fbtj", x, kernel) + bias[:, None, None, :]
+    h = np.zeros((F, B, units), dtype=x.dtype)
+    c = np.zeros((F, B, units), dtype=x.dtype)
+    outputs = []
+    for t in range(T):
+        z = x_proj[:, :, t, :] + np.einsum("fbu,fuj->fbj", h, recurrent_kernel)
+        # Keras gate 順序：i, f, c, o
+        i = rec_act(z[..., :units])
+        f = rec_act(z[..., units:2 * units])
+        g = act(z[..., 2 * units:3 * units])
+        o = rec_act(z[..., 3 * units:])
+        c = f * c + i * g
+        h = o * act(c)
+        if spec["return_sequences"]:
+            outputs.append(h)
+    return np.stack(outputs, axis=2) if spec["return_sequences"] else h
+
+
+def _dense_forward(x, kernel, bias, spec):
+    act = _activation(spec["activation"])
+    if x.ndim == 4:
+        y = np.einsum("fbti,fij->fbtj", x, kernel) + bias[:, None, None, :]
+    else:
+        y = np.einsum("fbi,fij->fbj", x, kernel) + bias[:, None, :]
+    return act(y)
+
+
+def _forward(layers, weights, x):
+    for spec, w in zip(layers, weights):
+        if spec["type"] == "lstm":
+            x = _lstm_forward(x, w["kernel"], w["recurrent_kernel"], w["bias"], spec)
+        else:
+            x = _dense_forward(x, w["kernel"], w["bias"], spec)
+    return x
+
+
+class NumpySequential:
+    """介面對齊 Keras：input_shape / get_weights() / predict() / predict_on_batch()"""
+
+    def __init__(self, meta: Dict[str, Any], weights: List[Dict[str, np.ndarray]]):
+        self.meta = meta
+        self.layers = meta["layers"]
+        self.input_shape = tuple(meta["input_shape"])
+        self._weights = weights
+
+    @classmethod
+    def load(cls, path: str) -> "NumpySequential":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["__meta__"]))
+            if meta.get("format_version") != FORMAT_VERSION:
+                raise ValueError(f"{path}：格式版本不符 {meta.get('format_version')}")
+            weights = []
+            for idx, spec in enumerate(meta["layers"]):
+                names = ("kernel", "recurrent_kernel", "bias") if spec["type"] == "lstm" else ("kernel", "bias")
+                weights.append({n: np.array(data[f"l{idx}_{n}"]) for n in names})
+        return cls(meta, weights)
+
+    def get_weights(self) -> List[np.ndarray]:
+        return [w[n] for w in self._weights for n in w]
+
+    def predict_on_batch(self, x) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        stacked = [{n: a[None, ...] for n, a in w.items()} for w in self._weights]
+        return _forward(self.layers, stacked, x[None, ...])[0]
+
+    def predict(self, x, verbose=0) -> np.ndarray:
+        return self.predict_on_batch(x)
+
+
+class StackedNumpySequential:
+    """多個同架構 NumpySequential 疊成一組；predict_on_batch 接受 / 回傳 list（同 Keras 多輸入多輸出）"""
+
+    def __init__(self, models: List[NumpySequential]):
+        if not models:
+            raise ValueError("models 不可為空")
+        self.layers = models[0].layers
+        for m in models[1:]:
+            if m.layers != self.layers:
+                raise ValueError("模型架構不一致，無法合併")
+        self._weights = [
+            {n: np.stack([m._weights[i][n] for m in models]) for n in models[0]._weights[i]}
+            for i in range(len(self.layers))
+        ]
+
+    def predict_on_batch(self, xs) -> List[np.ndarray]:
+        x = np.stack([np.asarray(a, dtype=np.float32) for a in xs])  # (F, B, T, in)
+        return list(_forward(self.layers, self._weights, x))